@@ -0,0 +1,12 @@
+"""
+Copyright 2023-present Martin Becke
+# SPDX-License-Identifier: Apache-2.0
+
+Shared helpers for the rn-practice topologies and lab servers.
+
+The scripts in topo01/, topo02/, topo-base/ ... are started directly, so they
+add the repository root to sys.path before importing from here:
+
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from rnlib import httpserve
+"""
@@ -0,0 +1,412 @@
+"""
+Copyright 2023-present Martin Becke
+# SPDX-License-Identifier: Apache-2.0
+
+Network state checkpoints.
+
+A Checkpoint captures the state a run built up on top of net.start() on
+every node: interface addresses, MTU and link state, the routes of all
+tables (also the ones routing daemons installed), a set of sysctls, the
+netem settings of the qdiscs and, on FRR routers, the running-config.
+It is saved as gzip'ed JSON and restored into a freshly built network
+of the same topology:
+
+* addresses, links, routes: one 'ip -force -batch' per node and the
+  sysctls with one 'sysctl -p', through NetConfig (all nodes in parallel)
+* netem qdiscs: one 'tc -batch' per node
+* FRR: the running-config through 'vtysh -f'
+
+The kernel routes are back right away, so the network forwards as it
+did at capture time while the daemons (started with the restored config)
+re-establish their sessions in the background.
+
+    snap = Checkpoint.capture(net)
+    snap.save('converged.ckpt')
+    ...
+    net.start()
+    Checkpoint.load('converged.ckpt').restore(net)
+
+The qdiscs and classes of TCLinks come from the topology itself; other
+qdisc differences than netem are reported, not changed.
+"""
+
+import gzip
+import json
+import os
+import subprocess
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from mininet.log import debug, info
+
+from rnlib.netconf import NetConfig
+
+VERSION = 1
+WORKERS = 16
+SYSCTLS = (
+    'net.ipv4.ip_forward',
+    'net.ipv6.conf.all.forwarding',
+    'net.ipv4.conf.all.rp_filter',
+    'net.ipv4.conf.default.rp_filter',
+    'net.ipv6.conf.all.disable_ipv6',
+    'net.ipv4.icmp_echo_ignore_all',
+    'net.ipv4.tcp_congestion_control',
+)
+# route types and protocols 'ip route' shows but the kernel makes itself
+SKIP_ROUTE_TYPES = ('local', 'broadcast', 'anycast', 'multicast')
+SKIP_ROUTE_PROTOCOLS = ('kernel',)
+
+
+def _output(node, args, stdin=None):
+    "stdout of `args` run in `node` ('' if it cannot run)"
+    try:
+        proc = node.popen(args, stdin=subprocess.PIPE if stdin is not None else None,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError as error:
+        return str(error)
+    output, _ = proc.communicate(stdin.encode() if stdin is not None else None)
+    return output.decode(errors='replace')
+
+
+def _json(text):
+    try:
+        return json.loads(text or '[]')
+    except ValueError:
+        return []
+
+
+def _is_frr(node):
+    "FRR routers of topo03 (lib.topotest.Router)"
+    return hasattr(node, 'vtysh_cmd') and hasattr(node, 'daemons')
+
+
+def _capture_node(node, sysctls, frr):
+    "The state of one node as a JSON-ready dict"
+    state = OrderedDict()
+    links = OrderedDict()
+    addresses = OrderedDict()
+    for link in _json(_output(node, ['ip', '-json', 'address', 'show'])):
+        name = link['ifname']
+        links[name] = {'mtu': link.get('mtu'), 'up': 'UP' in link.get('flags', ()),
+                       'peer': link.get('link')}
+        addresses[name] = ['{}/{}'.format(addr['local'], addr['prefixlen'])
+                           for addr in link.get('addr_info', ())
+                           if addr.get('scope') == 'global']
+    state['links'] = links
+    state['addresses'] = addresses
+
+    routes = []
+    for family in ('-4', '-6'):
+        for route in _json(_output(node, ['ip', family, '-json', 'route', 'show', 'table', 'all'])):
+            if route.get('type') in SKIP_ROUTE_TYPES or route.get('table') == 'local' \
+                    or route.get('protocol') in SKIP_ROUTE_PROTOCOLS \
+                    or route.get('dst', '').startswith(('fe80:', 'ff00:')):
+                continue
+            route['family'] = family
+            routes.append(route)
+    state['routes'] = routes
+
+    values = OrderedDict()
+    lines = _output(node, ['sysctl', '-e'] + list(sysctls)).splitlines() if sysctls else ()
+    for line in lines:
+        key, sep, value = line.partition(' = ')
+        if sep:
+            values[key.strip()] = value.strip()
+    state['sysctl'] = values
+
+    state['qdiscs'] = [qdisc for qdisc in _json(_output(node, ['tc', '-json', 'qdisc', 'show']))
+                       if qdisc.get('dev') != 'lo']
+    if frr if frr is not None else _is_frr(node):
+        state['frr'] = _output(node, ['vtysh', '-c', 'show running-config'])
+    return state
+
+
+def _route_dst(route):
+    dst = route.get('dst', 'default')
+    if dst == 'default':
+        dst = '0.0.0.0/0' if route['family'] == '-4' else '::/0'
+    return dst
+
+
+def _route_key(route):
+    "What identifies a route in the kernel"
+    return (route['family'], _route_dst(route), str(route.get('table', 'main')),
+            route.get('metric'))
+
+
+def _route_line(route):
+    "'ip -batch' line replacing `route`"
+    dst = _route_dst(route)
+    parts = ['route', 'replace']
+    if route.get('type') not in (None, 'unicast'):
+        parts.append(route['type'])
+    parts.append(dst)
+    if route.get('nexthops'):
+        for nexthop in route['nexthops']:
+            parts.append('nexthop')
+            if nexthop.get('gateway'):
+                parts += ['via', nexthop['gateway']]
+            if nexthop.get('dev'):
+                parts += ['dev', nexthop['dev']]
+            if nexthop.get('weight'):
+                parts += ['weight', str(nexthop['weight'])]
+    else:
+        if route.get('gateway'):
+            parts += ['via', route['gateway']]
+        if route.get('dev'):
+            parts += ['dev', route['dev']]
+    if route.get('protocol'):
+        parts += ['proto', str(route['protocol'])]
+    if route.get('metric') is not None:
+        parts += ['metric', str(route['metric'])]
+    if route.get('table') not in (None, 'main'):
+        parts += ['table', str(route['table'])]
+    if route.get('prefsrc'):
+        parts += ['src', route['prefsrc']]
+    if 'onlink' in route.get('flags', ()):
+        parts.append('onlink')
+    return ' '.join(parts)
+
+
+def _netem_line(qdisc):
+    "'tc -batch' line setting a netem qdisc like `qdisc`"
+    options = qdisc.get('options', {})
+    parts = ['qdisc', 'change', 'dev', qdisc['dev']]
+    parts += ['root'] if qdisc.get('root') else ['parent', qdisc['parent']]
+    parts += ['handle', qdisc['handle'], 'netem']
+    if options.get('limit'):
+        parts += ['limit', str(options['limit'])]
+    delay = options.get('delay') or {}
+    if delay.get('delay'):
+        parts += ['delay', '{}us'.format(int(round(delay['delay'] * 1e6)))]
+        if delay.get('jitter'):
+            parts.append('{}us'.format(int(round(delay['jitter'] * 1e6))))
+    loss = options.get('loss-random') or {}
+    if loss.get('loss'):
+        parts += ['loss', '{}%'.format(loss['loss'] * 100)]
+    return ' '.join(parts)
+
+
+def _qdisc_del_line(qdisc):
+    "'tc -batch' line deleting `qdisc`"
+    if qdisc.get('root'):
+        return 'qdisc del dev {} root'.format(qdisc['dev'])
+    if qdisc['kind'] in ('ingress', 'clsact'):
+        return 'qdisc del dev {} {}'.format(qdisc['dev'], qdisc['kind'])
+    return 'qdisc del dev {} parent {} handle {}'.format(
+        qdisc['dev'], qdisc['parent'], qdisc['handle'])
+
+
+def _prune_qdisc_lines(shown, qdiscs):
+    "'tc -batch' lines deleting the qdiscs of `shown` that are not in `qdiscs`"
+    wanted = set(_qdisc_key(qdisc) for qdisc in qdiscs)
+    # handles deleted per device, their children go with them
+    deleted = {}
+    lines = []
+    for qdisc in shown:
+        if _qdisc_key(qdisc) in wanted:
+            continue
+        dev = qdisc['dev']
+        parent = (qdisc.get('parent') or '').split(':')[0] + ':'
+        if parent not in deleted.get(dev, ()):
+            lines.append(_qdisc_del_line(qdisc))
+        deleted.setdefault(dev, set()).add(qdisc.get('handle'))
+    return lines
+
+
+def _qdisc_key(qdisc):
+    return (qdisc.get('dev'), qdisc.get('handle'), qdisc.get('kind'))
+
+
+class Checkpoint(object):
+    "Captured state of the nodes of a network"
+
+    def __init__(self, nodes, created=None):
+        # node name -> state dict (see _capture_node)
+        self.nodes = nodes
+        self.created = created or time.time()
+
+    @classmethod
+    def capture(cls, net, nodes=None, sysctls=SYSCTLS, frr=None, workers=WORKERS):
+        """
+        Capture the state of `nodes` (default: net.hosts, the routers are
+        hosts too) in parallel. `frr` forces the running-config capture
+        on or off, by default it is taken from topo03's FRR routers.
+        """
+        nodes = list(nodes if nodes is not None else net.hosts)
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=min(workers, max(1, len(nodes)))) as pool:
+            states = list(pool.map(lambda node: _capture_node(node, sysctls, frr), nodes))
+        debug('*** checkpoint of {} nodes took {:.2f} seconds\n'.format(
+            len(nodes), time.time() - start_time))
+        return cls(OrderedDict((node.name, state) for node, state in zip(nodes, states)))
+
+    def to_dict(self):
+        return OrderedDict([('version', VERSION), ('created', self.created),
+                            ('nodes', self.nodes)])
+
+    def save(self, path):
+        "Write the checkpoint to `path` (gzip'ed JSON)"
+        tmp = '{}.{}'.format(path, os.getpid())
+        with gzip.open(tmp, 'wt') as f:
+            json.dump(self.to_dict(), f, separators=(',', ':'))
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rt') as f:
+            data = json.load(f, object_pairs_hook=OrderedDict)
+        if data.get('version') != VERSION:
+            raise ValueError('{}: checkpoint version {}, expected {}'.format(
+                path, data.get('version'), VERSION))
+        return cls(data['nodes'], data.get('created'))
+
+    def _restore_ip(self, net, conf):
+        "Queue the links, addresses, routes and sysctls in `conf`"
+        for name, state in self.nodes.items():
+            node = net[name]
+            for intf, link in state['links'].items():
+                if intf == 'lo' or intf not in node.intfNames():
+                    continue
+                line = 'link set dev {} {}'.format(intf, 'up' if link['up'] else 'down')
+                if link.get('mtu'):
+                    line += ' mtu {}'.format(link['mtu'])
+                conf.ip(node, line)
+            for intf, cidrs in state['addresses'].items():
+                if intf != 'lo' and intf not in node.intfNames():
+                    continue
+                for cidr in cidrs:
+                    conf.ip(node, 'address replace {} dev {}'.format(cidr, intf))
+            # direct routes first, the gateways of the others depend on them
+            routes = sorted(state['routes'], key=lambda route: bool(
+                route.get('gateway') or route.get('nexthops')))
+            for route in routes:
+                conf.ip(node, _route_line(route))
+            for key, value in state['sysctl'].items():
+                conf.sysctl(node, key, value)
+
+    def _prune_ip(self, net, conf, workers):
+        """
+        Queue deletes of the routes, addresses and links added since the
+        capture (routes first, deleting an address may take its routes)
+        """
+        names = list(self.nodes)
+        current = Checkpoint.capture(net, [net[name] for name in names], sysctls=(),
+                                     frr=False, workers=workers)
+        for name in names:
+            node = net[name]
+            state = self.nodes[name]
+            now = current.nodes[name]
+            gone = set(intf for intf in now['links']
+                       if intf != 'lo' and intf not in state['links'])
+            keep = set(_route_key(route) for route in state['routes'])
+            for route in now['routes']:
+                devs = set(nexthop.get('dev') for nexthop in route.get('nexthops', ()))
+                devs.add(route.get('dev'))
+                if _route_key(route) in keep or devs & gone:
+                    continue
+                family, dst, table, metric = _route_key(route)
+                line = 'route del {}'.format(dst)
+                if metric is not None:
+                    line += ' metric {}'.format(metric)
+                conf.ip(node, '{} table {}'.format(line, table))
+            for intf, cidrs in now['addresses'].items():
+                if intf in gone:
+                    continue
+                keep = set(state['addresses'].get(intf, ()))
+                for cidr in cidrs:
+                    if cidr not in keep:
+                        conf.ip(node, 'address del {} dev {}'.format(cidr, intf))
+            deleted = set()
+            for intf in sorted(gone):
+                # deleting one end of a veth pair takes the other with it
+                if now['links'][intf].get('peer') in deleted:
+                    continue
+                deleted.add(intf)
+                conf.ip(node, 'link delete dev {}'.format(intf))
+
+    def _restore_tc(self, node, qdiscs, prune=False):
+        """
+        Set the netem qdiscs of `node`, with `prune` delete the qdiscs
+        that were added since the capture. Returns the differences left.
+        """
+        def show():
+            return [qdisc for qdisc in _json(_output(node, ['tc', '-json', 'qdisc', 'show']))
+                    if qdisc.get('dev') != 'lo']
+
+        shown = show()
+        problems = []
+        if prune:
+            lines = _prune_qdisc_lines(shown, qdiscs)
+            if lines:
+                output = _output(node, ['tc', '-force', '-batch', '-'], '\n'.join(lines) + '\n')
+                if output.strip():
+                    problems.append(output.strip())
+                shown = show()
+        current = dict((_qdisc_key(qdisc), qdisc) for qdisc in shown)
+        lines = []
+        for qdisc in qdiscs:
+            now = current.get(_qdisc_key(qdisc))
+            if now is None:
+                problems.append('missing qdisc {kind} {handle} on {dev}'.format(**qdisc))
+            elif now.get('options') != qdisc.get('options'):
+                if qdisc['kind'] == 'netem':
+                    lines.append(_netem_line(qdisc))
+                else:
+                    problems.append('qdisc {kind} {handle} on {dev} differs'.format(**qdisc))
+        if lines:
+            output = _output(node, ['tc', '-force', '-batch', '-'], '\n'.join(lines) + '\n')
+            if output.strip():
+                problems.append(output.strip())
+        return problems
+
+    def _restore_frr(self, node, config):
+        "Apply the running-config through vtysh"
+        fd, path = tempfile.mkstemp(prefix='rn-checkpoint-', suffix='.conf')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(config)
+            os.chmod(path, 0o644)
+            output = _output(node, ['vtysh', '-f', path])
+        finally:
+            os.unlink(path)
+        return [line.strip() for line in output.splitlines()
+                if 'Unknown command' in line or 'Error' in line]
+
+    def restore(self, net, frr=True, prune=False, workers=WORKERS):
+        """
+        Restore the captured state into `net`. With `prune` the routes,
+        addresses, links and qdiscs that were added after the capture are
+        deleted first, to reset a network that was in use. Returns a dict node name -> list
+        of problems for the nodes where something did not apply.
+        """
+        start_time = time.time()
+        problems = OrderedDict()
+        conf = NetConfig()
+        if prune:
+            self._prune_ip(net, conf, workers)
+        self._restore_ip(net, conf)
+        for name, output in conf.apply().items():
+            problems.setdefault(name, []).append(output.strip())
+
+        def rest(name):
+            state = self.nodes[name]
+            node = net[name]
+            found = self._restore_tc(node, state['qdiscs'], prune)
+            if frr and state.get('frr'):
+                found += self._restore_frr(node, state['frr'])
+            return found
+
+        names = list(self.nodes)
+        with ThreadPoolExecutor(max_workers=min(workers, max(1, len(names)))) as pool:
+            for name, found in zip(names, pool.map(rest, names)):
+                if found:
+                    problems.setdefault(name, []).extend(found)
+        info('*** restored {} nodes in {:.2f} seconds\n'.format(
+            len(names), time.time() - start_time))
+        for name, found in problems.items():
+            debug('*** {}: restore: {}\n'.format(name, '; '.join(found)))
+        return problems
@@ -0,0 +1,359 @@
+"""
+Copyright 2023-present Martin Becke
+# SPDX-License-Identifier: Apache-2.0
+
+Run manifest and leftover-state reaper.
+
+'mn -c' tears down everything that looks like Mininet on the host, one
+command at a time, and the start scripts add several killall calls on top.
+Instead, a topology records what its run created in a manifest right after
+net.start():
+
+* the node shells (process group and network namespace)
+* the root namespace interfaces (switch ports) and OVS bridges
+* pid files and directories the run writes
+
+reap() removes exactly that, the independent steps in parallel. The
+processes get SIGTERM and, if still alive after a short grace period,
+SIGKILL; this includes daemons that left the node shell (zebra --daemon)
+because every process in the run's namespaces is signalled.
+
+    cleanup.reap_previous('topo03')
+    net.start()
+    manifest = cleanup.RunManifest.record('topo03', net, dirs=['/tmp/topotests'])
+    ...
+    net.stop()
+    manifest.reap(keep_files=True)
+
+The start scripts call it as 'python3 ../rnlib/cleanup.py --no-fallback
+topo03' before and after a run (catching what a crashed run left). A
+clean run reaps and deletes its manifest, so a missing manifest means
+there is nothing to do; 'mn -c' only runs without --no-fallback.
+
+Since the reaper runs as root, the manifests live in a private RUN_DIR
+(mode 0700) and are only used if they belong to the current user and
+nobody else can write them. Directories and pid files are only removed
+below LOG_ROOT and RUN_DIR. Namespace inodes are reused by the kernel,
+so of the processes in a recorded namespace only those carrying the
+run's RN_RUN_ID in their environment (inherited from the topology
+script by the node shells and daemons) are signalled.
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import signal
+import stat
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+RUN_DIR = os.environ.get('RN_RUN_DIR', '/run/rn-practice')
+# Directories (logs) a manifest may have removed are below this
+LOG_ROOT = os.environ.get('RN_LOG_ROOT', '/tmp/topotests')
+# Marks the processes of this run, the node shells inherit it
+RUN_ID = os.environ.setdefault('RN_RUN_ID', uuid.uuid4().hex)
+# Seconds to wait for SIGTERM before SIGKILL
+GRACE = 0.5
+
+
+def _proc_starttime(pid):
+    "Start time of `pid` in clock ticks, None if there is no such process"
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # the command name may contain spaces, fields start after ')'
+    return int(stat.rsplit(')', 1)[1].split()[19])
+
+
+def _netns(pid):
+    "Network namespace id of `pid` ('net:[4026531993]'), None if unknown"
+    try:
+        return os.readlink('/proc/{}/ns/net'.format(pid))
+    except OSError:
+        return None
+
+
+def _run_id(pid):
+    "RN_RUN_ID in the environment of `pid`, None if it has none"
+    try:
+        with open('/proc/{}/environ'.format(pid), 'rb') as f:
+            environ = f.read()
+    except OSError:
+        return None
+    for item in environ.split(b'\0'):
+        if item.startswith(b'RN_RUN_ID='):
+            return item[len(b'RN_RUN_ID='):].decode(errors='replace')
+    return None
+
+
+def _check_private(path, st):
+    "Raise PermissionError unless `path` (stat `st`) is ours and only we can write it"
+    if st.st_uid != os.getuid() or st.st_mode & 0o022 or stat.S_ISLNK(st.st_mode):
+        raise PermissionError('{} is not owned by uid {} or writable by others'.format(
+            path, os.getuid()))
+
+
+def private_dir(path):
+    "`path`, created with mode 0700; PermissionError if it is not private"
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    _check_private(path, st)
+    if not stat.S_ISDIR(st.st_mode):
+        raise PermissionError('{} is not a directory'.format(path))
+    return path
+
+
+def run_dir():
+    "RUN_DIR, see private_dir()"
+    return private_dir(RUN_DIR)
+
+
+def _below(path, roots):
+    "True if `path` (symlinks resolved) is inside one of `roots`"
+    path = os.path.realpath(path)
+    for root in roots:
+        root = os.path.realpath(root)
+        if path != root and path.startswith(root.rstrip('/') + '/'):
+            return True
+    return False
+
+
+def _alive(pid):
+    "True unless `pid` is gone or a zombie"
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except OSError:
+        return False
+
+
+def _signal(pid, sig, group=False):
+    try:
+        if group:
+            os.killpg(pid, sig)
+        else:
+            os.kill(pid, sig)
+    except OSError:
+        pass
+
+
+class RunManifest(object):
+    "What one topology run created, stored as JSON in RUN_DIR/<name>.json"
+
+    def __init__(self, name, data=None):
+        self.name = name
+        self.path = os.path.join(RUN_DIR, '{}.json'.format(name))
+        self.data = data or {
+            'pid': os.getpid(),
+            'run_id': RUN_ID,
+            # [pid, starttime], signalled as process groups
+            'shells': [],
+            'namespaces': [],
+            'links': [],
+            'bridges': [],
+            'pidfiles': [],
+            'dirs': [],
+        }
+
+    @classmethod
+    def record(cls, name, net, pidfiles=(), dirs=()):
+        """
+        Record the nodes, switch ports and bridges of the started Mininet
+        `net` plus `pidfiles` (glob patterns) and `dirs`, and save it.
+        """
+        manifest = cls(name)
+        data = manifest.data
+        hostns = _netns(os.getpid())
+        for node in net.hosts + net.switches + net.controllers:
+            pid = getattr(node, 'pid', None)
+            if pid:
+                data['shells'].append([pid, _proc_starttime(pid)])
+                ns = _netns(pid)
+                if ns and ns != hostns and ns not in data['namespaces']:
+                    data['namespaces'].append(ns)
+        for switch in net.switches:
+            if not switch.inNamespace:
+                # only veth ends Mininet created, not attached hardware ports
+                data['links'].extend(intf.name for intf in switch.intfList()
+                                     if getattr(intf, 'link', None) is not None)
+            if 'OVS' in type(switch).__name__ or hasattr(switch, 'vsctl'):
+                data['bridges'].append(switch.name)
+        for path in dirs:
+            if not _below(path, [LOG_ROOT]):
+                raise ValueError('{} is not below {}'.format(path, LOG_ROOT))
+        data['pidfiles'].extend(pidfiles)
+        data['dirs'].extend(dirs)
+        manifest.save()
+        return manifest
+
+    @classmethod
+    def load(cls, name):
+        """
+        The saved manifest of `name`, None if there is none or if it (or
+        RUN_DIR) is not ours or writable by others
+        """
+        path = os.path.join(RUN_DIR, '{}.json'.format(name))
+        try:
+            _check_private(RUN_DIR, os.lstat(RUN_DIR))
+            fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+        except FileNotFoundError:
+            return None
+        except OSError as error:
+            sys.stderr.write('*** ignoring manifest {}: {}\n'.format(path, error))
+            return None
+        with os.fdopen(fd) as f:
+            try:
+                _check_private(path, os.fstat(f.fileno()))
+                return cls(name, json.load(f))
+            except (OSError, ValueError) as error:
+                sys.stderr.write('*** ignoring manifest {}: {}\n'.format(path, error))
+                return None
+
+    def save(self):
+        run_dir()
+        tmp = '{}.{}'.format(self.path, os.getpid())
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(tmp, self.path)
+
+    def _processes(self):
+        "pids to signal: (pid, is process group)"
+        result = []
+        for pid, starttime in self.data['shells']:
+            # a recycled pid has another start time
+            if starttime is not None and _proc_starttime(pid) == starttime:
+                result.append((pid, True))
+        namespaces = set(self.data['namespaces'])
+        hostns = _netns(os.getpid())
+        namespaces.discard(hostns)
+        run_id = self.data.get('run_id')
+        if namespaces and run_id:
+            for entry in os.listdir('/proc'):
+                # the inode of a namespace that is gone may be reused
+                if entry.isdigit() and _netns(entry) in namespaces \
+                        and _run_id(entry) == run_id:
+                    result.append((int(entry), False))
+        return result
+
+    def _kill(self):
+        procs = self._processes()
+        for pid, group in procs:
+            _signal(pid, signal.SIGTERM, group)
+        deadline = time.time() + GRACE
+        while time.time() < deadline and any(_alive(pid) for pid, _ in procs):
+            time.sleep(0.01)
+        for pid, group in procs:
+            if _alive(pid):
+                _signal(pid, signal.SIGKILL, group)
+        return len(procs)
+
+    def _links(self):
+        links = self.data['links']
+        if links:
+            batch = ''.join('link delete dev {}\n'.format(link) for link in links)
+            subprocess.run(['ip', '-force', '-batch', '-'], input=batch.encode(),
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return len(links)
+
+    def _bridges(self):
+        bridges = self.data['bridges']
+        if bridges:
+            cmd = ['ovs-vsctl']
+            for bridge in bridges:
+                cmd += ['--if-exists', 'del-br', bridge, '--']
+            try:
+                subprocess.run(cmd[:-1], stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+            except OSError:
+                pass
+        return len(bridges)
+
+    def _files(self):
+        count = 0
+        for pattern in self.data['pidfiles']:
+            for path in glob.glob(pattern):
+                if not _below(path, [LOG_ROOT, RUN_DIR]):
+                    continue
+                try:
+                    os.remove(path)
+                    count += 1
+                except OSError:
+                    pass
+        for path in self.data['dirs']:
+            if os.path.isdir(path) and _below(path, [LOG_ROOT]):
+                shutil.rmtree(path, ignore_errors=True)
+                count += 1
+        return count
+
+    def reap(self, keep_files=False):
+        """
+        Remove everything the run recorded, returns a dict step -> number
+        of things handled. The manifest is deleted afterwards. With
+        `keep_files` the pid files and directories (e.g. logs to look at)
+        stay and remain in the manifest for the next reap.
+        """
+        start_time = time.time()
+        steps = [('processes', self._kill), ('links', self._links),
+                 ('bridges', self._bridges)]
+        with ThreadPoolExecutor(max_workers=len(steps)) as pool:
+            futures = [(name, pool.submit(func)) for name, func in steps]
+            result = dict((name, future.result()) for name, future in futures)
+        if keep_files:
+            result['files'] = 0
+            for key in ('shells', 'namespaces', 'links', 'bridges'):
+                self.data[key] = []
+            self.save()
+        else:
+            # files last, the daemons may still write them while exiting
+            result['files'] = self._files()
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        result['seconds'] = time.time() - start_time
+        return result
+
+
+def reap_previous(name, fallback=False, keep_files=False):
+    """
+    Reap what a previous run of `name` left behind. Without a manifest,
+    run 'mn -c' if `fallback` is set. Returns the reap() result or None.
+    """
+    manifest = RunManifest.load(name)
+    if manifest is not None:
+        return manifest.reap(keep_files)
+    if fallback:
+        subprocess.run(['mn', '-c'], stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reap the leftovers of topology runs')
+    parser.add_argument('names', nargs='+', help='topology names, e.g. topo03')
+    parser.add_argument('--no-fallback', action='store_true',
+                        help="do not run 'mn -c' when there is no manifest")
+    parser.add_argument('--keep-files', action='store_true',
+                        help='keep pid files and directories (logs) until the next reap')
+    args = parser.parse_args()
+    for name in args.names:
+        result = reap_previous(name, fallback=not args.no_fallback,
+                               keep_files=args.keep_files)
+        if result is None:
+            print('{}: no manifest{}'.format(
+                name, '' if args.no_fallback else ", ran 'mn -c'"))
+        else:
+            print('{}: {processes} processes, {links} links, {bridges} bridges, '
+                  '{files} files in {seconds:.3f} seconds'.format(name, **result))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
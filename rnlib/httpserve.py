@@ -0,0 +1,652 @@
+"""
+Copyright 2023-present Martin Becke
+# SPDX-License-Identifier: Apache-2.0
+
+Serving engines for the lab web servers (topo01, topo02).
+
+    single   one connection at a time, the old socketserver.TCPServer
+    thread   fixed pool of worker threads fed from a bounded accept queue
+    asyncio  the event loop owns all (idle) keep-alive connections and
+             reads request heads; complete requests are handed to a
+             bounded pool of handler threads
+
+All engines speak HTTP/1.1 with keep-alive and keep the
+'Cache-Control: no-store' semantics of the original servers, so the
+TCLink bottlenecks and not the server limit what we measure.
+
+Regular files go out with socket.sendfile() (zero copy) on plain sockets
+and through a buffered copy on TLS sockets. Single byte ranges
+('Range: bytes=a-b', 'a-', '-n') are answered with 206 so clients can
+resume or fetch large objects like test30M.txt in parallel.
+
+Small hot files (index.html, attack.html) can be served from an in-memory
+LRU cache (--cache-size) with precomputed Content-Length/ETag headers and
+optional gzip variants (--gzip). Entries are keyed on path, mtime and
+size, so editing a file invalidates it. The default '--cache-control
+no-store' keeps the old headers for the cache-poisoning exercises,
+'revalidate' lets browsers keep a copy and revalidate it with the ETag.
+
+With an ssl.SSLContext (startHTTPsServer.py) the handshake runs in the
+worker thread, not in the accept loop. --processes N pre-forks N server
+processes that each bind the port with SO_REUSEPORT. The context is
+created before the fork, so all processes share the session ticket keys
+and a client can resume its session on whichever process it lands.
+"""
+
+import asyncio
+import collections
+import email.utils
+import gzip
+import http.server
+import io
+import os
+import queue
+import signal
+import socket
+import socketserver
+import ssl
+import stat
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+ENGINES = ('single', 'thread', 'asyncio')
+DEFAULT_ENGINE = 'thread'
+DEFAULT_WORKERS = 16
+# Seconds an idle keep-alive connection may wait for its next request
+KEEPALIVE_TIMEOUT = 5
+MAX_REQUEST_HEAD = 65536
+# Request bodies the asyncio engine buffers at most, larger ones get a 413
+MAX_REQUEST_BODY = 1024 * 1024
+# Chunk size of the buffered (TLS) copy path
+COPY_BUFSIZE = 256 * 1024
+CACHE_CONTROLS = ('no-store', 'revalidate')
+# Files larger than this are never cached, sendfile() is the better path
+CACHE_MAX_ENTRY = 1024 * 1024
+GZIP_TYPES = ('text/', 'application/javascript', 'application/json',
+              'application/xml', 'image/svg+xml')
+
+CachedFile = collections.namedtuple(
+    'CachedFile', 'key body gzbody ctype length gzlength etag lastmod')
+
+
+class ContentCache(object):
+    """
+    LRU cache of file contents bounded by `max_bytes` (bodies plus gzip
+    variants). Lookups cost one stat() of the file.
+    """
+
+    def __init__(self, max_bytes, max_entry=CACHE_MAX_ENTRY, compress=False):
+        self.max_bytes = max_bytes
+        self.max_entry = max_entry
+        self.compress = compress
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, guess_type):
+        """
+        Return the CachedFile for `path`, None if it is no regular file or
+        too large to be cached.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode) or st.st_size > self.max_entry:
+            return None
+        key = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.key == key:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        entry = self._load(path, key, st, guess_type(path))
+        if entry is None:
+            return None
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self.size -= self._cost(old)
+            self._entries[path] = entry
+            self.size += self._cost(entry)
+            while self.size > self.max_bytes and self._entries:
+                _, victim = self._entries.popitem(last=False)
+                self.size -= self._cost(victim)
+        return entry
+
+    def _load(self, path, key, st, ctype):
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+        except OSError:
+            return None
+        if len(body) != st.st_size:
+            # changed while we read it, do not cache a torn copy
+            return None
+        gzbody = None
+        if self.compress and ctype.startswith(GZIP_TYPES):
+            gzbody = gzip.compress(body, mtime=0)
+            if len(gzbody) >= len(body):
+                gzbody = None
+        etag = file_etag(st)
+        lastmod = email.utils.formatdate(st.st_mtime, usegmt=True)
+        return CachedFile(key, body, gzbody, ctype, str(len(body)),
+                          str(len(gzbody)) if gzbody else None, etag, lastmod)
+
+    @staticmethod
+    def _cost(entry):
+        return len(entry.body) + (len(entry.gzbody) if entry.gzbody else 0)
+
+
+def file_etag(st):
+    "Strong ETag of a file from its stat() result"
+    return '"{:x}-{:x}"'.format(st.st_mtime_ns, st.st_size)
+
+
+def accepts_gzip(value):
+    """
+    True if an 'Accept-Encoding' header allows gzip: listed (or matched by
+    '*') with a q-value above 0
+    """
+    qvalues = {}
+    for item in value.split(','):
+        coding, *params = item.split(';')
+        q = 1.0
+        for param in params:
+            name, _, number = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(number)
+                except ValueError:
+                    q = 0.0
+        qvalues[coding.strip().lower()] = q
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qvalues:
+            return qvalues[coding] > 0
+    return False
+
+
+def parse_range(value, size):
+    """
+    Parse a 'Range' header against a file of `size` bytes.
+
+    Returns (first, last) for a single satisfiable byte range, False if the
+    range can not be satisfied and None if the header should be ignored
+    (other units, multiple ranges, syntax errors).
+    """
+    unit, _, spec = value.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, sep, last = spec.strip().partition('-')
+    if not sep:
+        return None
+    if size == 0:
+        # no byte of an empty file can be selected
+        return False
+    try:
+        if first == '':
+            # suffix range: the last n bytes
+            length = int(last)
+            if length <= 0:
+                return False
+            return (max(0, size - length), size - 1)
+        first = int(first)
+        last = int(last) if last != '' else None
+    except ValueError:
+        return None
+    if first >= size:
+        return False
+    if last is None:
+        last = size - 1
+    if first < 0 or last < first:
+        return None
+    return (first, min(last, size - 1))
+
+
+class LabHttpRequestHandler(http.server.SimpleHTTPRequestHandler):
+    "SimpleHTTPRequestHandler with keep-alive and no-store responses"
+
+    protocol_version = 'HTTP/1.1'
+    # '/' is rewritten to this file
+    index = './index.html'
+    timeout = KEEPALIVE_TIMEOUT
+    # (offset, count) of the body copyfile() sends, None for everything
+    byterange = None
+    # ContentCache shared by all handlers, None serves from disk
+    cache = None
+    cache_control = 'no-store'
+
+    def do_GET(self):
+        if self.path == '/':
+            self.path = self.index
+        return http.server.SimpleHTTPRequestHandler.do_GET(self)
+
+    def send_response_only(self, code, message=None):
+        super().send_response_only(code, message)
+        if self.cache_control == 'no-store':
+            self.send_header('Cache-Control', 'no-store, must-revalidate')
+            self.send_header('Expires', '0')
+        else:
+            self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Accept-Ranges', 'bytes')
+
+    def send_head(self):
+        self.byterange = None
+        if 'Range' not in self.headers:
+            if self.cache is not None:
+                entry = self.cache.get(self.translate_path(self.path),
+                                       self.guess_type)
+                if entry is not None:
+                    return self.send_cached(entry)
+            return super().send_head()
+        path = self.translate_path(self.path)
+        if path.endswith('/') or not os.path.isfile(path):
+            return super().send_head()
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(404, 'File not found')
+            return None
+        try:
+            fs = os.fstat(f.fileno())
+            lastmod = self.date_time_string(fs.st_mtime)
+            byterange = parse_range(self.headers['Range'], fs.st_size)
+            # If-Range takes the strong ETag of the cache or the exact
+            # Last-Modified date, anything else gets the whole file
+            ifrange = self.headers.get('If-Range')
+            if byterange is None or (ifrange is not None and
+                                     ifrange.strip() not in (lastmod, file_etag(fs))):
+                f.close()
+                return super().send_head()
+            if byterange is False:
+                f.close()
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(fs.st_size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return None
+            first, last = byterange
+            self.send_response(206)
+            self.send_header('Content-type', self.guess_type(path))
+            self.send_header('Content-Range',
+                             'bytes {}-{}/{}'.format(first, last, fs.st_size))
+            self.send_header('Content-Length', str(last - first + 1))
+            self.send_header('Last-Modified', lastmod)
+            self.end_headers()
+            self.byterange = (first, last - first + 1)
+            return f
+        except:
+            f.close()
+            raise
+
+    def send_cached(self, entry):
+        if (self.cache_control == 'revalidate' and
+                self.headers.get('If-None-Match') == entry.etag):
+            self.send_response(304)
+            self.send_header('ETag', entry.etag)
+            self.end_headers()
+            return None
+        body, length = entry.body, entry.length
+        self.send_response(200)
+        if entry.gzbody is not None:
+            self.send_header('Vary', 'Accept-Encoding')
+            if accepts_gzip(self.headers.get('Accept-Encoding', '')):
+                body, length = entry.gzbody, entry.gzlength
+                self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-type', entry.ctype)
+        self.send_header('Content-Length', length)
+        self.send_header('Last-Modified', entry.lastmod)
+        self.send_header('ETag', entry.etag)
+        self.end_headers()
+        return io.BytesIO(body)
+
+    def copyfile(self, source, outputfile):
+        if isinstance(source, io.BytesIO):
+            # cached body or directory listing, already in memory
+            outputfile.write(source.getbuffer())
+            return
+        offset, count = self.byterange or (0, None)
+        # Headers may still sit in a buffered wfile
+        outputfile.flush()
+        if not isinstance(self.connection, ssl.SSLSocket):
+            self.connection.sendfile(source, offset, count)
+            return
+        source.seek(offset)
+        while count is None or count > 0:
+            buf = source.read(COPY_BUFSIZE if count is None else min(count, COPY_BUFSIZE))
+            if not buf:
+                break
+            outputfile.write(buf)
+            if count is not None:
+                count -= len(buf)
+
+    def handle_one_request(self):
+        # The idle timeout only applies while we wait for the next request
+        self.connection.settimeout(self.timeout)
+        super().handle_one_request()
+
+    def parse_request(self):
+        # ... but never while sending, a rate limited client may take minutes
+        self.connection.settimeout(None)
+        return super().parse_request()
+
+
+class ReusableTCPServer(socketserver.TCPServer):
+    allow_reuse_address = True
+    # the single engine handshakes in accept(), like the old server did
+    handshake_in_accept = True
+
+    def __init__(self, server_address, RequestHandlerClass,
+                 context=None, reuse_port=False):
+        self.context = context
+        self.allow_reuse_port = reuse_port
+        super().__init__(server_address, RequestHandlerClass)
+        if context is not None and self.handshake_in_accept:
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+
+    def server_bind(self):
+        if self.allow_reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+class ThreadPoolHTTPServer(ReusableTCPServer):
+    """
+    TCPServer that hands accepted connections to a fixed set of worker
+    threads. When all workers are busy and the queue is full, accepting
+    blocks and new clients wait in the listen backlog.
+    """
+
+    request_queue_size = 128
+    handshake_in_accept = False
+
+    def __init__(self, server_address, RequestHandlerClass,
+                 workers=DEFAULT_WORKERS, backlog=None,
+                 context=None, reuse_port=False):
+        self.workers = workers
+        self._pending = queue.Queue(maxsize=backlog or 4 * workers)
+        super().__init__(server_address, RequestHandlerClass,
+                         context=context, reuse_port=reuse_port)
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._worker,
+                                 name='http-worker-{}'.format(i), daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def process_request(self, request, client_address):
+        self._pending.put((request, client_address))
+
+    def _worker(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                if self.context is not None:
+                    request = self._handshake(request)
+                if request is not None:
+                    self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                if request is not None:
+                    self.shutdown_request(request)
+
+    def _handshake(self, request):
+        request.settimeout(KEEPALIVE_TIMEOUT)
+        try:
+            return self.context.wrap_socket(request, server_side=True)
+        except (ssl.SSLError, OSError):
+            request.close()
+            return None
+
+    def server_close(self):
+        super().server_close()
+        for _ in self._threads:
+            self._pending.put(None)
+
+
+def _preread_handler(handler_class):
+    "Wrap handler_class so it processes one request that was already read"
+
+    class PrereadHandler(handler_class):
+        def __init__(self, request, client_address, server, preread=b''):
+            self.preread = preread
+            super().__init__(request, client_address, server)
+
+        def setup(self):
+            self.connection = self.request
+            self.rfile = io.BytesIO(self.preread)
+            self.wfile = self.connection.makefile('wb')
+
+        def handle(self):
+            self.close_connection = True
+            self.handle_one_request()
+
+    PrereadHandler.__name__ = handler_class.__name__
+    return PrereadHandler
+
+
+def _content_length(head):
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            try:
+                return max(0, int(value.strip()))
+            except ValueError:
+                return 0
+    return 0
+
+
+TOO_LARGE = (b'HTTP/1.1 413 Payload Too Large\r\n'
+             b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+
+
+class AsyncioHTTPServer(object):
+    """
+    asyncio front end: waiting for (slow or idle) clients costs no thread,
+    only complete requests occupy one of the `workers` handler threads.
+    """
+
+    timeout = KEEPALIVE_TIMEOUT
+
+    def __init__(self, server_address, RequestHandlerClass,
+                 workers=DEFAULT_WORKERS, max_connections=1024,
+                 reuse_port=False):
+        self.server_address = server_address
+        self.RequestHandlerClass = _preread_handler(RequestHandlerClass)
+        self.workers = workers
+        self.max_connections = max_connections
+        self.socket = socket.create_server(server_address, backlog=128,
+                                           reuse_port=reuse_port)
+
+    def serve_forever(self):
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self.server_close()
+
+    def server_close(self):
+        self.socket.close()
+
+    def handle_error(self, request, client_address):
+        print('-' * 40, file=sys.stderr)
+        print('Exception occurred during processing of request from',
+              client_address, file=sys.stderr)
+        traceback.print_exc()
+        print('-' * 40, file=sys.stderr)
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                            thread_name_prefix='http-worker')
+        slots = asyncio.Semaphore(self.max_connections)
+        tasks = set()
+        self.socket.setblocking(False)
+        try:
+            while True:
+                await slots.acquire()
+                conn, addr = await loop.sock_accept(self.socket)
+                task = loop.create_task(self._connection(conn, addr, slots))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            self._executor.shutdown(wait=False)
+
+    async def _recv(self, conn, buf):
+        loop = asyncio.get_running_loop()
+        try:
+            data = await asyncio.wait_for(loop.sock_recv(conn, 65536),
+                                          self.timeout)
+        except (asyncio.TimeoutError, OSError):
+            return None
+        return buf + data if data else None
+
+    async def _connection(self, conn, addr, slots):
+        loop = asyncio.get_running_loop()
+        conn.setblocking(False)
+        buf = b''
+        try:
+            while True:
+                end = buf.find(b'\r\n\r\n')
+                while end < 0:
+                    if len(buf) > MAX_REQUEST_HEAD:
+                        return
+                    buf = await self._recv(conn, buf)
+                    if buf is None:
+                        return
+                    end = buf.find(b'\r\n\r\n')
+                length = _content_length(buf[:end])
+                if length > MAX_REQUEST_BODY:
+                    try:
+                        await loop.sock_sendall(conn, TOO_LARGE)
+                    except OSError:
+                        pass
+                    return
+                end += 4 + length
+                while len(buf) < end:
+                    buf = await self._recv(conn, buf)
+                    if buf is None:
+                        return
+                request, buf = buf[:end], buf[end:]
+                keep = await loop.run_in_executor(
+                    self._executor, self._handle, conn, addr, request)
+                if not keep:
+                    return
+        finally:
+            conn.close()
+            slots.release()
+
+    def _handle(self, conn, addr, request):
+        conn.setblocking(True)
+        try:
+            handler = self.RequestHandlerClass(conn, addr, self, preread=request)
+            keep = not handler.close_connection
+        except Exception:
+            self.handle_error(conn, addr)
+            keep = False
+        conn.setblocking(False)
+        return keep
+
+
+def make_tls_context(certfile, keyfile):
+    """
+    Server context with session resumption: stateless session tickets
+    (shared by all pre-forked processes) and OpenSSL's session cache.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    context.options &= ~ssl.OP_NO_TICKET
+    return context
+
+
+def add_arguments(parser, port=80):
+    "Add the serving engine options to an argparse parser"
+    parser.add_argument('--port', type=int, default=port,
+                        help='listen port (default {})'.format(port))
+    parser.add_argument('--engine', choices=ENGINES, default=DEFAULT_ENGINE,
+                        help='serving engine (default {})'.format(DEFAULT_ENGINE))
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='handler threads (default {})'.format(DEFAULT_WORKERS))
+    parser.add_argument('--processes', type=int, default=1,
+                        help='pre-forked server processes sharing the port '
+                             'via SO_REUSEPORT (default 1)')
+    parser.add_argument('--cache-size', type=float, default=0, metavar='MB',
+                        help='in-memory file cache size, 0 disables (default)')
+    parser.add_argument('--gzip', action='store_true',
+                        help='keep gzip variants of cached text files')
+    parser.add_argument('--cache-control', choices=CACHE_CONTROLS,
+                        default='no-store',
+                        help='client caching headers (default no-store)')
+
+
+def make_server(handler_class, args, host='', context=None, reuse_port=False):
+    "Create the server selected by the add_arguments options"
+    address = (host, args.port)
+    handler_class.cache_control = args.cache_control
+    if args.cache_size > 0:
+        handler_class.cache = ContentCache(int(args.cache_size * 1024 * 1024),
+                                           compress=args.gzip)
+    if args.engine == 'single':
+        return ReusableTCPServer(address, handler_class, context=context,
+                                 reuse_port=reuse_port)
+    if args.engine == 'thread':
+        return ThreadPoolHTTPServer(address, handler_class, workers=args.workers,
+                                    context=context, reuse_port=reuse_port)
+    if args.engine == 'asyncio':
+        if context is not None:
+            raise ValueError('the asyncio engine does not support TLS')
+        return AsyncioHTTPServer(address, handler_class, workers=args.workers,
+                                 reuse_port=reuse_port)
+    raise ValueError('unknown serving engine {}'.format(args.engine))
+
+
+def _serve_one(handler_class, args, host, context, reuse_port):
+    server = make_server(handler_class, args, host, context, reuse_port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if context is not None:
+            print('{}: TLS session stats {}'.format(
+                os.getpid(), context.session_stats()), file=sys.stderr)
+
+
+def serve(handler_class, args, host='', context=None):
+    """
+    Run the server selected by the add_arguments options until interrupted,
+    in args.processes pre-forked processes when that is more than one.
+    """
+    if args.processes <= 1:
+        _serve_one(handler_class, args, host, context, False)
+        return
+    children = []
+    for _ in range(args.processes):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _serve_one(handler_class, args, host, context, True)
+            finally:
+                os._exit(0)
+        children.append(pid)
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGINT)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            os.waitpid(pid, 0)
@@ -0,0 +1,272 @@
+"""
+Copyright 2023-present Martin Becke
+# SPDX-License-Identifier: Apache-2.0
+
+Throughput and latency measurements between Mininet hosts.
+
+A MeasurementSuite runs flows between host pairs in parallel, each with
+its worker processes started through node.popen() (not the node shell, so
+several flows can use the same host):
+
+* iperf3: one-off iperf3 server on dst, client on src (TCP or UDP with
+  -u), reports goodput, retransmits, UDP jitter and loss
+* ping:   RTT percentiles and loss of `count` echo requests
+* http:   python http.server on dst serving a file of `size` bytes, curl
+  on src fetches it `count` times; goodput and time-to-first-byte
+  percentiles
+
+The results are appended as JSON lines (one flow per line, tagged with a
+run id and labels) to measurements.jsonl in the repository root, so runs
+before and after a change can be compared.
+
+    suite = MeasurementSuite(net, labels={'topo': 'topo-base'})
+    suite.add('iperf3', 'h0', 'h6', duration=5)
+    suite.add('ping', 'h0', 'h6', count=50)
+    suite.add('http', 'h1', 'h5', size=1000000)
+    suite.write(suite.run())
+"""
+
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from mininet.log import debug
+
+KINDS = ('iperf3', 'ping', 'http')
+OUTPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      'measurements.jsonl')
+IPERF_PORT = 5201
+HTTP_PORT = 8201
+# Attempts to reach a server that is still starting
+CONNECT_TRIES = 20
+
+
+def percentiles(values, points=(50, 90, 99)):
+    "min/max/mean and the nearest-rank percentiles of `values`"
+    if not values:
+        return {}
+    values = sorted(values)
+    result = {'min': values[0], 'max': values[-1],
+              'mean': sum(values) / len(values)}
+    for point in points:
+        rank = max(1, -(-point * len(values) // 100))
+        result['p{}'.format(point)] = values[rank - 1]
+    return result
+
+
+def node_address(node):
+    "First global IPv4 address of `node` (addresses set after net.start())"
+    output = node.cmd('ip -4 -o address show scope global')
+    match = re.search(r'inet (\d+\.\d+\.\d+\.\d+)/', output)
+    return match.group(1) if match else node.IP()
+
+
+def _run(node, args, timeout):
+    "Run `args` in `node`, returns (returncode, stdout)"
+    proc = node.popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    try:
+        output, _ = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        output, _ = proc.communicate()
+    return proc.returncode, output.decode(errors='replace')
+
+
+def _stop(proc):
+    if proc.poll() is None:
+        proc.terminate()
+        try:
+            proc.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+class Flow(object):
+    "One measurement between two hosts"
+
+    def __init__(self, kind, src, dst, port, **params):
+        if kind not in KINDS:
+            raise ValueError('unknown measurement {}, use one of {}'.format(
+                kind, ', '.join(KINDS)))
+        self.kind = kind
+        self.src = src
+        self.dst = dst
+        self.port = port
+        self.params = params
+
+    def run(self, net):
+        src, dst = net[self.src], net[self.dst]
+        addr = self.params.get('addr') or node_address(dst)
+        result = {'kind': self.kind, 'src': self.src, 'dst': self.dst, 'addr': addr}
+        result.update(self.params)
+        start_time = time.time()
+        try:
+            result.update(getattr(self, '_' + self.kind)(src, dst, addr))
+        except (OSError, ValueError, KeyError) as error:
+            result['error'] = str(error)
+        result['seconds'] = time.time() - start_time
+        return result
+
+    def _iperf3(self, src, dst, addr):
+        duration = self.params.get('duration', 5)
+        server = dst.popen(['iperf3', '-s', '-1', '-p', str(self.port)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            args = ['iperf3', '-c', addr, '-p', str(self.port), '-J',
+                    '-t', str(duration)]
+            if self.params.get('udp'):
+                args += ['-u', '-b', str(self.params.get('bandwidth', '10M'))]
+            for _ in range(CONNECT_TRIES):
+                _, output = _run(src, args, duration + 30)
+                report = json.loads(output)
+                if 'error' not in report or 'connect' not in report['error']:
+                    break
+                time.sleep(0.05)
+        finally:
+            _stop(server)
+        if 'error' in report:
+            return {'error': report['error']}
+        end = report['end']
+        if self.params.get('udp'):
+            return {'goodput_bps': end['sum']['bits_per_second'],
+                    'jitter_ms': end['sum']['jitter_ms'],
+                    'loss': end['sum']['lost_percent'] / 100.0}
+        return {'goodput_bps': end['sum_received']['bits_per_second'],
+                'sent_bps': end['sum_sent']['bits_per_second'],
+                'retransmits': end['sum_sent'].get('retransmits')}
+
+    def _ping(self, src, dst, addr):
+        count = self.params.get('count', 20)
+        interval = self.params.get('interval', 0.2)
+        _, output = _run(src, ['ping', '-n', '-c', str(count), '-i', str(interval),
+                               '-W', '1', addr], count * interval + 10)
+        rtts = [float(rtt) for rtt in re.findall(r'time=([\d.]+) ms', output)]
+        match = re.search(r'(\d+) packets transmitted, (\d+) received', output)
+        if not match:
+            return {'error': output.strip().splitlines()[-1] if output.strip() else 'no output'}
+        sent, received = int(match.group(1)), int(match.group(2))
+        return {'sent': sent, 'received': received,
+                'loss': 1 - received / float(sent) if sent else 1.0,
+                'rtt_ms': percentiles(rtts)}
+
+    def _http(self, src, dst, addr):
+        count = self.params.get('count', 5)
+        size = self.params.get('size', 1000000)
+        docroot = tempfile.mkdtemp(prefix='rn-measure-')
+        with open(os.path.join(docroot, 'payload'), 'wb') as f:
+            f.write(os.urandom(size))
+        server = dst.popen(['python3', '-m', 'http.server', str(self.port),
+                            '--directory', docroot],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        url = 'http://{}:{}/payload'.format(addr, self.port)
+        fmt = '%{http_code} %{size_download} %{time_starttransfer} %{time_total}\n'
+        fetches = []
+        try:
+            for i in range(count):
+                for _ in range(CONNECT_TRIES if not fetches else 1):
+                    code, output = _run(src, ['curl', '-s', '-o', '/dev/null',
+                                              '-w', fmt, url], 60)
+                    # 7: could not connect, the server is still starting
+                    if code != 7:
+                        break
+                    time.sleep(0.05)
+                fields = output.split()
+                if code != 0 or len(fields) != 4 or fields[0] != '200':
+                    debug('*** http fetch {} failed: {}\n'.format(url, output))
+                    continue
+                fetches.append((int(fields[1]), float(fields[2]), float(fields[3])))
+        finally:
+            _stop(server)
+            shutil.rmtree(docroot, ignore_errors=True)
+        if not fetches:
+            return {'error': 'no successful fetch of {}'.format(url)}
+        goodput = [8 * nbytes / total for nbytes, _, total in fetches if total > 0]
+        return {'fetches': len(fetches), 'failed': count - len(fetches),
+                'goodput_bps': percentiles(goodput),
+                'ttfb_ms': percentiles([1000 * ttfb for _, ttfb, _ in fetches])}
+
+
+class MeasurementSuite(object):
+    "Flows between hosts of `net`, measured in parallel"
+
+    def __init__(self, net, labels=None):
+        self.net = net
+        self.labels = labels or {}
+        self.flows = []
+
+    def add(self, kind, src, dst, **params):
+        "Add a flow, `params` depend on the kind (see the module docstring)"
+        port = {'iperf3': IPERF_PORT, 'http': HTTP_PORT}.get(kind, 0) + len(self.flows)
+        self.flows.append(Flow(kind, src, dst, port, **params))
+
+    def run(self, parallel=True):
+        "Run all flows, returns the list of result records"
+        run_id = uuid.uuid4().hex[:12]
+        started = time.time()
+        if parallel and self.flows:
+            with ThreadPoolExecutor(max_workers=len(self.flows)) as pool:
+                results = list(pool.map(lambda flow: flow.run(self.net), self.flows))
+        else:
+            results = [flow.run(self.net) for flow in self.flows]
+        for result in results:
+            result.update(run=run_id, time=started, labels=self.labels)
+        return results
+
+    def write(self, results, path=OUTPUT):
+        "Append `results` as JSON lines to `path`"
+        with open(path, 'a') as f:
+            for result in results:
+                f.write(json.dumps(result, sort_keys=True) + '\n')
+        return path
+
+
+def parse_flows(spec):
+    """
+    Parse 'kind:src:dst[:key=value...],...' e.g.
+    'iperf3:h1:h5:duration=10,ping:h1:h5:count=100' into
+    [(kind, src, dst, params)]. Numbers become int/float.
+    """
+    flows = []
+    for item in spec.split(','):
+        fields = item.strip().split(':')
+        if len(fields) < 3:
+            raise ValueError('flow {!r} is not kind:src:dst'.format(item))
+        params = {}
+        for field in fields[3:]:
+            key, _, value = field.partition('=')
+            for convert in (int, float):
+                try:
+                    value = convert(value)
+                    break
+                except ValueError:
+                    pass
+            params[key] = value
+        flows.append((fields[0], fields[1], fields[2], params))
+    return flows
+
+
+def add_arguments(parser):
+    "Add the --measure/--measure-output options to an argparse parser"
+    parser.add_argument('--measure', default=None, metavar='FLOWS',
+                        help="measure after bring-up, e.g. 'iperf3:h1:h5,ping:h1:h5:count=50'")
+    parser.add_argument('--measure-output', default=OUTPUT,
+                        help='JSON lines file (default: %(default)s)')
+
+
+def measure_from_args(net, args, labels=None):
+    "Run the flows of --measure (if any), returns the results"
+    if not args.measure:
+        return []
+    suite = MeasurementSuite(net, labels)
+    for kind, src, dst, params in parse_flows(args.measure):
+        suite.add(kind, src, dst, **params)
+    results = suite.run()
+    suite.write(results, args.measure_output)
+    return results
@@ -0,0 +1,128 @@
+"""
+Copyright 2023-present Martin Becke
+# SPDX-License-Identifier: Apache-2.0
+
+Batched namespace configuration.
+
+Instead of one node.cmd() round-trip through Mininet's shell pipe per
+ifconfig, sysctl or 'ip route add', NetConfig collects the commands per
+node and applies them with a single
+
+    ip -force -batch <file>; sysctl -q -p <file>
+
+per node. apply() sends the command to all node shells first and then
+collects the output, so the nodes configure themselves in parallel.
+
+    conf = NetConfig()
+    conf.address(r1, 'r1-eth0', '10.0.10.1/24')
+    conf.sysctl(r1, 'net.ipv4.ip_forward', 1)
+    conf.route(h1, 'default', via='10.0.10.1')
+    conf.apply()
+"""
+
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+from mininet.log import debug
+
+
+class NodeBatch(object):
+    "ip and sysctl lines collected for one node"
+
+    def __init__(self, node):
+        self.node = node
+        self.ip = []
+        self.sysctl = OrderedDict()
+
+    def command(self, ipfile, sysctlfile):
+        cmds = []
+        if self.ip:
+            cmds.append('ip -force -batch {}'.format(ipfile))
+        if self.sysctl:
+            cmds.append('sysctl -q -p {}'.format(sysctlfile))
+        return '; '.join(cmds)
+
+
+class NetConfig(object):
+    "Collects per-node configuration and applies it in one shot"
+
+    def __init__(self):
+        self.batches = OrderedDict()
+        # (node name, interface) -> 'a.b.c.d/len', kept across apply()
+        self.addresses = OrderedDict()
+
+    def _batch(self, node):
+        batch = self.batches.get(node.name)
+        if batch is None:
+            batch = self.batches[node.name] = NodeBatch(node)
+        return batch
+
+    def address(self, node, intf, cidr):
+        "Replace the addresses of `intf` with `cidr` (like ifconfig) and bring it up"
+        if intf not in node.intfNames():
+            debug('*** {} has no interface {}, not configuring {}\n'.format(
+                node.name, intf, cidr))
+            return
+        self.addresses[(node.name, intf)] = cidr
+        batch = self._batch(node)
+        batch.ip.append('address flush dev {} scope global'.format(intf))
+        batch.ip.append('address add {} dev {}'.format(cidr, intf))
+        batch.ip.append('link set dev {} up'.format(intf))
+
+    def route(self, node, prefix, via=None, dev=None, replace=False):
+        "Add a route (or replace an existing one); `prefix` may be 'default'"
+        line = 'route {} {}'.format('replace' if replace else 'add', prefix)
+        if via is not None:
+            line += ' via {}'.format(via)
+        if dev is not None:
+            line += ' dev {}'.format(dev)
+        self._batch(node).ip.append(line)
+
+    def ip(self, node, line):
+        "Add a raw 'ip -batch' line, e.g. 'route replace 10.0.0.0/8 via 10.0.1.1'"
+        self._batch(node).ip.append(line)
+
+    def sysctl(self, node, key, value):
+        self._batch(node).sysctl[key] = value
+
+    def apply(self, parallel=True):
+        """
+        Apply and forget the collected configuration. Like the single
+        node.cmd() calls it replaces, a failing line does not stop the
+        rest; returns a dict node name -> error output for the nodes where
+        something failed.
+        """
+        tmpdir = tempfile.mkdtemp(prefix='rn-netconf-')
+        failed = {}
+        try:
+            pending = []
+            for name, batch in self.batches.items():
+                ipfile = os.path.join(tmpdir, name + '.ip')
+                sysctlfile = os.path.join(tmpdir, name + '.sysctl')
+                with open(ipfile, 'w') as f:
+                    f.write('\n'.join(batch.ip) + '\n')
+                with open(sysctlfile, 'w') as f:
+                    for key, value in batch.sysctl.items():
+                        f.write('{} = {}\n'.format(key, value))
+                cmd = batch.command(ipfile, sysctlfile)
+                if not cmd:
+                    continue
+                if parallel:
+                    batch.node.sendCmd(cmd)
+                    pending.append(batch.node)
+                else:
+                    output = batch.node.cmd(cmd)
+                    if output.strip():
+                        failed[name] = output
+            for node in pending:
+                output = node.waitOutput()
+                if output.strip():
+                    failed[node.name] = output
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        for name, output in failed.items():
+            debug('*** {}: configuration failed:\n{}'.format(name, output))
+        self.batches.clear()
+        return failed
@@ -0,0 +1,214 @@
+"""
+Copyright 2023-present Martin Becke
+# SPDX-License-Identifier: Apache-2.0
+
+Static routing table generator.
+
+Takes the link graph of a Mininet Topo (Topo.links()) and the interface
+addresses (NetConfig.addresses) and computes, once per router, a
+shortest-path (BFS, every hop costs 1) route table to every subnet that
+is not directly connected. Works for any shape, not only the r1--rN chain.
+
+Hosts and routers that share a switch are one L2 segment, a direct link
+is a segment with two interfaces. Routes can optionally be aggregated:
+prefixes with the same next hop are collapsed into the smallest set of
+covering prefixes (ipaddress.collapse_addresses only merges prefixes that
+are completely present, so no traffic is misrouted).
+
+The result is cached as JSON keyed by a hash of graph and addresses, so
+repeated runs of the same topology skip the computation. The topologies
+run as root ('sudo -E' keeps the user's HOME), so root caches in
+/var/cache/rn-practice instead of leaving root-owned files in the user's
+~/.cache.
+
+    table = cached_routes(net.topo, conf.addresses, routers)
+    install_routes(net, conf, table)
+"""
+
+import collections
+import hashlib
+import ipaddress
+import json
+import os
+
+CACHE_DIR = os.environ.get('RN_CACHE_DIR',
+                           '/var/cache/rn-practice' if os.geteuid() == 0
+                           else os.path.expanduser('~/.cache/rn-practice'))
+# Bump when the output of compute_routes changes for the same input
+CACHE_VERSION = 1
+
+Route = collections.namedtuple('Route', 'prefix via dev')
+
+
+def link_interfaces(topo):
+    """
+    Return [((node1, intf1), (node2, intf2)), ...] for all links of `topo`,
+    with Mininet's default interface names where none were given.
+    """
+    result = []
+    for _, _, info in topo.links(sort=True, withInfo=True):
+        node1, node2 = info['node1'], info['node2']
+        intf1 = info.get('intfName1') or '{}-eth{}'.format(node1, info['port1'])
+        intf2 = info.get('intfName2') or '{}-eth{}'.format(node2, info['port2'])
+        result.append(((node1, intf1), (node2, intf2)))
+    return result
+
+
+def segments(topo):
+    "Group the non-switch interfaces of `topo` into L2 segments"
+    links = link_interfaces(topo)
+    # union-find over switches, switches connected to switches are one segment
+    parent = {}
+
+    def find(sw):
+        while parent.setdefault(sw, sw) != sw:
+            parent[sw] = parent[parent[sw]]
+            sw = parent[sw]
+        return sw
+
+    for (n1, _), (n2, _) in links:
+        if topo.isSwitch(n1) and topo.isSwitch(n2):
+            parent[find(n1)] = find(n2)
+
+    bridged = collections.defaultdict(list)
+    result = []
+    for end1, end2 in links:
+        sw1, sw2 = topo.isSwitch(end1[0]), topo.isSwitch(end2[0])
+        if sw1 and sw2:
+            continue
+        if sw1:
+            bridged[find(end1[0])].append(end2)
+        elif sw2:
+            bridged[find(end2[0])].append(end1)
+        else:
+            result.append([end1, end2])
+    result.extend(bridged[sw] for sw in sorted(bridged))
+    return result
+
+
+def compute_routes(topo, addresses, routers, aggregate=False):
+    """
+    Compute the static routes of every router in `routers`.
+
+    `addresses` maps (node, interface) to 'a.b.c.d/len'. Returns a dict
+    router -> [Route(prefix, via, dev), ...] sorted by prefix.
+    """
+    routers = set(routers)
+    # per segment: the subnets on it and the router interfaces attached
+    seg_nets = []
+    seg_routers = []
+    for seg in segments(topo):
+        nets = set()
+        attached = []
+        for node, intf in seg:
+            cidr = addresses.get((node, intf))
+            if cidr is None:
+                continue
+            iface = ipaddress.ip_interface(cidr)
+            nets.add(iface.network)
+            if node in routers:
+                attached.append((node, intf, str(iface.ip)))
+        seg_nets.append(nets)
+        seg_routers.append(attached)
+
+    # router adjacency: (neighbour, next hop address, outgoing interface)
+    adjacent = collections.defaultdict(list)
+    connected = collections.defaultdict(set)
+    for nets, attached in zip(seg_nets, seg_routers):
+        for node, intf, _ in attached:
+            connected[node].update(nets)
+            for other, _, otherip in attached:
+                if other != node:
+                    adjacent[node].append((other, otherip, intf))
+    for node in adjacent:
+        adjacent[node].sort()
+
+    table = {}
+    for router in sorted(routers):
+        # BFS, remember the first hop used to reach every router
+        first_hop = {router: None}
+        distance = {router: 0}
+        queue = collections.deque([router])
+        while queue:
+            cur = queue.popleft()
+            for nxt, via, dev in adjacent[cur]:
+                if nxt in distance:
+                    continue
+                distance[nxt] = distance[cur] + 1
+                first_hop[nxt] = first_hop[cur] or (via, dev)
+                queue.append(nxt)
+
+        best = {}
+        for nets, attached in zip(seg_nets, seg_routers):
+            reachable = [(distance[node], node) for node, _, _ in attached
+                         if node in distance and node != router]
+            if not reachable:
+                continue
+            dist, nearest = min(reachable)
+            hop = first_hop[nearest]
+            for net in nets:
+                if net in connected[router]:
+                    continue
+                if net not in best or dist < best[net][0]:
+                    best[net] = (dist, hop)
+
+        routes = [(net, hop) for net, (_, hop) in best.items()]
+        if aggregate:
+            routes = _aggregate(routes)
+        table[router] = [Route(str(net), via, dev)
+                         for net, (via, dev) in sorted(routes)]
+    return table
+
+
+def _aggregate(routes):
+    by_hop = collections.defaultdict(list)
+    for net, hop in routes:
+        by_hop[hop].append(net)
+    result = []
+    for hop, nets in by_hop.items():
+        for version in (4, 6):
+            same = [n for n in nets if n.version == version]
+            result.extend((net, hop) for net in ipaddress.collapse_addresses(same))
+    return result
+
+
+def _cache_key(topo, addresses, routers, aggregate):
+    data = {
+        'version': CACHE_VERSION,
+        'links': link_interfaces(topo),
+        'switches': sorted(topo.switches()),
+        'addresses': sorted([list(k), v] for k, v in addresses.items()),
+        'routers': sorted(routers),
+        'aggregate': aggregate,
+    }
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def cached_routes(topo, addresses, routers, aggregate=False, cachedir=CACHE_DIR):
+    "compute_routes() with an on-disk cache, a broken cache is recomputed"
+    path = os.path.join(cachedir, 'routes-{}.json'.format(
+        _cache_key(topo, addresses, routers, aggregate)))
+    try:
+        with open(path) as f:
+            return {router: [Route(*r) for r in routes]
+                    for router, routes in json.load(f).items()}
+    except (OSError, ValueError, TypeError):
+        pass
+    table = compute_routes(topo, addresses, routers, aggregate)
+    try:
+        os.makedirs(cachedir, exist_ok=True)
+        tmp = '{}.{}'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(table, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+    return table
+
+
+def install_routes(net, conf, table):
+    "Queue the routes of `table` in NetConfig `conf`"
+    for router, routes in table.items():
+        node = net[router]
+        for route in routes:
+            conf.route(node, route.prefix, via=route.via, dev=route.dev)
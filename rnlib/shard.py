@@ -0,0 +1,633 @@
+"""
+Copyright 2023-present Martin Becke
+# SPDX-License-Identifier: Apache-2.0
+
+Sharded Mininet.
+
+One Mininet process drives every node shell through its pipes, so bring
+up and node.cmd() of large topologies are bound to one core. ShardedNet
+splits the topology graph into `shards` parts with few links between
+them and runs every part in a worker process with a Mininet of its own:
+
+* partition(): recursive min-cut bisection, each bisection grown by BFS
+  and refined with Fiduccia-Mattheyses passes (the imbalance of the
+  levels adds up, so every level gets its share of TOLERANCE)
+* the workers build and start their part in parallel
+* the coordinator creates the veth pairs of the cut links directly in
+  the namespaces of both ends (one 'ip -batch'), the workers adopt them
+  as interfaces of their nodes (TCIntf for TCLinks, switch ports are
+  attached)
+* configure(net, conf) of the topology runs in every worker: it sees
+  all nodes and records all addresses (routes are computed from the
+  whole graph), only commands for its own nodes are applied
+* cmd() goes to the worker of the node, cmds() fans out to all workers
+
+    net = ShardedNet('gen:shape=chain,n=400', shards=4)
+    net.start()
+    net.cmds([('h1', 'ping -c1 10.1.144.10'), ('h200', 'ip route')])
+    net.stop()
+
+    $ sudo python3 rnlib/shard.py gen:shape=chain,n=400 --shards 4
+    $ sudo python3 rnlib/shard.py topo02/topo02.py:RTopo:N=100 --shards 4
+
+Topologies are given like for rnlib/warmpool.py. The switches are
+standalone OVS bridges without a controller: one controller per shard
+would compete for the same port.
+"""
+
+import argparse
+import cmd
+import heapq
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import deque, OrderedDict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
+
+from rnlib import routing
+from rnlib.cleanup import RUN_DIR, private_dir
+from rnlib.netconf import NetConfig, NodeBatch
+from rnlib.warmpool import load_topology
+
+# Allowed imbalance of the parts of partition(), as a share of the part size
+TOLERANCE = 0.05
+# Fiduccia-Mattheyses passes per bisection at most
+PASSES = 8
+# Link options that are not interface parameters
+LINK_KEYS = ('node1', 'node2', 'port1', 'port2', 'intfName1', 'intfName2',
+             'params1', 'params2', 'cls', 'key', 'addr1', 'addr2')
+
+
+class ShardError(Exception):
+    pass
+
+
+def graph(topo):
+    "Adjacency of `topo`: node -> {neighbor: number of links}"
+    adj = OrderedDict((name, {}) for name in topo.nodes(sort=True))
+    for node1, node2 in topo.links(sort=True):
+        if node1 != node2:
+            adj[node1][node2] = adj[node1].get(node2, 0) + 1
+            adj[node2][node1] = adj[node2].get(node1, 0) + 1
+    return adj
+
+
+def _bfs(start, adj, members):
+    "Nodes of `members` in BFS order from `start`"
+    seen = {start}
+    order = []
+    queue = deque([start])
+    while queue:
+        node = queue.popleft()
+        order.append(node)
+        for other in adj[node]:
+            if other in members and other not in seen:
+                seen.add(other)
+                queue.append(other)
+    return order
+
+
+def _bisect(nodes, adj, share, passes=PASSES, tolerance=TOLERANCE):
+    """
+    Split `nodes` into (first, second), first with `share` of the nodes,
+    cutting few links. The first part is grown by BFS from a peripheral
+    node, then FM passes move single nodes while that lowers the cut.
+    Neither part is empty if there are two nodes or more.
+    """
+    members = set(nodes)
+    index = dict((node, i) for i, node in enumerate(nodes))
+    target = min(max(1, int(round(len(nodes) * share))), len(nodes) - 1)
+    slack = max(1, int(min(target, len(nodes) - target) * tolerance))
+    low = max(1, target - slack)
+    high = min(len(nodes) - 1, target + slack)
+
+    side = dict.fromkeys(nodes, 1)
+    count = 0
+    for node in nodes:
+        if count >= target:
+            break
+        if side[node] == 0:
+            continue
+        # the far end of a BFS is a peripheral node of the component
+        start = _bfs(node, adj, members)[-1]
+        for other in _bfs(start, adj, members):
+            if count >= target:
+                break
+            side[other] = 0
+            count += 1
+
+    for _ in range(passes):
+        gain = {}
+        for node in nodes:
+            gain[node] = sum(weight if side[other] != side[node] else -weight
+                             for other, weight in adj[node].items() if other in members)
+        heap = [(-gain[node], index[node], node) for node in nodes]
+        heapq.heapify(heap)
+        locked = set()
+        moves = []
+        size = count
+        delta = best = 0
+        best_moves = 0
+        while heap:
+            negative, _, node = heapq.heappop(heap)
+            if node in locked or -negative != gain[node]:
+                continue
+            new_size = size + (1 if side[node] == 1 else -1)
+            if not low <= new_size <= high:
+                continue
+            side[node] ^= 1
+            locked.add(node)
+            size = new_size
+            delta -= gain[node]
+            moves.append(node)
+            if delta < best:
+                best, best_moves = delta, len(moves)
+            for other, weight in adj[node].items():
+                if other in members and other not in locked:
+                    gain[other] += 2 * weight if side[other] != side[node] else -2 * weight
+                    heapq.heappush(heap, (-gain[other], index[other], other))
+        for node in moves[best_moves:]:
+            side[node] ^= 1
+        count = sum(1 for node in nodes if side[node] == 0)
+        if best == 0:
+            break
+    return ([node for node in nodes if side[node] == 0],
+            [node for node in nodes if side[node] == 1])
+
+
+def partition(topo, parts):
+    """
+    node -> part (0 .. parts - 1), balanced parts with a small cut. A
+    part may be off by TOLERANCE after all levels of bisection: each
+    level gets TOLERANCE / levels.
+    """
+    adj = graph(topo)
+    parts = max(1, min(parts, len(adj)))
+    tolerance = TOLERANCE / max(1, (parts - 1).bit_length())
+    result = OrderedDict()
+
+    def split(nodes, first, count):
+        count = min(count, len(nodes))
+        if count <= 1:
+            for node in nodes:
+                result[node] = first
+            return
+        left = count // 2
+        part1, part2 = _bisect(nodes, adj, left / count, tolerance=tolerance)
+        split(part1, first, left)
+        split(part2, first + left, count - left)
+
+    split(list(adj), 0, parts)
+    # a small or odd-shaped graph can leave part numbers unused
+    number = dict((part, i) for i, part in enumerate(sorted(set(result.values()))))
+    return OrderedDict((node, number[result[node]]) for node in adj)
+
+
+def cut_links(topo, parts):
+    "Link infos of `topo` whose ends are in different parts"
+    return [info for node1, node2, info in topo.links(sort=True, withInfo=True)
+            if parts[node1] != parts[node2]]
+
+
+def _intf_name(info, side):
+    return info.get('intfName{}'.format(side)) or '{}-eth{}'.format(
+        info['node{}'.format(side)], info['port{}'.format(side)])
+
+
+def _intf_params(info, side):
+    "Interface parameters of one end of a link like Link() passes them"
+    params = dict(info.get('params{}'.format(side)) or {})
+    params.update((key, value) for key, value in info.items() if key not in LINK_KEYS)
+    return params
+
+
+def _is_tc(info):
+    from mininet.link import TCLink
+    cls = info.get('cls')
+    return isinstance(cls, type) and issubclass(cls, TCLink)
+
+
+def _ignore(*args, **kwargs):
+    "moveIntfFn for interfaces created in their namespace (like Link's)"
+    pass
+
+
+class _Remote(object):
+    "A node of another shard as configure() sees it: name and interfaces"
+
+    def __init__(self, name, intfs):
+        self.name = name
+        self.intfs = intfs
+
+    def intfNames(self):
+        return list(self.intfs)
+
+    intfList = intfNames
+
+
+class ShardView(object):
+    """
+    The net of one shard for configure(): net[name] of the other
+    shards' nodes are _Remote, net.topo is the whole topology
+    """
+
+    def __init__(self, net, topo):
+        self.net = net
+        self.topo = topo
+        intfs = OrderedDict()
+        for (node1, intf1), (node2, intf2) in routing.link_interfaces(topo):
+            intfs.setdefault(node1, []).append(intf1)
+            intfs.setdefault(node2, []).append(intf2)
+        self.remote = dict((name, _Remote(name, intfs.get(name, [])))
+                           for name in topo.nodes() if name not in net)
+
+    @property
+    def hosts(self):
+        return self.net.hosts
+
+    @property
+    def switches(self):
+        return self.net.switches
+
+    def __contains__(self, name):
+        return name in self.net or name in self.remote
+
+    def __getitem__(self, name):
+        return self.net[name] if name in self.net else self.remote[name]
+
+
+class ShardConfig(NetConfig):
+    "NetConfig that records the addresses of all nodes, applies to `local` ones only"
+
+    def __init__(self, local):
+        NetConfig.__init__(self)
+        self.local = set(local)
+
+    def _batch(self, node):
+        if node.name not in self.local:
+            # thrown away
+            return NodeBatch(node)
+        return NetConfig._batch(self, node)
+
+
+class Worker(object):
+    "One shard: a Mininet of some nodes of the topology"
+
+    def __init__(self, spec, name):
+        self.spec = spec
+        self.name = name
+        self.topo = None
+        self.configure = None
+        self.net = None
+        self.manifest = None
+
+    def build(self, nodes):
+        from mininet.link import TCLink
+        from mininet.net import Mininet
+        from mininet.node import OVSBridge
+        from mininet.topo import Topo
+        from mininet.util import ipAdd, macColonHex
+        from rnlib import cleanup
+
+        cleanup.reap_previous(self.name)
+        self.topo, self.configure = load_topology(self.spec)
+        local = set(nodes)
+        part = Topo()
+        # MACs and default IPs as an unsharded Mininet(autoSetMacs=True) sets them
+        for number, name in enumerate(self.topo.hosts(), 1):
+            if name in local:
+                opts = dict(self.topo.nodeInfo(name))
+                opts.setdefault('ip', '{}/8'.format(ipAdd(number)))
+                opts.setdefault('mac', macColonHex(number))
+                part.addNode(name, **opts)
+        for name in self.topo.switches():
+            if name in local:
+                part.addNode(name, **self.topo.nodeInfo(name))
+        for node1, node2, info in self.topo.links(sort=True, withInfo=True):
+            if node1 in local and node2 in local:
+                part.addLink(**info)
+        self.net = Mininet(topo=part, link=TCLink, switch=OVSBridge, controller=None)
+        self.net.start()
+        self.manifest = cleanup.RunManifest.record(self.name, self.net)
+        return {'ok': True, 'pids': OrderedDict(
+            (node.name, node.pid) for node in self.net.hosts + self.net.switches)}
+
+    def attach(self, intfs):
+        "Adopt the cut link ends [[node, intf, port, params, tc], ...] made for us"
+        from mininet.link import Intf, TCIntf
+        for name, intf_name, port, params, tc in intfs:
+            node = self.net[name]
+            params = dict(params, moveIntfFn=_ignore)
+            intf = (TCIntf if tc else Intf)(intf_name, node=node, port=port, **params)
+            if node in self.net.switches and hasattr(node, 'attach'):
+                node.attach(intf)
+            else:
+                intf.ifconfig('up')
+        return {'ok': True}
+
+    def configure_net(self):
+        if self.configure is None:
+            return {'ok': True, 'failed': {}}
+        conf = ShardConfig(node.name for node in self.net.hosts + self.net.switches)
+        self.configure(ShardView(self.net, self.topo), conf)
+        return {'ok': True, 'failed': conf.apply()}
+
+    def cmds(self, items):
+        "Run [[node, command], ...] with all nodes at once, returns the outputs"
+        outputs = [None] * len(items)
+        pending = list(enumerate(items))
+        while pending:
+            busy = OrderedDict()
+            later = []
+            for index, (name, command) in pending:
+                if name in busy:
+                    # a second command for a node waits for the next round
+                    later.append((index, (name, command)))
+                    continue
+                self.net[name].sendCmd(command)
+                busy[name] = index
+            for name, index in busy.items():
+                outputs[index] = self.net[name].waitOutput()
+            pending = later
+        return {'ok': True, 'outputs': outputs}
+
+    def handle(self, request):
+        op = request.get('op')
+        if op == 'build':
+            return self.build(request['nodes'])
+        if op == 'attach':
+            return self.attach(request['intfs'])
+        if op == 'configure':
+            return self.configure_net()
+        if op == 'cmds':
+            return self.cmds(request['cmds'])
+        return {'ok': False, 'error': 'unknown op {!r}'.format(op)}
+
+    def stop(self):
+        if self.net is not None:
+            self.net.stop()
+            self.net = None
+        if self.manifest is not None:
+            self.manifest.reap()
+            self.manifest = None
+
+
+def worker_main(spec, name):
+    "Worker process: requests on stdin, replies on stdout, one JSON object per line"
+    import signal
+    from mininet.log import setLogLevel
+
+    replies = os.fdopen(os.dup(1), 'w', buffering=1)
+    os.dup2(2, 1)
+    setLogLevel('info')
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    worker = Worker(spec, name)
+    try:
+        for line in sys.stdin:
+            request = json.loads(line)
+            if request.get('op') == 'stop':
+                break
+            try:
+                reply = worker.handle(request)
+            except Exception as error:
+                reply = {'ok': False, 'error': '{}: {}'.format(type(error).__name__, error)}
+            replies.write(json.dumps(reply) + '\n')
+    finally:
+        worker.stop()
+
+
+class _Shard(object):
+    "Coordinator side of a worker process"
+
+    def __init__(self, spec, name, log_dir):
+        self.name = name
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+        private_dir(log_dir)
+        with open(os.path.join(log_dir, '{}.log'.format(name)), 'w') as log:
+            self.proc = subprocess.Popen(
+                [sys.executable, '-m', 'rnlib.shard', 'worker', spec, '--name', name],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=log, env=env,
+                universal_newlines=True, bufsize=1)
+
+    def send(self, data):
+        self.proc.stdin.write(json.dumps(data) + '\n')
+        self.proc.stdin.flush()
+
+    def receive(self):
+        line = self.proc.stdout.readline()
+        reply = json.loads(line) if line else {'ok': False, 'error': 'worker exited'}
+        if not reply.get('ok'):
+            raise ShardError('{}: {}'.format(self.name, reply.get('error')))
+        return reply
+
+    def stop(self, timeout=60):
+        if self.proc.poll() is None:
+            try:
+                self.send({'op': 'stop'})
+                self.proc.stdin.close()
+                self.proc.wait(timeout)
+            except (OSError, ValueError, subprocess.TimeoutExpired):
+                self.proc.terminate()
+                self.proc.wait()
+
+
+class ShardedNet(object):
+    "A topology spread over `shards` worker processes"
+
+    def __init__(self, spec, shards=None, name='shard', log_dir=RUN_DIR):
+        path, sep, rest = spec.partition(':')
+        if sep and path.endswith('.py'):
+            spec = '{}:{}'.format(os.path.abspath(path), rest)
+        self.spec = spec
+        self.name = name
+        self.log_dir = log_dir
+        self.topo, _ = load_topology(spec)
+        self.parts = partition(self.topo, shards or os.cpu_count() or 1)
+        self.cut = cut_links(self.topo, self.parts)
+        self.count = max(self.parts.values()) + 1
+        self.shards = []
+        self.pids = {}
+        self.times = OrderedDict()
+
+    def _all(self, requests):
+        "Send requests[i] to shard i, all at once, returns the replies"
+        for shard, request in zip(self.shards, requests):
+            shard.send(request)
+        return [shard.receive() for shard in self.shards]
+
+    def _timed(self, phase, requests):
+        start_time = time.time()
+        replies = self._all(requests)
+        self.times[phase] = time.time() - start_time
+        return replies
+
+    def _link_cut(self):
+        "Create the veth pairs of the cut links in their namespaces"
+        start_time = time.time()
+        lines = []
+        intfs = [[] for _ in self.shards]
+        for info in self.cut:
+            ends = []
+            for side in (1, 2):
+                node = info['node{}'.format(side)]
+                intf = _intf_name(info, side)
+                ends.append((intf, self.pids[node]))
+                intfs[self.parts[node]].append(
+                    [node, intf, info['port{}'.format(side)], _intf_params(info, side),
+                     _is_tc(info)])
+            lines.append('link add name {} netns {} type veth peer name {} netns {}'.format(
+                ends[0][0], ends[0][1], ends[1][0], ends[1][1]))
+        if lines:
+            proc = subprocess.Popen(['ip', '-force', '-batch', '-'], stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output, _ = proc.communicate(('\n'.join(lines) + '\n').encode())
+            if proc.returncode:
+                raise ShardError('cut links: {}'.format(output.decode().strip()))
+        self.times['veth'] = time.time() - start_time
+        return intfs
+
+    def start(self):
+        from mininet.log import info
+
+        members = [[] for _ in range(self.count)]
+        for node, part in self.parts.items():
+            members[part].append(node)
+        info('*** {} shards: {} nodes, {} cut links\n'.format(
+            self.count, '/'.join(str(len(nodes)) for nodes in members), len(self.cut)))
+        self.shards = [_Shard(self.spec, '{}{}'.format(self.name, part), self.log_dir)
+                       for part in range(self.count)]
+        try:
+            for reply in self._timed('build', [{'op': 'build', 'nodes': nodes}
+                                               for nodes in members]):
+                self.pids.update(reply['pids'])
+            intfs = self._link_cut()
+            self._timed('attach', [{'op': 'attach', 'intfs': part} for part in intfs])
+            failed = {}
+            for reply in self._timed('configure', [{'op': 'configure'}] * self.count):
+                failed.update(reply['failed'])
+        except Exception:
+            self.stop()
+            raise
+        info('*** sharded bring-up: {}\n'.format(', '.join(
+            '{} {:.2f}s'.format(phase, seconds) for phase, seconds in self.times.items())))
+        return failed
+
+    def cmds(self, items):
+        "Run [(node, command), ...] on all shards at once, returns the outputs in order"
+        per_shard = [[] for _ in self.shards]
+        for index, (node, command) in enumerate(items):
+            if node not in self.parts:
+                raise ShardError('no node {}'.format(node))
+            per_shard[self.parts[node]].append((index, node, command))
+        outputs = [None] * len(items)
+        replies = self._all([{'op': 'cmds', 'cmds': [[node, command] for _, node, command in part]}
+                             for part in per_shard])
+        for part, reply in zip(per_shard, replies):
+            for (index, _, _), output in zip(part, reply['outputs']):
+                outputs[index] = output
+        return outputs
+
+    def cmd(self, node, command):
+        "node.cmd() on the shard of `node`"
+        return self.cmds([(node, command)])[0]
+
+    def hosts(self):
+        return self.topo.hosts()
+
+    def stop(self):
+        for shard in self.shards:
+            shard.stop()
+        self.shards = []
+
+
+class ShardCLI(cmd.Cmd):
+    "Minimal CLI: '<node> <command>' like Mininet's, 'all <command>' on every host"
+
+    prompt = 'shards> '
+
+    def __init__(self, net):
+        cmd.Cmd.__init__(self)
+        self.net = net
+
+    def emptyline(self):
+        pass
+
+    def default(self, line):
+        node, _, command = line.partition(' ')
+        if node not in self.net.parts:
+            print('*** unknown node or command: {}'.format(node))
+            return
+        try:
+            sys.stdout.write(self.net.cmd(node, command))
+        except ShardError as error:
+            print('*** {}'.format(error))
+
+    def do_all(self, line):
+        "all <command>: run <command> on every host in parallel"
+        hosts = self.net.hosts()
+        start_time = time.time()
+        outputs = self.net.cmds([(host, line) for host in hosts])
+        for host, output in zip(hosts, outputs):
+            sys.stdout.write('{}: {}'.format(host, output if output.strip() else '\n'))
+        print('*** {} hosts in {:.2f}s'.format(len(hosts), time.time() - start_time))
+
+    def do_nodes(self, line):
+        "List the nodes and their shard"
+        for node, part in self.net.parts.items():
+            print('{} {}'.format(node, part))
+
+    def do_shards(self, line):
+        "Nodes per shard and the cut links"
+        for part in range(self.net.count):
+            print('shard {}: {}'.format(part, ' '.join(
+                node for node, where in self.net.parts.items() if where == part)))
+        for info in self.net.cut:
+            print('cut: {} - {}'.format(info['node1'], info['node2']))
+
+    def do_exit(self, line):
+        "Exit"
+        return True
+
+    do_EOF = do_exit
+
+
+def main():
+    if sys.argv[1:2] == ['worker']:
+        parser = argparse.ArgumentParser(prog='shard.py worker')
+        parser.add_argument('topo')
+        parser.add_argument('--name', default='shard')
+        args = parser.parse_args(sys.argv[2:])
+        worker_main(args.topo, args.name)
+        return
+
+    parser = argparse.ArgumentParser(description='Sharded Mininet')
+    parser.add_argument('topo', help="'gen:shape=chain,n=10' or 'file.py:Class[:KEY=value,...]'")
+    parser.add_argument('--shards', type=int, default=os.cpu_count(),
+                        help='worker processes (default: %(default)s)')
+    parser.add_argument('--exec', action='append', default=[], metavar="'NODE CMD'",
+                        help='run the commands (in parallel) and exit instead of the CLI')
+    args = parser.parse_args()
+
+    from mininet.log import setLogLevel
+    setLogLevel('info')
+    net = ShardedNet(args.topo, args.shards)
+    net.start()
+    try:
+        if args.exec:
+            items = [tuple(line.split(' ', 1)) for line in args.exec]
+            for (node, _), output in zip(items, net.cmds(items)):
+                sys.stdout.write('{}: {}'.format(node, output))
+        else:
+            ShardCLI(net).cmdloop()
+    finally:
+        net.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+"""
+Copyright 2023-present Martin Becke
+# SPDX-License-Identifier: Apache-2.0
+
+Per-interface counter telemetry.
+
+A Sampler thread reads the interface counters of every node namespace
+every `interval` seconds and the qdisc statistics ('tc -s -j qdisc show',
+backlog, drops, overlimits) every `qdisc_every` samples. The counters are
+those of /sys/class/net/<intf>/statistics, read from /proc/<pid>/net/dev
+of one node per namespace: one file per namespace instead of one per
+counter and interface, so hundreds of interfaces cost next to nothing.
+Nodes sharing a namespace (the OVS switches in the root namespace) are
+read once and split by their interface names.
+
+Every interface has a fixed-size ring buffer backed by one array('d'),
+rates are computed over a window of the latest samples.
+
+    sampler = Sampler(net, interval=1)
+    sampler.start()
+    install_cli(sampler)        # adds 'telemetry' to the Mininet CLI
+    ...
+    sampler.export('telemetry.json')
+    sampler.stop()
+"""
+
+import json
+import os
+import subprocess
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from mininet.cli import CLI
+from mininet.log import debug, output
+
+# /proc/net/dev columns (after the interface name) we keep
+NETDEV_FIELDS = OrderedDict([
+    ('rx_bytes', 0), ('rx_packets', 1), ('rx_errors', 2), ('rx_dropped', 3),
+    ('tx_bytes', 8), ('tx_packets', 9), ('tx_errors', 10), ('tx_dropped', 11),
+])
+QDISC_FIELDS = ('qdisc_backlog', 'qdisc_qlen', 'qdisc_drops', 'qdisc_overlimits',
+                'qdisc_requeues')
+# a sample: time, the counters, the qdisc values (NaN until first read)
+FIELDS = ('time',) + tuple(NETDEV_FIELDS) + QDISC_FIELDS
+# counters reported as per second rates, the rest as last value
+RATE_FIELDS = tuple(NETDEV_FIELDS) + ('qdisc_drops', 'qdisc_overlimits', 'qdisc_requeues')
+
+CAPACITY = 600
+INTERVAL = 1.0
+QDISC_EVERY = 5
+
+
+class Ring(object):
+    "Fixed-size ring of samples of one interface, one flat array('d')"
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.width = len(FIELDS)
+        self.data = array('d', [0.0]) * (capacity * self.width)
+        self.count = 0
+        self.head = 0
+
+    def append(self, values):
+        offset = self.head * self.width
+        self.data[offset:offset + self.width] = array('d', values)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def sample(self, age=0):
+        "The sample `age` steps back (0: the latest) as a tuple"
+        if age >= self.count:
+            raise IndexError('ring has {} samples'.format(self.count))
+        offset = ((self.head - 1 - age) % self.capacity) * self.width
+        return tuple(self.data[offset:offset + self.width])
+
+    def samples(self):
+        "All samples, oldest first"
+        return [self.sample(age) for age in range(self.count - 1, -1, -1)]
+
+    def rates(self, window=1):
+        """
+        Per second rates of the counters over the last `window` intervals
+        and the latest qdisc backlog/qlen, None with less than 2 samples.
+        """
+        if self.count < 2:
+            return None
+        window = min(window, self.count - 1)
+        new, old = self.sample(0), self.sample(window)
+        elapsed = new[0] - old[0]
+        result = OrderedDict()
+        for i, name in enumerate(FIELDS[1:], 1):
+            if name in RATE_FIELDS:
+                delta = new[i] - old[i]
+                # NaN (no qdisc read yet) or counter reset
+                if delta != delta or delta < 0 or elapsed <= 0:
+                    result[name] = None
+                else:
+                    result[name] = delta / elapsed
+            else:
+                result[name] = None if new[i] != new[i] else new[i]
+        return result
+
+
+def parse_netdev(text):
+    "/proc/net/dev content -> {intf: [counter values in NETDEV_FIELDS order]}"
+    columns = list(NETDEV_FIELDS.values())
+    result = {}
+    for line in text.splitlines()[2:]:
+        name, _, values = line.partition(':')
+        values = values.split()
+        if len(values) >= 16:
+            result[name.strip()] = [float(values[c]) for c in columns]
+    return result
+
+
+def parse_qdisc(text):
+    "'tc -s -j qdisc show' output -> {intf: [QDISC_FIELDS values]} of root qdiscs"
+    result = {}
+    try:
+        qdiscs = json.loads(text or '[]')
+    except ValueError:
+        return result
+    for qdisc in qdiscs:
+        if not qdisc.get('root'):
+            continue
+        result[qdisc['dev']] = [float(qdisc.get('backlog', 0)), float(qdisc.get('qlen', 0)),
+                                float(qdisc.get('drops', 0)), float(qdisc.get('overlimits', 0)),
+                                float(qdisc.get('requeues', 0))]
+    return result
+
+
+class Sampler(object):
+    "Samples the interfaces of all nodes of `net` in a background thread"
+
+    def __init__(self, net, interval=INTERVAL, capacity=CAPACITY,
+                 qdisc_every=QDISC_EVERY):
+        self.net = net
+        self.interval = interval
+        self.capacity = capacity
+        self.qdisc_every = qdisc_every
+        self.rings = OrderedDict()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.namespaces = self._namespaces()
+        self.qdisc = {}
+        self.cpu = 0.0
+        self.ticks = 0
+
+    def _namespaces(self):
+        "netns id -> (a node in it, {intf: ring name})"
+        namespaces = OrderedDict()
+        for node in self.net.hosts + self.net.switches:
+            try:
+                nsid = os.readlink('/proc/{}/ns/net'.format(node.pid))
+            except OSError:
+                continue
+            _, intfs = namespaces.setdefault(nsid, (node, {}))
+            for intf in node.intfNames():
+                if intf != 'lo':
+                    intfs[intf] = '{}:{}'.format(node.name, intf)
+        return namespaces
+
+    def _read_qdisc(self, node):
+        proc = node.popen(['tc', '-s', '-j', 'qdisc', 'show'],
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        text, _ = proc.communicate()
+        return parse_qdisc(text.decode(errors='replace'))
+
+    def sample(self, qdisc=False):
+        "Take one sample of every interface"
+        nan = float('nan')
+        if qdisc:
+            nodes = [node for node, _ in self.namespaces.values()]
+            workers = min(16, max(1, len(nodes)))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                stats = list(pool.map(self._read_qdisc, nodes))
+            self.qdisc = dict(zip(self.namespaces, stats))
+        for nsid, (node, intfs) in self.namespaces.items():
+            try:
+                with open('/proc/{}/net/dev'.format(node.pid)) as f:
+                    counters = parse_netdev(f.read())
+            except OSError:
+                continue
+            now = time.time()
+            qdiscs = self.qdisc.get(nsid, {})
+            with self.lock:
+                for intf, name in intfs.items():
+                    if intf not in counters:
+                        continue
+                    ring = self.rings.get(name)
+                    if ring is None:
+                        ring = self.rings[name] = Ring(self.capacity)
+                    qvalues = qdiscs.get(intf)
+                    if qvalues is None:
+                        # keep the last qdisc values between tc reads
+                        qvalues = ring.sample()[-len(QDISC_FIELDS):] if ring.count \
+                            else [nan] * len(QDISC_FIELDS)
+                    ring.append([now] + counters[intf] + list(qvalues))
+
+    def _run(self):
+        next_time = time.time()
+        while not self.stopped.is_set():
+            start_cpu = time.process_time()
+            try:
+                self.sample(qdisc=self.qdisc_every and self.ticks % self.qdisc_every == 0)
+            except Exception as error:  # keep sampling, this is a monitor
+                debug('*** telemetry sample failed: {}\n'.format(error))
+            self.ticks += 1
+            self.cpu += time.process_time() - start_cpu
+            next_time += self.interval
+            self.stopped.wait(max(0, next_time - time.time()))
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name='telemetry', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def rates(self, window=1, match=None):
+        "{'node:intf': rates} of the interfaces (containing `match`)"
+        with self.lock:
+            return OrderedDict((name, ring.rates(window)) for name, ring in self.rings.items()
+                               if match is None or match in name)
+
+    def top(self, count=10, window=1, key=None):
+        "The `count` busiest interfaces by tx+rx bytes/s (or rates[`key`])"
+        def busy(item):
+            rates = item[1]
+            if key is not None:
+                return rates.get(key) or 0
+            return (rates['rx_bytes'] or 0) + (rates['tx_bytes'] or 0)
+        rates = [item for item in self.rates(window).items() if item[1] is not None]
+        return sorted(rates, key=busy, reverse=True)[:count]
+
+    def to_dict(self, window=1, samples=False):
+        "JSON-ready rates (and raw samples) of every interface"
+        result = OrderedDict([
+            ('interval', self.interval), ('ticks', self.ticks),
+            ('cpu_seconds', self.cpu), ('fields', FIELDS),
+            ('rates', self.rates(window)),
+        ])
+        if samples:
+            with self.lock:
+                # NaN (qdisc not read yet) is not JSON
+                result['samples'] = OrderedDict(
+                    (name, [[None if value != value else value for value in sample]
+                            for sample in ring.samples()])
+                    for name, ring in self.rings.items())
+        return result
+
+    def export(self, path, window=1, samples=True):
+        "Write to_dict() to `path`"
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(window, samples), f, indent=1)
+        return path
+
+
+def _bps(value):
+    if value is None:
+        return '-'
+    for unit in ('', 'k', 'M', 'G'):
+        if value < 1000:
+            return '{:.1f}{}'.format(value, unit)
+        value /= 1000.0
+    return '{:.1f}T'.format(value)
+
+
+def format_rates(items):
+    "Table of (name, rates) pairs"
+    lines = ['{:<16} {:>9} {:>9} {:>8} {:>8} {:>7} {:>7} {:>8} {:>7}'.format(
+        'interface', 'rx bit/s', 'tx bit/s', 'rx pk/s', 'tx pk/s', 'drop/s',
+        'qdrop/s', 'backlog', 'qlen')]
+    for name, rates in items:
+        if rates is None:
+            lines.append('{:<16} (collecting)'.format(name))
+            continue
+        drops = (rates['rx_dropped'] or 0) + (rates['tx_dropped'] or 0)
+        lines.append('{:<16} {:>9} {:>9} {:>8} {:>8} {:>7} {:>7} {:>8} {:>7}'.format(
+            name, _bps(8 * rates['rx_bytes']), _bps(8 * rates['tx_bytes']),
+            _bps(rates['rx_packets']), _bps(rates['tx_packets']), _bps(drops),
+            _bps(rates['qdisc_drops']), _bps(rates['qdisc_backlog']),
+            _bps(rates['qdisc_qlen'])))
+    return '\n'.join(lines)
+
+
+def install_cli(sampler):
+    """
+    Add the 'telemetry' command to the Mininet CLI:
+
+        telemetry                 all interfaces
+        telemetry top [N]         the N busiest interfaces
+        telemetry <match>         interfaces whose node:intf contains match
+        telemetry json <file>     export rates and samples
+        telemetry window <N>      rates over the last N intervals
+    """
+    state = {'window': 1}
+
+    def do_telemetry(self, line):
+        "Interface rates from the telemetry sampler, see 'help telemetry'"
+        args = line.split()
+        if args[:1] == ['top']:
+            items = sampler.top(int(args[1]) if len(args) > 1 else 10, state['window'])
+        elif args[:1] == ['json'] and len(args) == 2:
+            output('wrote {}\n'.format(sampler.export(args[1], state['window'])))
+            return
+        elif args[:1] == ['window'] and len(args) == 2:
+            state['window'] = max(1, int(args[1]))
+            output('rates over {} intervals\n'.format(state['window']))
+            return
+        else:
+            items = sampler.rates(state['window'], args[0] if args else None).items()
+        output(format_rates(items) + '\n')
+        output('{} samples, {:.3f} s CPU\n'.format(sampler.ticks, sampler.cpu))
+
+    do_telemetry.__doc__ = install_cli.__doc__
+    CLI.do_telemetry = do_telemetry
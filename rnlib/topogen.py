@@ -0,0 +1,197 @@
+"""
+Copyright 2023-present Martin Becke
+# SPDX-License-Identifier: Apache-2.0
+
+Parameterized router topologies.
+
+GenTopo builds chain, ring, tree, fat-tree and random-mesh networks of N
+routers with the naming of topo-base's RTopo:
+
+* routers r1..rN, every router ri has a host hi on ri-eth0
+* router-router links use ri-eth1, ri-eth2, ... in link order
+
+and its addressing roles: the router is .1 and the host .10 on the host
+LAN, the lower numbered router is .1 and the other .2 on a link. To scale
+past RTopo's 10.0.{10*i}.0/24 scheme the /24s come from two pools:
+
+* host LAN of ri:  10.{1 + i // 256}.{i % 256}.0/24
+* k-th link:       10.{128 + k // 256}.{k % 256}.0/24
+
+    topo = GenTopo(shape='ring', n=20)
+    net = Mininet(topo=topo)
+    net.start()
+    conf = NetConfig()
+    configure(net, conf)
+    conf.apply()
+"""
+
+import random
+
+from mininet.link import TCLink
+from mininet.topo import Topo
+
+from rnlib import routing
+
+SHAPES = ('chain', 'ring', 'tree', 'fattree', 'mesh')
+
+HOST_POOL = 1
+LINK_POOL = 128
+
+
+def subnet(pool, index):
+    "The index-th /24 of a pool, as '10.a.b.'"
+    return '10.{}.{}.'.format(pool + index // 256, index % 256)
+
+
+def fattree_size(k):
+    "Number of routers of a k-ary fat-tree: (k/2)^2 core, k pods of k switches"
+    return 5 * k * k // 4
+
+
+def fattree_k(n):
+    "Largest even k whose fat-tree has at most `n` routers"
+    if n < fattree_size(2):
+        raise ValueError('a fat-tree needs at least {} routers, got {}'.format(
+            fattree_size(2), n))
+    k = 2
+    while fattree_size(k + 2) <= n:
+        k += 2
+    return k
+
+
+def router_edges(shape, n, fanout=2, k=None, degree=3, seed=0):
+    """
+    Router adjacency of a topology as [(i, j), ...] with 1 <= i < j <= n.
+    For 'fattree' n is replaced by the size of the k-ary fat-tree (see
+    fattree_k()), returns (n, edges).
+    """
+    if shape not in SHAPES:
+        raise ValueError('unknown shape {}, use one of {}'.format(shape, ', '.join(SHAPES)))
+    edges = []
+    if shape in ('chain', 'ring'):
+        edges = [(i, i + 1) for i in range(1, n)]
+        if shape == 'ring' and n > 2:
+            edges.append((1, n))
+    elif shape == 'tree':
+        edges = [((i - 2) // fanout + 1, i) for i in range(2, n + 1)]
+    elif shape == 'fattree':
+        if k is None:
+            k = fattree_k(n)
+        elif k < 2 or k % 2:
+            raise ValueError('fat-tree arity must be even and at least 2, got {}'.format(k))
+        half = k // 2
+        core = half * half
+        n = fattree_size(k)
+        for pod in range(k):
+            # routers of a pod: half aggregation, then half edge
+            agg = [core + pod * k + a + 1 for a in range(half)]
+            edge = [core + pod * k + half + e + 1 for e in range(half)]
+            for a, router in enumerate(agg):
+                edges.extend((router, e) for e in edge)
+                edges.extend((c + 1, router) for c in range(a * half, (a + 1) * half))
+    elif shape == 'mesh':
+        rnd = random.Random(seed)
+        # random spanning tree, then random extra links up to the average degree
+        present = set()
+        for i in range(2, n + 1):
+            present.add((rnd.randint(1, i - 1), i))
+        wanted = min(n * (n - 1) // 2, max(n - 1, n * degree // 2))
+        while len(present) < wanted:
+            i, j = sorted(rnd.sample(range(1, n + 1), 2))
+            present.add((i, j))
+        edges = sorted(present)
+    return n, sorted(edges)
+
+
+class GenTopo(Topo):
+    "Routers in a given shape, one host per router"
+
+    def build(self, shape='chain', n=5, fanout=2, k=None, degree=3, seed=0,
+              bw=None, delay=None, **_opts):
+        self.shape = shape
+        self.n, self.edges = router_edges(shape, n, fanout, k, degree, seed)
+        # (node, interface) -> 'a.b.c.d/len' and host -> default gateway
+        self.addressing = {}
+        self.gateways = {}
+        self.routers = ['r{}'.format(i) for i in range(1, self.n + 1)]
+        self.hostnames = ['h{}'.format(i) for i in range(1, self.n + 1)]
+
+        linkopts = {}
+        if bw is not None or delay is not None:
+            linkopts = dict(cls=TCLink, bw=bw, delay=delay)
+
+        for i in range(1, self.n + 1):
+            router = self.addHost('r{}'.format(i))
+            host = self.addHost('h{}'.format(i))
+            net = subnet(HOST_POOL, i)
+            self.addLink(host, router, intfName1='{}-eth0'.format(host),
+                         intfName2='{}-eth0'.format(router))
+            self.addressing[(router, '{}-eth0'.format(router))] = net + '1/24'
+            self.addressing[(host, '{}-eth0'.format(host))] = net + '10/24'
+            self.gateways[host] = net + '1'
+
+        ports = dict((router, 1) for router in self.routers)
+        for index, (i, j) in enumerate(self.edges):
+            r1, r2 = 'r{}'.format(i), 'r{}'.format(j)
+            intf1 = '{}-eth{}'.format(r1, ports[r1])
+            intf2 = '{}-eth{}'.format(r2, ports[r2])
+            ports[r1] += 1
+            ports[r2] += 1
+            self.addLink(r1, r2, intfName1=intf1, intfName2=intf2, **linkopts)
+            net = subnet(LINK_POOL, index)
+            self.addressing[(r1, intf1)] = net + '1/24'
+            self.addressing[(r2, intf2)] = net + '2/24'
+
+
+def setup_ip(net, conf):
+    "Queue addresses, forwarding and host default routes of a GenTopo net"
+    topo = net.topo
+    for (name, intf), cidr in sorted(topo.addressing.items()):
+        conf.address(net[name], intf, cidr)
+    for name in topo.routers:
+        router = net[name]
+        conf.sysctl(router, 'net.ipv4.ip_forward', 1)
+        for intf in router.intfNames():
+            if intf != 'lo':
+                conf.sysctl(router, 'net.ipv4.conf.{}.rp_filter'.format(intf), 0)
+    for name, gateway in topo.gateways.items():
+        conf.route(net[name], 'default', via=gateway)
+
+
+def setup_route(net, conf, aggregate=False):
+    "Queue the static routes of all routers, returns the route table"
+    table = routing.cached_routes(net.topo, conf.addresses, net.topo.routers, aggregate)
+    routing.install_routes(net, conf, table)
+    return table
+
+
+def configure(net, conf, aggregate=False):
+    "setup_ip() and setup_route(), apply `conf` afterwards"
+    setup_ip(net, conf)
+    return setup_route(net, conf, aggregate)
+
+
+def add_arguments(parser):
+    "Add the topology options to an argparse parser"
+    parser.add_argument('--shape', choices=SHAPES, default='chain',
+                        help='router topology (default: %(default)s)')
+    parser.add_argument('--n', type=int, default=5,
+                        help='number of routers (fat-tree: upper bound)')
+    parser.add_argument('--fanout', type=int, default=2, help='tree fanout')
+    parser.add_argument('--k', type=int, default=None,
+                        help='fat-tree arity (even), derived from --n if not given')
+    parser.add_argument('--degree', type=int, default=3,
+                        help='average router degree of the random mesh')
+    parser.add_argument('--seed', type=int, default=0, help='random mesh seed')
+    parser.add_argument('--bw', type=float, default=None,
+                        help='router link bandwidth in Mbit/s (TCLink)')
+    parser.add_argument('--delay', default=None,
+                        help="router link delay, e.g. '0.1ms' (TCLink)")
+
+
+def topo_from_args(args, **overrides):
+    "GenTopo from parsed add_arguments() options"
+    opts = dict(shape=args.shape, n=args.n, fanout=args.fanout, k=args.k,
+                degree=args.degree, seed=args.seed, bw=args.bw, delay=args.delay)
+    opts.update(overrides)
+    return GenTopo(**opts)
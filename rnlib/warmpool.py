@@ -0,0 +1,628 @@
+"""
+Copyright 2023-present Martin Becke
+# SPDX-License-Identifier: Apache-2.0
+
+Warm pool of pre-built topologies.
+
+Building a topology (namespaces, veths, bridges, addresses, routes)
+takes seconds to minutes at larger N. The pool server keeps `size`
+instances of a topology built and configured and hands them out over a
+Unix socket; a released instance is reset to the state right after its
+setup and goes back into the pool:
+
+    $ sudo python3 rnlib/warmpool.py serve topo02/topo02.py:RTopo:N=10 --size 3
+    $ sudo python3 rnlib/warmpool.py run h0 ping -c1 10.0.100.10
+    $ sudo python3 rnlib/warmpool.py status
+
+or from Python:
+
+    with PoolClient() as client, client.acquire() as lease:
+        print(lease.cmd('h0', 'ip route'))
+        # lease.nodes: name -> pid, 'nsenter -t <pid> -n' enters a node
+
+Topologies are given as
+
+    gen:shape=ring,n=20             rnlib.topogen.GenTopo, topogen.configure()
+    path/file.py:Class[:KEY=value,...]
+                                    Class of file.py; upper case keys set
+                                    module globals (topo02's N), the others
+                                    are build() parameters. The module's
+                                    configure(net, conf) is run if it has one
+
+Every instance runs in a worker process of its own, started with
+'unshare --net', so the instances can use the same interface names
+side by side. Linux bridges are used instead of OVS switches (OVS has a
+single, host-wide bridge namespace) and there is no controller.
+
+Reset kills the processes started in the nodes since the setup and
+restores the setup-time Checkpoint with prune=True: routes, addresses,
+links and qdiscs added meanwhile are deleted, changed ones are put back,
+FRR gets its setup-time running-config. It takes one batch per node, not
+a rebuild. An instance where the reset leaves differences is stopped
+and replaced by a new one. A lease ends with 'release' or when the
+client's connection closes.
+
+The socket is in the private (0700, root's when run with sudo) RUN_DIR:
+whoever may connect can run commands as root in the nodes.
+"""
+
+import argparse
+import importlib.util
+import itertools
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import subprocess
+import sys
+import threading
+import time
+from collections import deque, OrderedDict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
+
+from rnlib.cleanup import RUN_DIR, _alive, _check_private, _netns, private_dir
+
+SOCKET = os.path.join(RUN_DIR, 'warmpool.sock')
+# Seconds the processes killed on reset get to go away
+GRACE = 1.0
+
+
+class PoolError(Exception):
+    pass
+
+
+def _value(text):
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return text
+
+
+def _params(text):
+    "'a=1,b=x' -> {'a': 1, 'b': 'x'}"
+    params = OrderedDict()
+    for item in filter(None, text.split(',')):
+        key, sep, value = item.partition('=')
+        if not sep:
+            raise ValueError('expected key=value, got {!r}'.format(item))
+        params[key.strip()] = _value(value.strip())
+    return params
+
+
+def load_topology(spec):
+    """
+    The Topo and the configure(net, conf) function of a topology spec
+    (see the module docstring), configure is None if there is none.
+    """
+    if spec == 'gen' or spec.startswith('gen:'):
+        from rnlib import topogen
+        return topogen.GenTopo(**_params(spec[4:])), topogen.configure
+    path, sep, rest = spec.partition(':')
+    if not sep or not path.endswith('.py'):
+        raise ValueError('topology {!r}: expected gen:... or file.py:Class'.format(spec))
+    classname, _, params = rest.partition(':')
+    module_spec = importlib.util.spec_from_file_location(
+        'warmpool_{}'.format(os.path.basename(path)[:-3]), path)
+    module = importlib.util.module_from_spec(module_spec)
+    module_spec.loader.exec_module(module)
+    build = OrderedDict()
+    for key, value in _params(params).items():
+        if key.isupper():
+            setattr(module, key, value)
+        else:
+            build[key] = value
+    return getattr(module, classname)(**build), getattr(module, 'configure', None)
+
+
+def _namespace_pids(namespaces):
+    "pids of the processes in the network namespaces `namespaces`"
+    pids = set()
+    for entry in os.listdir('/proc'):
+        if entry.isdigit() and _netns(entry) in namespaces:
+            pids.add(int(entry))
+    return pids
+
+
+class Worker(object):
+    "One pre-built instance, runs in its own network namespace"
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.net = None
+        self.baseline = None
+        self.namespaces = set()
+        self.pids = set()
+
+    def start(self):
+        from mininet.link import TCLink
+        from mininet.net import Mininet
+        from mininet.nodelib import LinuxBridge
+        from rnlib.checkpoint import Checkpoint
+        from rnlib.netconf import NetConfig
+
+        subprocess.call(['ip', 'link', 'set', 'lo', 'up'])
+        topo, configure = load_topology(self.spec)
+        self.net = Mininet(topo=topo, link=TCLink, switch=LinuxBridge,
+                           controller=None, autoSetMacs=True)
+        self.net.start()
+        if configure is not None:
+            conf = NetConfig()
+            configure(self.net, conf)
+            conf.apply()
+        self.baseline = Checkpoint.capture(self.net)
+        self.namespaces = set(_netns(node.pid) for node in self.net.hosts)
+        self.pids = _namespace_pids(self.namespaces)
+
+    def info(self):
+        return {'pid': os.getpid(),
+                'nodes': OrderedDict((node.name, node.pid) for node in self.net.hosts)}
+
+    def _kill_strays(self):
+        "Kill what was started in the nodes after the setup, returns the count"
+        strays = _namespace_pids(self.namespaces) - self.pids
+        for pid in strays:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+        deadline = time.time() + GRACE
+        while time.time() < deadline and any(_alive(pid) for pid in strays):
+            time.sleep(0.01)
+        return len(strays)
+
+    def reset(self):
+        "Back to the setup state, not ok if something could not be reset"
+        start_time = time.time()
+        killed = self._kill_strays()
+        problems = self.baseline.restore(self.net, prune=True)
+        reply = {'ok': not problems, 'killed': killed, 'problems': problems,
+                 'seconds': time.time() - start_time}
+        if problems:
+            reply['error'] = 'reset left differences on {}'.format(', '.join(problems))
+        return reply
+
+    def handle(self, request):
+        op = request.get('op')
+        if op == 'cmd':
+            if request.get('node') not in self.net:
+                return {'ok': False, 'error': 'no node {}'.format(request.get('node'))}
+            return {'ok': True, 'output': self.net[request['node']].cmd(request['cmd'])}
+        if op == 'reset':
+            return self.reset()
+        return {'ok': False, 'error': 'unknown op {!r}'.format(op)}
+
+    def stop(self):
+        if self.net is not None:
+            self.net.stop()
+            self.net = None
+
+
+def worker_main(spec):
+    """
+    Worker process: build `spec`, report on stdout and serve requests
+    from stdin, one JSON object per line. Everything else that is
+    written to stdout goes to stderr.
+    """
+    from mininet.log import setLogLevel
+
+    replies = os.fdopen(os.dup(1), 'w', buffering=1)
+    os.dup2(2, 1)
+    setLogLevel('info')
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    def reply(data):
+        replies.write(json.dumps(data) + '\n')
+
+    worker = Worker(spec)
+    try:
+        start_time = time.time()
+        try:
+            worker.start()
+        except Exception as error:
+            reply({'ok': False, 'error': '{}: {}'.format(type(error).__name__, error)})
+            raise
+        ready = worker.info()
+        ready.update(ok=True, seconds=time.time() - start_time)
+        reply(ready)
+        for line in sys.stdin:
+            request = json.loads(line)
+            if request.get('op') == 'stop':
+                break
+            try:
+                reply(worker.handle(request))
+            except Exception as error:
+                reply({'ok': False, 'error': '{}: {}'.format(type(error).__name__, error)})
+    finally:
+        worker.stop()
+
+
+class Instance(object):
+    "Pool side of a worker process"
+
+    def __init__(self, spec, name, log_dir=RUN_DIR):
+        self.spec = spec
+        self.name = name
+        self.info = None
+        self.lock = threading.Lock()
+        private_dir(log_dir)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+        with open(os.path.join(log_dir, '{}.log'.format(name)), 'w') as log:
+            self.proc = subprocess.Popen(
+                ['unshare', '--net', '--', sys.executable, '-m', 'rnlib.warmpool',
+                 'worker', spec],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=log, env=env,
+                universal_newlines=True, bufsize=1)
+
+    def wait_ready(self):
+        "Wait until the instance is built, returns its info (or raises PoolError)"
+        line = self.proc.stdout.readline()
+        reply = json.loads(line) if line else {'ok': False, 'error': 'worker exited'}
+        if not reply.get('ok'):
+            self.stop()
+            raise PoolError('{}: {}'.format(self.name, reply.get('error')))
+        self.info = reply
+        return reply
+
+    def request(self, data):
+        with self.lock:
+            try:
+                self.proc.stdin.write(json.dumps(data) + '\n')
+                self.proc.stdin.flush()
+                line = self.proc.stdout.readline()
+            except (OSError, ValueError):
+                line = ''
+        return json.loads(line) if line else {'ok': False, 'error': 'worker exited'}
+
+    def stop(self, timeout=30):
+        if self.proc.poll() is None:
+            try:
+                with self.lock:
+                    self.proc.stdin.write('{"op": "stop"}\n')
+                    self.proc.stdin.close()
+                self.proc.wait(timeout)
+            except (OSError, ValueError, subprocess.TimeoutExpired):
+                self.proc.terminate()
+                self.proc.wait()
+
+
+class WarmPool(object):
+    """
+    Keeps `size` instances of `spec` ready (or being built/reset), at
+    most `limit` instances exist at a time
+    """
+
+    def __init__(self, spec, size=2, limit=None, log_dir=RUN_DIR):
+        self.spec = spec
+        self.size = size
+        self.limit = limit or 2 * size
+        self.log_dir = log_dir
+        self.cond = threading.Condition()
+        self.ready = deque()
+        self.leased = {}
+        self.building = 0
+        self.resetting = 0
+        self.retired = 0
+        self.error = None
+        self.closed = False
+        self.numbers = itertools.count(1)
+        self.leases = itertools.count(1)
+
+    def _fill(self):
+        "Start building the missing instances, called with the lock held"
+        total = len(self.ready) + len(self.leased) + self.building + self.resetting
+        missing = min(self.size - len(self.ready) - self.building - self.resetting,
+                      self.limit - total)
+        for _ in range(max(0, missing)):
+            self.building += 1
+            self.error = None
+            name = 'warmpool-{}-{}'.format(os.getpid(), next(self.numbers))
+            threading.Thread(target=self._build, args=(name,), daemon=True).start()
+
+    def fill(self):
+        with self.cond:
+            self._fill()
+
+    def _build(self, name):
+        instance = None
+        try:
+            instance = Instance(self.spec, name, self.log_dir)
+            instance.wait_ready()
+        except (OSError, PoolError) as error:
+            with self.cond:
+                self.building -= 1
+                self.error = str(error)
+                self.cond.notify_all()
+            return
+        with self.cond:
+            self.building -= 1
+            if not self.closed:
+                self.ready.append(instance)
+                self.cond.notify_all()
+                return
+        instance.stop()
+
+    def acquire(self, timeout=None):
+        "(lease id, Instance) of a ready instance, waits for one"
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.cond:
+            self._fill()
+            while not self.ready:
+                if self.closed:
+                    raise PoolError('pool closed')
+                if self.error and not self.building and not self.resetting:
+                    raise PoolError(self.error)
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise PoolError('no instance of {} ready within {}s'.format(
+                        self.spec, timeout))
+                self.cond.wait(remaining)
+            instance = self.ready.popleft()
+            lease = next(self.leases)
+            self.leased[lease] = instance
+            self._fill()
+        return lease, instance
+
+    def release(self, lease):
+        "Reset the instance of `lease` in the background and put it back"
+        with self.cond:
+            instance = self.leased.pop(lease, None)
+            if instance is None:
+                raise PoolError('unknown lease {}'.format(lease))
+            self.resetting += 1
+        threading.Thread(target=self._reset, args=(instance,), daemon=True).start()
+
+    def _reset(self, instance):
+        "Reset a released instance, one that does not reset cleanly is replaced"
+        reply = instance.request({'op': 'reset'})
+        keep = reply.get('ok') and not self.closed
+        retire = not reply.get('ok') and not self.closed
+        if retire:
+            sys.stderr.write('*** {}: retired: {}\n'.format(instance.name, reply.get('error')))
+        with self.cond:
+            self.resetting -= 1
+            if retire:
+                self.retired += 1
+            if keep and len(self.ready) < self.size:
+                self.ready.append(instance)
+                self.cond.notify_all()
+                instance = None
+            self._fill()
+        if instance is not None:
+            instance.stop()
+
+    def status(self):
+        with self.cond:
+            return {'ready': len(self.ready), 'leased': len(self.leased),
+                    'building': self.building, 'resetting': self.resetting,
+                    'retired': self.retired,
+                    'size': self.size, 'limit': self.limit, 'error': self.error}
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            instances = list(self.ready) + list(self.leased.values())
+            self.ready.clear()
+            self.leased.clear()
+            self.cond.notify_all()
+        for instance in instances:
+            instance.stop()
+
+
+class PoolRequestHandler(socketserver.StreamRequestHandler):
+    "One client connection, JSON requests and replies one per line"
+
+    def handle(self):
+        # lease id -> pool of the leases of this connection
+        self.leases = {}
+        try:
+            for line in self.rfile:
+                try:
+                    reply = self.dispatch(json.loads(line.decode()))
+                except (PoolError, ValueError, KeyError) as error:
+                    reply = {'ok': False, 'error': str(error)}
+                self.wfile.write((json.dumps(reply) + '\n').encode())
+        finally:
+            for lease, pool in self.leases.items():
+                pool.release(lease)
+
+    def _pool(self, spec):
+        pools = self.server.pools
+        if spec is None and len(pools) == 1:
+            return next(iter(pools.values()))
+        if spec not in pools:
+            raise PoolError('no pool for {!r}, serving: {}'.format(spec, ', '.join(pools)))
+        return pools[spec]
+
+    def _lease(self, request):
+        lease = request['lease']
+        if lease not in self.leases:
+            raise PoolError('unknown lease {}'.format(lease))
+        return lease, self.leases[lease]
+
+    def dispatch(self, request):
+        op = request.get('op')
+        if op == 'acquire':
+            start_time = time.time()
+            pool = self._pool(request.get('topo'))
+            lease, instance = pool.acquire(request.get('timeout'))
+            self.leases[lease] = pool
+            return {'ok': True, 'lease': lease, 'topo': pool.spec,
+                    'pid': instance.info['pid'], 'nodes': instance.info['nodes'],
+                    'wait': time.time() - start_time}
+        if op == 'cmd':
+            lease, pool = self._lease(request)
+            return pool.leased[lease].request(
+                {'op': 'cmd', 'node': request['node'], 'cmd': request['cmd']})
+        if op == 'release':
+            lease, pool = self._lease(request)
+            del self.leases[lease]
+            pool.release(lease)
+            return {'ok': True}
+        if op == 'status':
+            return {'ok': True, 'pools': OrderedDict(
+                (spec, pool.status()) for spec, pool in self.server.pools.items())}
+        raise PoolError('unknown op {!r}'.format(op))
+
+
+class PoolServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    "Serves the `pools` (spec -> WarmPool) on the Unix socket `path`"
+
+    daemon_threads = True
+
+    def __init__(self, path, pools, mode=0o600):
+        self.pools = pools
+        private_dir(os.path.dirname(path))
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            pass
+        else:
+            # only a stale socket of ours is replaced
+            _check_private(path, st)
+            if not stat.S_ISSOCK(st.st_mode):
+                raise PermissionError('{} exists and is not a socket'.format(path))
+            os.unlink(path)
+        socketserver.UnixStreamServer.__init__(self, path, PoolRequestHandler)
+        os.chmod(path, mode)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        for pool in self.pools.values():
+            pool.close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+class Lease(object):
+    "An acquired instance; nodes: name -> pid of the node shell"
+
+    def __init__(self, client, reply):
+        self.client = client
+        self.id = reply['lease']
+        self.topo = reply['topo']
+        self.pid = reply['pid']
+        self.nodes = reply['nodes']
+        self.wait = reply['wait']
+
+    def cmd(self, node, command):
+        "Run `command` in the shell of `node` (node.cmd()), returns the output"
+        return self.client.request('cmd', lease=self.id, node=node, cmd=command)['output']
+
+    def release(self):
+        if self.id is not None:
+            self.client.request('release', lease=self.id)
+            self.id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class PoolClient(object):
+    "Connection to a PoolServer"
+
+    def __init__(self, path=SOCKET):
+        # the server's directory is private, nobody else can have put the socket there
+        directory = os.path.dirname(path)
+        _check_private(directory, os.lstat(directory))
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.file = self.sock.makefile('rw', buffering=1)
+
+    def request(self, op, **params):
+        params['op'] = op
+        self.file.write(json.dumps(params) + '\n')
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise PoolError('pool server closed the connection')
+        reply = json.loads(line)
+        if not reply.get('ok'):
+            raise PoolError(reply.get('error'))
+        return reply
+
+    def acquire(self, topo=None, timeout=None):
+        return Lease(self, self.request('acquire', topo=topo, timeout=timeout))
+
+    def status(self):
+        return self.request('status')['pools']
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Warm pool of pre-built topologies')
+    parser.add_argument('--socket', default=SOCKET, help='default: %(default)s')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='build and serve the topologies')
+    serve.add_argument('topos', nargs='+', metavar='TOPO',
+                       help="'gen:shape=chain,n=10' or 'file.py:Class[:KEY=value,...]'")
+    serve.add_argument('--size', type=int, default=2,
+                       help='ready instances per topology (default: %(default)s)')
+    serve.add_argument('--limit', type=int, default=None,
+                       help='instances per topology at most (default: 2 * size)')
+    run = commands.add_parser('run', help='run a command in a node of a pooled instance')
+    run.add_argument('--topo', default=None, help='needed if more than one is served')
+    run.add_argument('--timeout', type=float, default=None)
+    run.add_argument('node')
+    run.add_argument('cmd', nargs=argparse.REMAINDER)
+    commands.add_parser('status', help='print the pool status')
+    worker = commands.add_parser('worker', help=argparse.SUPPRESS)
+    worker.add_argument('topo')
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        worker_main(args.topo)
+    elif args.command == 'serve':
+        from mininet.log import setLogLevel, info
+        setLogLevel('info')
+        pools = OrderedDict()
+        for spec in args.topos:
+            path, sep, rest = spec.partition(':')
+            if sep and path.endswith('.py'):
+                # the workers may run in another directory
+                spec = '{}:{}'.format(os.path.abspath(path), rest)
+            pools[spec] = WarmPool(spec, args.size, args.limit)
+            pools[spec].fill()
+        server = PoolServer(args.socket, pools)
+        info('*** warm pool serving {} on {}\n'.format(', '.join(pools), args.socket))
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    elif args.command == 'run':
+        with PoolClient(args.socket) as client, \
+                client.acquire(args.topo, args.timeout) as lease:
+            sys.stderr.write('lease {} of {} after {:.3f}s\n'.format(
+                lease.id, lease.topo, lease.wait))
+            sys.stdout.write(lease.cmd(args.node, ' '.join(args.cmd)))
+    else:
+        with PoolClient(args.socket) as client:
+            print(json.dumps(client.status(), indent=1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+
+"""
+Copyright 2023-present Martin Becke
+# SPDX-License-Identifier: Apache-2.0
+
+Bring-up benchmark of generated topologies.
+
+For every shape and size the network is built and torn down once, and
+the wall clock time of each phase is recorded:
+
+* build:    Mininet(topo) - nodes, links, interfaces
+* start:    net.start()
+* address:  addresses, sysctls and host default routes (NetConfig)
+* routing:  computing the static routes and installing them
+* ping:     until the first ping h1 -> hN succeeds (None if it never did)
+* stop:     net.stop() and reaping the run
+
+One JSON object per run is appended to the output file and a table is
+printed:
+
+    $ sudo python3 bench-topo.py --shapes chain,ring,mesh --sizes 2,10,50,100,200
+
+Dependencies:
+    Work with this setub base on the mininet image
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from mininet.net import Mininet
+from mininet.log import setLogLevel, info
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rnlib.netconf import NetConfig
+from rnlib import cleanup
+from rnlib import routing
+from rnlib import topogen
+
+PHASES = ('build', 'start', 'address', 'routing', 'ping', 'stop')
+OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench-topo.jsonl')
+
+
+def first_ping(src, dst, timeout):
+    "Seconds until `src` got a reply from `dst`, None after `timeout`"
+    start_time = time.time()
+    while time.time() - start_time < timeout:
+        if ' 0% packet loss' in src.cmd('ping -c1 -W1 {}'.format(dst)):
+            return time.time() - start_time
+    return None
+
+
+def bench(shape, n, args):
+    "Bring up one topology, returns the result record"
+    result = {'shape': shape, 'n': n}
+    cleanup.reap_previous('bench-topo')
+
+    t = time.time()
+    topo = topogen.GenTopo(shape=shape, n=n, k=args.k, degree=args.degree,
+                           seed=args.seed, bw=args.bw, delay=args.delay)
+    net = Mininet(topo=topo, autoSetMacs=True)
+    result['build'] = time.time() - t
+    result.update(routers=topo.n, links=len(topo.edges))
+
+    t = time.time()
+    net.start()
+    result['start'] = time.time() - t
+    manifest = cleanup.RunManifest.record('bench-topo', net)
+
+    t = time.time()
+    conf = NetConfig()
+    topogen.setup_ip(net, conf)
+    failed = conf.apply()
+    result['address'] = time.time() - t
+
+    t = time.time()
+    table = routing.compute_routes(topo, conf.addresses, topo.routers, args.aggregate)
+    routing.install_routes(net, conf, table)
+    failed.update(conf.apply())
+    result['routing'] = time.time() - t
+    result['routes'] = sum(len(routes) for routes in table.values())
+    result['failed'] = sorted(failed)
+
+    last = 'h{}'.format(topo.n)
+    dst = topo.addressing[(last, '{}-eth0'.format(last))].split('/')[0]
+    result['ping'] = first_ping(net['h1'], dst, args.ping_timeout)
+
+    t = time.time()
+    net.stop()
+    manifest.reap()
+    result['stop'] = time.time() - t
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bring-up benchmark of generated topologies')
+    parser.add_argument('--shapes', default='chain',
+                        help='comma separated, of {}'.format(', '.join(topogen.SHAPES)))
+    parser.add_argument('--sizes', default='2,5,10,20,50,100,200',
+                        help='comma separated router counts')
+    parser.add_argument('--k', type=int, default=None, help='fat-tree arity')
+    parser.add_argument('--degree', type=int, default=3, help='mesh degree')
+    parser.add_argument('--seed', type=int, default=0, help='mesh seed')
+    parser.add_argument('--bw', type=float, default=None, help='link bandwidth (TCLink)')
+    parser.add_argument('--delay', default=None, help='link delay (TCLink)')
+    parser.add_argument('--aggregate', action='store_true', help='aggregate routes')
+    parser.add_argument('--ping-timeout', type=float, default=30)
+    parser.add_argument('--output', default=OUTPUT,
+                        help='JSON lines file the results are appended to (default: %(default)s)')
+    args = parser.parse_args()
+
+    print('{:>8} {:>5} {:>7} {:>8}'.format('shape', 'n', 'links', 'routes') +
+          ''.join('{:>9}'.format(phase) for phase in PHASES))
+    for shape in args.shapes.split(','):
+        for n in [int(size) for size in args.sizes.split(',')]:
+            if shape == 'fattree' and args.k is None and n < topogen.fattree_size(2):
+                print('{:>8} {:>5}  skipped, a fat-tree needs at least {} routers'.format(
+                    shape, n, topogen.fattree_size(2)))
+                continue
+            info('*** {} n={}\n'.format(shape, n))
+            result = bench(shape, n, args)
+            result['time'] = time.time()
+            with open(args.output, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+            print('{shape:>8} {routers:>5} {links:>7} {routes:>8}'.format(**result) +
+                  ''.join('{:>9}'.format('-' if result[phase] is None
+                                         else '{:.3f}'.format(result[phase]))
+                          for phase in PHASES))
+            if result['failed']:
+                print('  configuration failed on {}'.format(', '.join(result['failed'])))
+
+
+if __name__ == '__main__':
+    setLogLevel('warning')
+    main()
@@ -18,6 +18,12 @@ from mininet.node import Node
 from typing import List, Dict, Tuple, Union
 from mininet.term import makeTerm
 import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rnlib.netconf import NetConfig
+from rnlib import routing
+from rnlib import telemetry
 
 
 N=5
@@ -52,84 +58,74 @@ class RTopo(Topo):
             self.addLink(r[i], r[i+1], intfName1 = 'r{}-eth2'.format(i), intfName2='r{}-eth1'.format(i+1), cls=TCLink, bw=10, delay='0.1ms')
 
 
-def  setup_router_ip(net):
+def  setup_router_ip(net, conf):
     for i in range(1,N+1):
         rname = 'r{}'.format(i)
         r=net[rname]
         if0name='{}-eth0'.format(rname)
         ip0addr='10.0.{}.1'.format(10*i)
-        r.cmd('ifconfig {} {}/24'.format(if0name, ip0addr))
+        conf.address(r, if0name, '{}/24'.format(ip0addr))
         if1name='{}-eth1'.format(rname)
         ip1addr='10.0.{}.2'.format(i-1)		# correct for i==0
-        r.cmd('ifconfig {} {}/24'.format(if1name, ip1addr))
+        conf.address(r, if1name, '{}/24'.format(ip1addr))
         if2name='{}-eth2'.format(rname)
         if i != N:
             ip2addr='10.0.{}.1'.format(i)    
         else:
            ip2addr='10.0.{}.1'.format((N+1)*10)
         
-        r.cmd('ifconfig {} {}/24'.format(if2name, ip2addr))  
-        r.cmd('sysctl net.ipv4.ip_forward=1')
+        conf.address(r, if2name, '{}/24'.format(ip2addr))
+        conf.sysctl(r, 'net.ipv4.ip_forward', 1)
         ifacelist = r.intfList()
         for iface in ifacelist:
-            if iface != 'lo': r.cmd('sysctl net.ipv4.conf.{}.rp_filter=0'.format(iface))
+            if iface != 'lo': conf.sysctl(r, 'net.ipv4.conf.{}.rp_filter'.format(iface), 0)
 
-def setup_host_ip(net):
+def setup_host_ip(net, conf):
     # h0, h N + 1 is special
     h0 = net['h0']
-    h0.cmd('ifconfig h0-eth0 10.0.0.1/24')
-    h0.cmd('ip route add to default via 10.0.0.2')
+    conf.address(h0, 'h0-eth0', '10.0.0.1/24')
+    conf.route(h0, 'default', via='10.0.0.2')
    
     hn = net['h{}'.format(N+1)]
-    hn.cmd('ifconfig {}-eth0 10.0.{}.10/24'.format(hn, 10*(N+1)))
-    hn.cmd('ip route add to default via 10.0.{}.1'.format((10*(N+1))))
+    conf.address(hn, '{}-eth0'.format(hn.name), '10.0.{}.10/24'.format(10*(N+1)))
+    conf.route(hn, 'default', via='10.0.{}.1'.format((10*(N+1))))
     
     for i in range(1, N+1):
         hname = 'h{}'.format(i)		
         hi = net[hname]
-        hi.cmd('ifconfig {}-eth0 10.0.{}.10/24'.format(hname, 10*i))
-        hi.cmd('ip route add to default via 10.0.{}.1'.format(10*i))
+        conf.address(hi, '{}-eth0'.format(hname), '10.0.{}.10/24'.format(10*i))
+        conf.route(hi, 'default', via='10.0.{}.1'.format(10*i))
         
         
 
-def setup_route(net):
-     for k in range(0,N+2):
-          for i in range(1,N+1):
-             rname = 'r{}'.format(i)
-             r=net[rname]
-             if0name='{}-eth1'.format(rname)
-             if1name='{}-eth2'.format(rname)
-	   	
-             if i > k:
-               #   for z in range(1,N+1):
-               #   	if z > (i):
-               #   	    tmp = 'r{}'.format(z)
-               #   	    t=net[tmp]
-               #   	    t.cmd('ip route add 10.0.{}.0/24 via 10.0.{}.1 dev {}'.format((i), ((i-1)), if0name))
-                  r.cmd('ip route add 10.0.{}.0/24 via 10.0.{}.1 dev {}'.format((10*(k)), ((i-1)), if0name))
-             if i < (k):
-                  # for z in range(1,N+1):
-                  #	if z < (i):
-                  #	    r.cmd('ip route add 10.0.{}.0/24 via 10.0.{}.2 dev {}'.format((z-1), (i), if1name)) 
-                  r.cmd('ip route add 10.0.{}.0/24 via 10.0.{}.2 dev {}'.format((10*(k)), (i), if1name))  
-            
-                  
+def setup_route(net, conf):
+    # shortest path routes from the topology graph and the addresses above
+    routers = ['r{}'.format(i) for i in range(1, N+1)]
+    table = routing.cached_routes(net.topo, conf.addresses, routers)
+    routing.install_routes(net, conf, table)
+
+
 def run():
     rtopo = RTopo()
     net = Mininet(topo = rtopo, link=TCLink, autoSetMacs = True)
     net.start()
     
-    # Setup Router IP adresses
-    setup_router_ip(net)
-    setup_host_ip(net)
-    setup_route(net)
+    # Setup Router IP adresses, collected and applied with one batch per node
+    conf = NetConfig()
+    setup_router_ip(net, conf)
+    setup_host_ip(net, conf)
+    setup_route(net, conf)
+    conf.apply()
     for i in range(0, N+2):
         hname = 'h{}'.format(i)		
         hi = net[hname]
         makeTerm(hi)
 
+    # Interface counters in the background, 'telemetry' in the CLI shows rates
+    sampler = telemetry.Sampler(net).start()
+    telemetry.install_cli(sampler)
     CLI( net)
-    
+    sampler.stop()
 
     net.stop()    
     
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+
+"""
+Copyright 2023-present Martin Becke
+# SPDX-License-Identifier: Apache-2.0
+
+Generated router topologies, the size is given on the command line
+instead of editing N in the source:
+
+    $ sudo python3 topo-gen.py --shape chain --n 5       # like topo-base.py
+    $ sudo python3 topo-gen.py --shape fattree --k 4
+    $ sudo python3 topo-gen.py --shape mesh --n 30 --degree 4 --seed 7
+    $ sudo python3 topo-gen.py --n 5 --bw 10 --delay 0.1ms --measure iperf3:h1:h5,ping:h1:h5
+    $ sudo python3 topo-gen.py --n 50 --checkpoint n50.ckpt     # save the state
+    $ sudo python3 topo-gen.py --n 50 --restore n50.ckpt        # and rerun from it
+    $ sudo python3 topo-gen.py --shape mesh --n 500 --shards 8   # 8 Mininet processes
+
+Dependencies:
+    Work with this setub base on the mininet image
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from mininet.net import Mininet
+from mininet.cli import CLI
+from mininet.log import setLogLevel, info
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rnlib.netconf import NetConfig
+from rnlib import checkpoint
+from rnlib import cleanup
+from rnlib import measure
+from rnlib import shard
+from rnlib import topogen
+
+
+def run_sharded(args):
+    "The topology split over --shards Mininet processes (rnlib/shard.py)"
+    opts = [('shape', args.shape), ('n', args.n), ('fanout', args.fanout), ('k', args.k),
+            ('degree', args.degree), ('seed', args.seed), ('bw', args.bw),
+            ('delay', args.delay)]
+    spec = 'gen:' + ','.join('{}={}'.format(key, value)
+                             for key, value in opts if value is not None)
+    net = shard.ShardedNet(spec, args.shards, name='topo-gen-shard')
+    net.start()
+    try:
+        shard.ShardCLI(net).cmdloop()
+    finally:
+        net.stop()
+
+
+def run(args):
+    cleanup.reap_previous('topo-gen')
+    topo = topogen.topo_from_args(args)
+    info('*** {} with {} routers and {} router links\n'.format(
+        topo.shape, topo.n, len(topo.edges)))
+    net = Mininet(topo=topo, autoSetMacs=True)
+    net.start()
+    manifest = cleanup.RunManifest.record('topo-gen', net)
+
+    if args.restore:
+        # the state of an earlier run instead of configuring from scratch
+        checkpoint.Checkpoint.load(args.restore).restore(net)
+    else:
+        # Addresses and shortest path static routes, one batch per node
+        conf = NetConfig()
+        topogen.configure(net, conf, aggregate=args.aggregate)
+        conf.apply()
+    if args.checkpoint:
+        info('*** checkpoint written to {}\n'.format(
+            checkpoint.Checkpoint.capture(net).save(args.checkpoint)))
+
+    # Optional throughput/latency flows, appended to measurements.jsonl
+    for result in measure.measure_from_args(net, args, labels={
+            'topo': 'topo-gen', 'shape': topo.shape, 'n': topo.n}):
+        info('*** {kind} {src} -> {dst}: {result}\n'.format(result=json.dumps(
+            dict((key, value) for key, value in result.items()
+                 if key in ('goodput_bps', 'rtt_ms', 'ttfb_ms', 'loss', 'error'))),
+            **result))
+
+    CLI(net)
+
+    net.stop()
+    manifest.reap()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generated router topology')
+    topogen.add_arguments(parser)
+    parser.add_argument('--aggregate', action='store_true',
+                        help='aggregate static routes with the same next hop')
+    parser.add_argument('--checkpoint', metavar='FILE',
+                        help='save the configured network state to FILE')
+    parser.add_argument('--restore', metavar='FILE',
+                        help='restore the network state from a --checkpoint FILE')
+    parser.add_argument('--shards', type=int, default=0,
+                        help='split the topology over SHARDS Mininet processes')
+    measure.add_arguments(parser)
+    args = parser.parse_args()
+    if args.shards and (args.aggregate or args.checkpoint or args.restore or args.measure):
+        parser.error('--shards does not support --aggregate, --checkpoint, --restore '
+                     'and --measure')
+    setLogLevel('info')
+    if args.shards:
+        run_sharded(args)
+    else:
+        run(args)
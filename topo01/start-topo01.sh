@@ -16,8 +16,7 @@ else
     echo "Der Nameserver $nameserver ist bereits in der Datei vorhanden."
 fi
 
-sudo mn -c
+sudo -E python3 ../rnlib/cleanup.py --no-fallback topo01
 sudo -E  python3 topo01.py
-sudo mn -c
-sudo killall xterm
+sudo -E python3 ../rnlib/cleanup.py --no-fallback topo01
 sudo mv /etc/resolv.conf.old /etc/resolv.conf
@@ -1,21 +1,16 @@
-import http.server
-import socketserver
+import argparse
+import os
+import sys
 
-class MyHttpRequestHandler(http.server.SimpleHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/':
-            self.path = './index.html'
-        return http.server.SimpleHTTPRequestHandler.do_GET(self)
-    def send_response_only(self, code, message=None):
-        super().send_response_only(code, message)
-        self.send_header('Cache-Control', 'no-store, must-revalidate')
-        self.send_header('Expires', '0')
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rnlib import httpserve
 
-# Create an object of the above class
-handler_object = MyHttpRequestHandler
+class MyHttpRequestHandler(httpserve.LabHttpRequestHandler):
+    index = './index.html'
 
-PORT = 80
-my_server = socketserver.TCPServer(("", PORT), handler_object)
+parser = argparse.ArgumentParser(description='Lab HTTP server')
+httpserve.add_arguments(parser, port=80)
+args = parser.parse_args()
 
 # Star the server
-my_server.serve_forever()
+httpserve.serve(MyHttpRequestHandler, args)
@@ -1,39 +1,42 @@
-import http.server
-import ssl
+import argparse
 import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rnlib import httpserve
 
 host = '0.0.0.0'
 port = 443
 
-class MyHttpRequestHandler(http.server.SimpleHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/':
-            self.path = './index.html'
-        return http.server.SimpleHTTPRequestHandler.do_GET(self)
-    def send_response_only(self, code, message=None):
-        super().send_response_only(code, message)
-        self.send_header('Cache-Control', 'no-store, must-revalidate')
-        self.send_header('Expires', '0')
+# Use openssl to create a self signed certificate:
+# openssl req -x509 -newkey rsa:4096 -keyout key.pem -out cert.pem -days 365 -nodes
+# openssl req -x509 -newkey ec -pkeyopt ec_paramgen_curve:prime256v1 -keyout ecdsa-key.pem -out ecdsa-cert.pem -days 365 -nodes
+CERTIFICATES = {
+    'rsa': ('cert.pem', 'key.pem'),
+    'ecdsa': ('ecdsa-cert.pem', 'ecdsa-key.pem'),
+}
+
+class MyHttpRequestHandler(httpserve.LabHttpRequestHandler):
+    index = './index.html'
 
 def main():
+    parser = argparse.ArgumentParser(description='Lab HTTPS server')
+    httpserve.add_arguments(parser, port=port)
+    parser.add_argument('--cert-type', choices=sorted(CERTIFICATES), default='rsa',
+                        help='certificate/key pair, ecdsa handshakes are much cheaper (default rsa)')
+    args = parser.parse_args()
+    if args.engine == 'asyncio':
+        parser.error('the asyncio engine does not support TLS')
+
     pwd = os.getcwd()
     try:
-        # Use openssl to create a self signed certificate:
-        # openssl req -x509 -newkey rsa:4096 -keyout key.pem -out cert.pem -days 365 -nodes
-        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-        context.load_cert_chain('cert.pem', 'key.pem')
-        print(f"Serving TLS")
-        handler_object = MyHttpRequestHandler
-
-        httpd = http.server.HTTPServer((host, port), handler_object)
-        httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
-        httpd.serve_forever()
+        certfile, keyfile = CERTIFICATES[args.cert_type]
+        # Created before forking, all processes share the session ticket keys
+        context = httpserve.make_tls_context(certfile, keyfile)
+        print(f"Serving TLS ({args.cert_type})")
+        httpserve.serve(MyHttpRequestHandler, args, host=host, context=context)
     finally:
         os.chdir(pwd)
 
 if __name__ == "__main__":
     main()
-
-
-
-
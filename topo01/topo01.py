@@ -24,6 +24,7 @@ Dependencies:
 
 #!/usr/bin/python
 
+import os
 import re
 import sys
 
@@ -41,6 +42,9 @@ from mininet.nodelib import NAT
 from mininet.util import quietRun
 from mininet.term import makeTerm
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rnlib import cleanup
+
 class LinuxRouter(Node):
     def config(self, **params):
         super(LinuxRouter, self).config(**params)
@@ -94,6 +98,7 @@ def topology():
     net.addLink(h1, s0, intfName1='h1-eth0', intfName2='s0-eth0')
     
     net.build()
+    manifest = cleanup.RunManifest.record('topo01', net)
     
     h1.cmd('ifconfig h1-eth0 10.0.5.2/24')
     h1.cmd('ip route add default via 10.0.5.1')
@@ -130,6 +135,7 @@ def topology():
 
     info("*** Stopping network\n")
     net.stop()
+    manifest.reap()
 
 if __name__ == '__main__':
     setLogLevel( 'info' )
@@ -3,8 +3,7 @@ echo "start topology"
 #sudo mv /etc/resolv.conf /etc/resolv.conf.old
 #echo "nameserver 10.0.1.2" | sudo tee /etc/resolv.conf
 #sudo bash -c  'echo "nameserver 1.1.1.1" >> /etc/resolv.conf'
-sudo mn -c
+sudo -E python3 ../rnlib/cleanup.py --no-fallback topo02
 sudo -E  python3 topo02.py
-sudo mn -c
-sudo killall xterm
+sudo -E python3 ../rnlib/cleanup.py --no-fallback topo02
 #sudo mv /etc/resolv.conf.old /etc/resolv.conf
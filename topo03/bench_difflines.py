@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+#
+# bench_difflines.py
+# Benchmark of normalize_text() and difflines() on large router output
+#
+# Copyright (c) 2017 by
+# Network Device Education Foundation, Inc. ("NetDEF")
+#
+# Permission to use, copy, modify, and/or distribute this software
+# for any purpose with or without fee is hereby granted, provided
+# that the above copyright notice and this permission notice appear
+# in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND NETDEF DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL NETDEF BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY
+# DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS,
+# WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+
+"""
+bench_difflines.py: normalize_text() and difflines() against the old versions
+
+The rX/*.ref files are scaled up to full table size: their lines are
+repeated with the IPv4 addresses renumbered per copy, the "current" side
+gets vtysh-like padding (tabs, double spaces, CRs, trailing blanks).
+Every size is compared equal, with one changed line and with 1% of the
+lines changed. The old difflib version is skipped above --max-old lines,
+where it takes minutes.
+
+    ./bench_difflines.py --sizes 1000,10000,100000
+"""
+
+import argparse
+import difflib
+import glob
+import os
+import re
+import sys
+import time
+
+CWD = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(CWD)
+
+# Only the mininet-independent part of lib.topotest is used here, but the
+# module imports mininet, so it has to be installed.
+from lib.topotest import normalize_text, difflines
+
+IPV4 = re.compile(r'\b(\d+)\.(\d+)\.(\d+)\.(\d+)\b')
+
+
+def old_normalize_text(text):
+    "normalize_text() before the streaming version"
+    text = re.sub(r'[ \t]+', ' ', text)
+    text = re.sub(r'\r', '', text)
+    text = re.sub(r'[ \t]+\n', '\n', text)
+    return text.rstrip()
+
+
+def old_difflines(text1, text2, title1='', title2='', **opts):
+    "difflines() before the patience diff"
+    text1 = ('\n'.join(text1.rstrip().splitlines()) + '\n').splitlines(1)
+    text2 = ('\n'.join(text2.rstrip().splitlines()) + '\n').splitlines(1)
+    diff = '\n'.join(difflib.unified_diff(text1, text2,
+                                          fromfile=title1, tofile=title2, **opts))
+    return os.linesep.join([s for s in diff.splitlines() if s])
+
+
+def scale(lines, size):
+    "`size` lines made of copies of `lines` with renumbered addresses"
+    result = []
+    copy = 0
+    while len(result) < size:
+        octets = lambda m: '{}.{}.{}.{}'.format(
+            m.group(1), copy // 256 % 256, copy % 256, m.group(4))
+        result.extend(IPV4.sub(octets, line) for line in lines)
+        copy += 1
+    return result[:size]
+
+
+def padded(lines):
+    "The lines as vtysh might print them"
+    return '\r\n'.join(line.replace(' ', '  ', 1) + ' \t' for line in lines) + '\r\n\r\n'
+
+
+def changed(lines, every):
+    "Copy of `lines` with every `every`th line altered"
+    result = list(lines)
+    for i in range(len(result) // 2 % every, len(result), every):
+        result[i] = result[i] + ' CHANGED'
+    return result
+
+
+def timed(func):
+    start_time = time.time()
+    result = func()
+    return time.time() - start_time, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma separated output sizes in lines')
+    parser.add_argument('--max-old', type=int, default=10000,
+                        help='largest size to run the old difflines() for')
+    args = parser.parse_args()
+
+    refs = sorted(glob.glob(os.path.join(CWD, 'r*', '*.ref')))
+    print('{:<20} {:>7} {:>7} {:>10} {:>10} {:>10} {:>10}'.format(
+        'ref', 'lines', 'change', 'norm old', 'norm new', 'diff old', 'diff new'))
+    for ref in refs:
+        with open(ref) as f:
+            base = f.read().splitlines()
+        if not base:
+            continue
+        name = os.path.relpath(ref, CWD)
+        for size in [int(s) for s in args.sizes.split(',')]:
+            # router_output_cmp() normalizes both sides
+            expected = normalize_text('\n'.join(scale(base, size)))
+            for label, every in (('none', 0), ('one', size), ('1%', 100)):
+                current_lines = scale(base, size)
+                if every:
+                    current_lines = changed(current_lines, every)
+                current = padded(current_lines)
+
+                norm_old, old_text = timed(lambda: old_normalize_text(current))
+                norm_new, new_text = timed(lambda: normalize_text(current))
+                assert old_text == new_text
+                diff_new, diff = timed(lambda: difflines(new_text, expected, 'Current', 'Expected'))
+                assert (diff == '') == (label == 'none')
+                if size <= args.max_old:
+                    diff_old, old_diff = timed(lambda: old_difflines(
+                        old_text, expected, 'Current', 'Expected'))
+                    assert (old_diff == '') == (diff == '')
+                    diff_old = '{:.4f}'.format(diff_old)
+                else:
+                    diff_old = '-'
+                print('{:<20} {:>7} {:>7} {:>10.4f} {:>10.4f} {:>10} {:>10.4f}'.format(
+                    name, size, label, norm_old, norm_new, diff_old, diff_new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+#
+# bench_json_cmp.py
+# Benchmark of json_cmp() on large route tables
+#
+# Copyright (c) 2017 by
+# Network Device Education Foundation, Inc. ("NetDEF")
+#
+# Permission to use, copy, modify, and/or distribute this software
+# for any purpose with or without fee is hereby granted, provided
+# that the above copyright notice and this permission notice appear
+# in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND NETDEF DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL NETDEF BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY
+# DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS,
+# WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+
+"""
+bench_json_cmp.py: json_cmp() with and without the list index
+
+Builds 'show ip bgp json'-like route lists of growing size and compares
+them against an expected subset (every 10th route), once matching and
+once with a difference. The unindexed O(n * m) comparison is skipped for
+sizes where it would take minutes (--max-linear), so is rendering the
+error diff of the failed comparison (--max-render).
+
+    ./bench_json_cmp.py --sizes 1000,10000,100000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+CWD = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(CWD)
+
+# Only the mininet-independent part of lib.topotest is used here, but the
+# module imports mininet, so it has to be installed.
+from lib.topotest import json_cmp
+
+
+def routes(count):
+    "A BGP table like list of `count` routes"
+    return [{
+        'prefix': '10.{}.{}.0/24'.format(i // 256, i % 256),
+        'valid': True,
+        'bestpath': True,
+        'nexthops': [{'ip': '192.168.{}.1'.format(i % 4), 'afi': 'ipv4', 'used': True}],
+        'metric': 0,
+        'path': '65001 65002',
+    } for i in range(count)]
+
+
+def timed(func):
+    start_time = time.time()
+    result = func()
+    return time.time() - start_time, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='100,1000,10000,100000',
+                        help='comma separated table sizes')
+    parser.add_argument('--max-linear', type=int, default=10000,
+                        help='largest size to run without the index')
+    parser.add_argument('--max-render', type=int, default=10000,
+                        help='largest size to render the error diff for')
+    args = parser.parse_args()
+
+    print('{:>8} {:>6} {:>12} {:>12} {:>12}'.format(
+        'routes', 'match', 'indexed', 'linear', 'error text'))
+    for size in [int(s) for s in args.sizes.split(',')]:
+        have = {'routes': routes(size)}
+        expect = {'routes': [dict(r) for r in have['routes'][::10]]}
+        broken = {'routes': [dict(r) for r in expect['routes']]}
+        broken['routes'][-1]['metric'] = 1
+
+        for match, data in (('yes', expect), ('no', broken)):
+            indexed, result = timed(lambda: json_cmp(have, data))
+            assert (result is None) == (match == 'yes')
+            if size <= args.max_linear:
+                linear, lresult = timed(lambda: json_cmp(have, data, index=False))
+                assert (lresult is None) == (result is None)
+                linear = '{:.4f}'.format(linear)
+            else:
+                linear = '-'
+            # the diff is only rendered here, not in json_cmp()
+            if result is not None and size <= args.max_render:
+                render = '{:.4f}'.format(timed(lambda: str(result))[0])
+            else:
+                render = '-'
+            print('{:>8} {:>6} {:>12.4f} {:>12} {:>12}'.format(
+                size, match, indexed, linear, render))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+#
+# addresses.py
+# Interface address inventory and IPv6 link-local repair
+#
+# Copyright (c) 2017 by
+# Network Device Education Foundation, Inc. ("NetDEF")
+#
+# Permission to use, copy, modify, and/or distribute this software
+# for any purpose with or without fee is hereby granted, provided
+# that the above copyright notice and this permission notice appear
+# in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND NETDEF DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL NETDEF BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY
+# DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS,
+# WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+
+"""
+Address inventory.
+
+Keeps node -> interface -> addresses, read with one 'ip -json address'
+(netlink) per node. With `watch`, an 'ip monitor address link' per node
+marks the node stale on every change, so queries are answered from the
+cache until something changed; without it every query re-reads.
+
+repair_linklocal() computes the EUI-64 link-local address of every
+interface from its MAC in Python and adds the missing ones with a single
+'ip -batch' per node (zebra removes them on start under Mininet).
+
+    inventory = AddressInventory(watch=True)
+    inventory.repair_linklocal([r1, r2, r3])
+    inventory.linklocal(r1)           # [['r1-eth0', 'fe80::...'], ...]
+    inventory.get(r1, 'r1-eth0')      # {'mac': ..., 'ipv4': [...], ...}
+"""
+
+import ipaddress
+import json
+import re
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.topolog import logger
+
+WORKERS = 16
+# The link-local addresses get_ipv6_linklocal() always reported: a full
+# 64 bit interface identifier like EUI-64 ones have
+IID64 = re.compile(r'^fe80::[0-9a-f]+:[0-9a-f]+:[0-9a-f]+:[0-9a-f]+$')
+
+
+def eui64_linklocal(mac):
+    "fe80::/64 address of the interface with MAC `mac` (modified EUI-64)"
+    octets = [int(part, 16) for part in mac.split(':')]
+    if len(octets) != 6:
+        raise ValueError('not a MAC address: {}'.format(mac))
+    octets[0] ^= 0x02
+    iid = octets[:3] + [0xff, 0xfe] + octets[3:]
+    return str(ipaddress.IPv6Address(bytes([0xfe, 0x80] + [0] * 6 + iid)))
+
+
+def parse_addresses(data):
+    "'ip -json address show' output -> {ifname: {'mac', 'ipv4', 'ipv6', 'linklocal'}}"
+    result = {}
+    for link in json.loads(data or '[]'):
+        info = result[link['ifname']] = {
+            'mac': link.get('address'), 'ipv4': [], 'ipv6': [], 'linklocal': []}
+        for addr in link.get('addr_info', ()):
+            cidr = '{}/{}'.format(addr['local'], addr['prefixlen'])
+            if addr['family'] == 'inet':
+                info['ipv4'].append(cidr)
+            elif addr.get('scope') == 'link':
+                info['linklocal'].append(addr['local'])
+            else:
+                info['ipv6'].append(cidr)
+    return result
+
+
+class _Watch(object):
+    "'ip monitor address link' in a node, calls `changed` on every event"
+
+    def __init__(self, node, changed):
+        self.proc = node.popen(['ip', 'monitor', 'address', 'link'],
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.changed = changed
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def _read(self):
+        for _ in iter(self.proc.stdout.readline, b''):
+            self.changed()
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            self.proc.wait()
+
+
+class AddressInventory(object):
+    "Cached interface addresses of Mininet nodes"
+
+    def __init__(self, watch=False):
+        self.watch = watch
+        self.lock = threading.Lock()
+        # node name -> {ifname: info}
+        self.cache = {}
+        self.stale = set()
+        # node name -> number of watch events, a read is only fresh if
+        # no event arrived while it ran
+        self.generation = {}
+        self.watches = {}
+
+    def _read(self, node):
+        proc = node.popen(['ip', '-json', 'address', 'show'],
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        data, _ = proc.communicate()
+        return parse_addresses(data.decode())
+
+    def _mark(self, name):
+        with self.lock:
+            self.generation[name] = self.generation.get(name, 0) + 1
+            self.stale.add(name)
+
+    def refresh(self, nodes):
+        "Re-read the addresses of `nodes` in parallel"
+        nodes = list(nodes)
+        for node in nodes:
+            if self.watch and node.name not in self.watches:
+                # start watching before reading, no change is missed
+                self.watches[node.name] = _Watch(node, lambda name=node.name: self._mark(name))
+        with self.lock:
+            before = [self.generation.get(node.name, 0) for node in nodes]
+        with ThreadPoolExecutor(max_workers=min(WORKERS, max(1, len(nodes)))) as pool:
+            results = list(pool.map(self._read, nodes))
+        with self.lock:
+            for node, result, generation in zip(nodes, results, before):
+                self.cache[node.name] = result
+                # a change seen during the read may be missing from it
+                if self.generation.get(node.name, 0) == generation:
+                    self.stale.discard(node.name)
+
+    def get(self, node, intf=None):
+        "{ifname: info} of `node`, or the info of `intf`, re-read if stale"
+        with self.lock:
+            fresh = self.watch and node.name in self.cache and node.name not in self.stale
+        if not fresh:
+            self.refresh([node])
+        addresses = self.cache[node.name]
+        return addresses if intf is None else addresses.get(intf)
+
+    def linklocal(self, node, every=False):
+        """
+        Link-local addresses of `node` as [[ifname, address], ...], a second
+        address on the same interface as 'ifname-2' (get_ipv6_linklocal()).
+        Only addresses with a 64 bit interface identifier (EUI-64), with
+        `every` all of them (manually added or privacy ones too).
+        """
+        result = []
+        for ifname, info in self.get(node).items():
+            found = [local for local in info['linklocal'] if every or IID64.match(local)]
+            for count, local in enumerate(found, 1):
+                result.append([ifname if count == 1 else '{}-{}'.format(ifname, count), local])
+        return result
+
+    def repair_linklocal(self, nodes):
+        """
+        Add the EUI-64 link-local address to every interface of `nodes`
+        that lacks it, one 'ip -batch' per node. Returns a dict node name
+        -> number of addresses added.
+        """
+        nodes = list(nodes)
+        self.refresh(nodes)
+
+        def repair(node):
+            lines = []
+            for ifname, info in self.cache[node.name].items():
+                mac = info['mac']
+                if ifname == 'lo' or not mac or mac == '00:00:00:00:00:00':
+                    continue
+                try:
+                    local = eui64_linklocal(mac)
+                except ValueError:
+                    continue
+                if local not in info['linklocal']:
+                    lines.append('address add {}/64 dev {} scope link\n'.format(local, ifname))
+            if lines:
+                proc = node.popen(['ip', '-force', '-batch', '-'], stdin=subprocess.PIPE,
+                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                output, _ = proc.communicate(''.join(lines).encode())
+                if output.strip():
+                    logger.debug('%s: link-local repair: %s', node.name, output.decode())
+            return len(lines)
+
+        with ThreadPoolExecutor(max_workers=min(WORKERS, max(1, len(nodes)))) as pool:
+            added = list(pool.map(repair, nodes))
+        repaired = [node for node, count in zip(nodes, added) if count]
+        if repaired:
+            self.refresh(repaired)
+        return dict((node.name, count) for node, count in zip(nodes, added))
+
+    def forget(self, node):
+        "Stop watching `node` and drop its addresses"
+        with self.lock:
+            watch = self.watches.pop(node.name, None)
+            self.cache.pop(node.name, None)
+            self.stale.discard(node.name)
+            self.generation.pop(node.name, None)
+        if watch is not None:
+            watch.close()
+
+    def close(self):
+        for name in list(self.watches):
+            watch = self.watches.pop(name)
+            watch.close()
@@ -0,0 +1,216 @@
+#
+# convergence.py
+# Event-driven waiting for routing convergence
+#
+# Copyright (c) 2017 by
+# Network Device Education Foundation, Inc. ("NetDEF")
+#
+# Permission to use, copy, modify, and/or distribute this software
+# for any purpose with or without fee is hereby granted, provided
+# that the above copyright notice and this permission notice appear
+# in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND NETDEF DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL NETDEF BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY
+# DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS,
+# WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+
+"""
+Convergence waiting.
+
+ConvergenceWaiter re-runs a check with an exponential backoff (starting
+at tens of milliseconds) until it returns the expected value or the
+deadline passes. A trigger wakes the waiter up early when something
+changed:
+
+* RouteTrigger: 'ip monitor route' in the node, i.e. netlink route
+  notifications
+* LogTrigger: new lines (optionally matching a regex) in a daemon log
+
+The time-to-converge of every check is recorded and can be logged with
+report().
+"""
+
+import re
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.topolog import logger
+
+INITIAL_WAIT = 0.025
+MAX_WAIT = 1.0
+
+
+class Trigger(object):
+    "Base class: an event that is set whenever something changed"
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def wait(self, timeout):
+        "Wait up to `timeout` seconds for a change, returns True on change"
+        fired = self.event.wait(timeout)
+        self.event.clear()
+        return fired
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class RouteTrigger(Trigger):
+    "Fires on netlink route notifications ('ip monitor route') in `node`"
+
+    def __init__(self, node, family='-4'):
+        super(RouteTrigger, self).__init__()
+        self.proc = node.popen(['ip', family, 'monitor', 'route'],
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL)
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def _read(self):
+        for _ in iter(self.proc.stdout.readline, b''):
+            self.event.set()
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            self.proc.wait()
+
+
+class LogTrigger(Trigger):
+    """
+    Fires on lines appended to the log file `path` (matching `pattern` if
+    given). The file is checked every `interval` seconds in a thread.
+    """
+
+    def __init__(self, path, pattern=None, interval=0.01):
+        super(LogTrigger, self).__init__()
+        self.path = path
+        self.pattern = re.compile(pattern) if pattern else None
+        self.interval = interval
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def _read(self):
+        offset = None
+        partial = ''
+        while not self.closed.wait(self.interval):
+            try:
+                with open(self.path) as f:
+                    f.seek(0, 2)
+                    end = f.tell()
+                    if offset is None or end < offset:
+                        # first look or the log was rotated/truncated
+                        offset = end
+                        continue
+                    f.seek(offset)
+                    data = f.read()
+                    offset = f.tell()
+            except OSError:
+                continue
+            lines = (partial + data).split('\n')
+            partial = lines.pop()
+            for line in lines:
+                if self.pattern is None or self.pattern.search(line):
+                    self.event.set()
+                    break
+
+    def close(self):
+        self.closed.set()
+
+
+class ConvergenceWaiter(object):
+    """
+    Waits for checks to return an expected value, deadline based and with
+    exponential backoff. Records the time-to-converge per check name.
+    """
+
+    def __init__(self, timeout=60, initial_wait=INITIAL_WAIT, max_wait=MAX_WAIT):
+        self.timeout = timeout
+        self.initial_wait = initial_wait
+        self.max_wait = max_wait
+        # name -> seconds until converged, None if it never did
+        self.results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def wait(self, func, what, name=None, trigger=None, timeout=None):
+        """
+        Run `func` until it returns `what`. Between tries wait for
+        `trigger` or the backoff interval, whatever comes first.
+
+        Returns (True, func-return) on success or
+        (False, func-return) on failure.
+        """
+        if name is None:
+            name = getattr(getattr(func, 'func', func), '__name__', '<unknown>')
+        start_time = time.time()
+        deadline = start_time + (self.timeout if timeout is None else timeout)
+        delay = self.initial_wait
+        tries = 0
+        while True:
+            result = func()
+            tries += 1
+            now = time.time()
+            if result == what:
+                self._record(name, now - start_time)
+                logger.info("'%s' converged after %.3f seconds (%s tries)",
+                            name, now - start_time, tries)
+                return (True, result)
+            remaining = deadline - now
+            if remaining <= 0:
+                self._record(name, None)
+                logger.error("'%s' failed after %.2f seconds (%s tries)",
+                             name, now - start_time, tries)
+                return (False, result)
+            if trigger is not None:
+                trigger.wait(min(delay, remaining))
+            else:
+                time.sleep(min(delay, remaining))
+            delay = min(delay * 2, self.max_wait)
+
+    def wait_routers(self, routers, make_check, what, trigger=None, timeout=None):
+        """
+        Wait for all `routers` in parallel. `make_check(router)` returns the
+        check function for a router, `trigger(router)` optionally creates
+        its Trigger. Returns a dict router name -> (ok, func-return).
+        """
+        def one(router):
+            check = make_check(router)
+            if trigger is None:
+                return self.wait(check, what, router.name, timeout=timeout)
+            with trigger(router) as trig:
+                return self.wait(check, what, router.name, trig, timeout)
+
+        routers = list(routers)
+        with ThreadPoolExecutor(max_workers=max(1, len(routers))) as pool:
+            results = list(pool.map(one, routers))
+        return OrderedDict((router.name, res) for router, res in zip(routers, results))
+
+    def _record(self, name, seconds):
+        with self._lock:
+            self.results[name] = seconds
+
+    def report(self):
+        "Log the time-to-converge of every check, returns the results"
+        for name, seconds in self.results.items():
+            if seconds is None:
+                logger.info('%s: not converged', name)
+            else:
+                logger.info('%s: converged in %.3f seconds', name, seconds)
+        return self.results
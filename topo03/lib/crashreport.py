@@ -0,0 +1,229 @@
+#
+# crashreport.py
+# Crash, memory leak and AddressSanitizer analysis of router daemons
+#
+# Copyright (c) 2017 by
+# Network Device Education Foundation, Inc. ("NetDEF")
+#
+# Permission to use, copy, modify, and/or distribute this software
+# for any purpose with or without fee is hereby granted, provided
+# that the above copyright notice and this permission notice appear
+# in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND NETDEF DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL NETDEF BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY
+# DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS,
+# WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+
+"""
+Crash and leak analysis.
+
+Looks at the node log directories straight from the host file system
+(no 'cat' through the node shell): core files ('<daemon>_core*.dmp') and
+the daemons' stderr ('<daemon>.err'). The stderr files are read line by
+line and the memstats leak lists and AddressSanitizer blocks are picked
+up as they stream by. The gdb backtraces of all cores run as concurrent
+gdb processes (one per worker thread).
+
+The result is a plain dict, per router and daemon:
+
+    {'core': path, 'backtrace': text,
+     'leaks': [{'group': name, 'allocations': [line, ...]}],
+     'asan': [{'type': 'heap-use-after-free', 'log': text}]}
+
+with only the daemons that have something to report.
+"""
+
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+ASAN_START = re.compile(r'(==[0-9]+==)ERROR: AddressSanitizer: ([^\s]*) ')
+LEAK_GROUP = re.compile(r'showing active allocations in memory group ([a-zA-Z0-9]+)')
+CORE_PATTERN = '{}_core*.dmp'
+ASAN_LOG = '/tmp/AddressSanitzer.txt'
+GDB_TIMEOUT = 120
+WORKERS = 8
+
+
+def scan_stderr(path, leaks=True):
+    """
+    Stream the stderr file `path`, returns (leaks, asan) lists. Missing
+    files have nothing to report.
+    """
+    found_leaks = []
+    found_asan = []
+    asan = None
+    # like topotest.py, allocations only count in a log with memstats
+    memstats = False
+    try:
+        f = open(path, errors='replace')
+    except OSError:
+        return found_leaks, found_asan
+    with f:
+        for line in f:
+            line = line.rstrip('\n')
+            if asan is not None:
+                # the block ends at the next line with the same ==pid== mark
+                if asan['mark'] in line:
+                    found_asan.append({'type': asan['type'],
+                                       'log': '\n'.join(asan['lines'])})
+                    asan = None
+                else:
+                    asan['lines'].append(line)
+                continue
+            match = ASAN_START.search(line)
+            if match:
+                asan = {'mark': match.group(1), 'type': match.group(2),
+                        'lines': [line[match.end(1):]]}
+                continue
+            if 'memstats' in line:
+                memstats = True
+            elif 'showing active allocations' not in line:
+                continue
+            if not leaks:
+                continue
+            match = LEAK_GROUP.search(line)
+            if match:
+                found_leaks.append({'group': match.group(1), 'allocations': []})
+                continue
+            text = line.split('memstats:', 1)[-1].strip()
+            if not found_leaks:
+                found_leaks.append({'group': None, 'allocations': []})
+            if text:
+                found_leaks[-1]['allocations'].append(text)
+    if asan is not None:
+        found_asan.append({'type': asan['type'], 'log': '\n'.join(asan['lines'])})
+    if not memstats:
+        found_leaks = []
+    return found_leaks, found_asan
+
+
+def backtrace(daemon_path, corefile):
+    "gdb backtrace of `corefile`"
+    try:
+        proc = subprocess.run(['gdb', daemon_path, corefile, '--batch', '-ex', 'bt'],
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              timeout=GDB_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as error:
+        return 'no backtrace: {}'.format(error)
+    return proc.stdout.decode(errors='replace')
+
+
+def _node_daemons(router, nodedir):
+    "Daemons of `router` that are enabled or left files in `nodedir`"
+    daemons = [daemon for daemon, enabled in router.daemons.items() if enabled == 1]
+    try:
+        names = os.listdir(nodedir)
+    except OSError:
+        names = []
+    for name in names:
+        if name.endswith('.err'):
+            daemon = name[:-len('.err')]
+        elif '_core' in name and name.endswith('.dmp'):
+            daemon = name.split('_core', 1)[0]
+        else:
+            continue
+        if daemon in router.daemons and daemon not in daemons:
+            daemons.append(daemon)
+    return daemons
+
+
+def analyze(routers, leaks=True, workers=WORKERS):
+    """
+    Analyze the daemons of all `routers` in parallel. Returns an
+    OrderedDict router name -> {daemon: findings} (see module docstring).
+    """
+    jobs = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for router in routers:
+            nodedir = os.path.join(router.logdir, router.name)
+            for daemon in _node_daemons(router, nodedir):
+                cores = sorted(glob.glob(os.path.join(nodedir, CORE_PATTERN.format(daemon))))
+                stderr = os.path.join(nodedir, '{}.err'.format(daemon))
+                bt = None
+                if cores:
+                    bt = pool.submit(backtrace, os.path.join(router.daemondir, daemon), cores[0])
+                scan = pool.submit(scan_stderr, stderr, leaks and not cores)
+                jobs.append((router.name, daemon, cores[0] if cores else None, bt, scan))
+
+        report = OrderedDict((router.name, OrderedDict()) for router in routers)
+        for name, daemon, core, bt, scan in jobs:
+            found_leaks, found_asan = scan.result()
+            findings = OrderedDict()
+            if core is not None:
+                findings['core'] = core
+                findings['backtrace'] = bt.result()
+            if found_leaks:
+                findings['leaks'] = found_leaks
+            if found_asan:
+                findings['asan'] = found_asan
+            if findings:
+                report[name][daemon] = findings
+    return report
+
+
+def format_report(report):
+    "The report as the text checkRouterCores() always returned"
+    traces = ''
+    for router, daemons in report.items():
+        for daemon, findings in daemons.items():
+            if 'core' in findings:
+                traces += '\n%s: %s crashed. Core file found - Backtrace follows:\n%s' % (
+                    router, daemon, findings['backtrace'])
+            elif 'leaks' in findings:
+                traces += '\n%s: %s has memory leaks:\n' % (router, daemon)
+                for group in findings['leaks']:
+                    if group['group'] is not None:
+                        traces += '  ## showing active allocations in memory group %s\n' % group['group']
+                    for allocation in group['allocations']:
+                        traces += '    %s\n' % allocation
+            if 'asan' in findings:
+                traces += '\n%s: Daemon %s killed by AddressSanitizer' % (router, daemon)
+    return traces
+
+
+def write_asan_log(report, testname=None, path=ASAN_LOG):
+    "Append the AddressSanitizer errors of `report` to `path`"
+    if testname is None:
+        testname = os.path.basename(sys.argv[0])
+    entries = [(router, daemon, asan) for router, daemons in report.items()
+               for daemon, findings in daemons.items()
+               for asan in findings.get('asan', ())]
+    if not entries:
+        return
+    with open(path, 'a') as f:
+        for router, daemon, asan in entries:
+            f.write('## Error: %s\n\n' % asan['type'])
+            f.write('### AddressSanitizer error in topotest `%s`, daemon `%s`, router `%s`\n\n' % (
+                testname, daemon, router))
+            f.write('    ' + '\n    '.join(asan['log'].splitlines()) + '\n')
+            f.write('\n---------------\n')
+
+
+def run_report(routers, path=None):
+    """
+    One report for the whole run from the results of the routers'
+    checkRouterCores() (router.crash_report), optionally written as JSON.
+    """
+    report = OrderedDict([
+        ('time', time.time()),
+        ('routers', OrderedDict((router.name, getattr(router, 'crash_report', {}))
+                                for router in routers)),
+    ])
+    report['problems'] = sum(len(daemons) for daemons in report['routers'].values())
+    if path is not None:
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=1)
+    return report
@@ -0,0 +1,330 @@
+#
+# frrconf.py
+# FRR configuration rendered from the topology
+#
+# Copyright (c) 2017 by
+# Network Device Education Foundation, Inc. ("NetDEF")
+#
+# Permission to use, copy, modify, and/or distribute this software
+# for any purpose with or without fee is hereby granted, provided
+# that the above copyright notice and this permission notice appear
+# in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND NETDEF DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL NETDEF BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY
+# DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS,
+# WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+
+"""
+FRR config renderer.
+
+Renders zebra.conf, ripd.conf and bgpd.conf of every router from the
+Topo graph instead of hand-written rX/*.conf files. Every switch (and
+every direct router-router link) is a segment: with one router it is a
+stub network, with more a transit network RIP runs on and BGP peers
+over. Addresses are taken from the link params ('ip' in params1/params2,
+like Mininet uses them), segments without any get the next free subnet
+of STUB_POOL (a /24) or TRANSIT_POOL (as small as fits) and the router
+number as host part where it fits.
+
+Optional router params (topotest.addRouter(topo, 'r3', ...)):
+
+    asn=65003                             BGP AS (default ASN_BASE + number)
+    static_routes=['192.168.2.0/24 192.168.3.10']
+    rip_redistribute=['connected', 'static']
+
+Configs are rendered into a store kept across runs next to the run
+directories (<test dir>/.frrconf/<router>/<daemon>.conf), files whose
+content hash did not change since the last run are not written again.
+The run gets hard links to them in <logdir>/<router>/.
+
+    renderer = FrrConfigRenderer(topo)
+    renderer.write(logdir)
+"""
+
+import hashlib
+import ipaddress
+import json
+import os
+import re
+import shutil
+from collections import OrderedDict
+
+DAEMONS = ('zebra', 'ripd', 'bgpd')
+ASN_BASE = 65000
+STUB_POOL = '10.0.0.0/8'
+TRANSIT_POOL = '193.1.0.0/16'
+HASH_FILE = '.frrconf.json'
+# directory of the store, next to the run directories of the test
+STORE_DIR = '.frrconf'
+
+
+def router_number(name):
+    "The number in a router name ('r12' -> 12), None without one"
+    match = re.search(r'(\d+)$', name)
+    return int(match.group(1)) if match else None
+
+
+def _write_file(path, text):
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _link_file(src, dst):
+    "Hard link `src` to `dst` (a copy across file systems)"
+    try:
+        if os.path.samefile(src, dst):
+            return
+        os.unlink(dst)
+    except OSError:
+        pass
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def install_configs(configs, logdir, store=None):
+    """
+    Install `configs` ({router: {daemon: text}}) to <logdir>/<router>/.
+    The files are written to `store` (default: <logdir>/../.frrconf),
+    skipping those whose content hash is unchanged since an earlier run,
+    and linked into the run. Returns (written, skipped).
+    """
+    if store is None:
+        store = os.path.join(os.path.dirname(os.path.abspath(logdir)), STORE_DIR)
+    written = skipped = 0
+    for router, daemons in configs.items():
+        nodedir = os.path.join(logdir, router)
+        storedir = os.path.join(store, router)
+        os.makedirs(nodedir, exist_ok=True)
+        os.makedirs(storedir, exist_ok=True)
+        hashfile = os.path.join(storedir, HASH_FILE)
+        try:
+            with open(hashfile) as f:
+                hashes = json.load(f)
+        except (OSError, ValueError):
+            hashes = {}
+        changed = False
+        for daemon, text in daemons.items():
+            name = '{}.conf'.format(daemon)
+            path = os.path.join(storedir, name)
+            data = text.encode()
+            digest = hashlib.sha256(data).hexdigest()
+            try:
+                unchanged = hashes.get(name) == digest and os.path.getsize(path) == len(data)
+            except OSError:
+                unchanged = False
+            if unchanged:
+                skipped += 1
+            else:
+                _write_file(path, text)
+                hashes[name] = digest
+                changed = True
+                written += 1
+            _link_file(path, os.path.join(nodedir, name))
+        if changed:
+            _write_file(hashfile, json.dumps(hashes, indent=1, sort_keys=True))
+    return written, skipped
+
+
+def read_configs(source, routers, daemons=DAEMONS):
+    "Hand-written configs of `routers` from <source>/<router>/<daemon>.conf"
+    configs = OrderedDict()
+    for router in routers:
+        configs[router] = OrderedDict()
+        for daemon in daemons:
+            try:
+                with open(os.path.join(source, router, '{}.conf'.format(daemon))) as f:
+                    configs[router][daemon] = f.read()
+            except OSError:
+                continue
+    return configs
+
+
+class FrrConfigRenderer(object):
+    "Renders the FRR configs of the routers of `topo`"
+
+    def __init__(self, topo, routers=None, asn_base=ASN_BASE,
+                 stub_pool=STUB_POOL, transit_pool=TRANSIT_POOL):
+        self.topo = topo
+        if routers is None:
+            routers = [name for name in topo.nodes(sort=False)
+                       if not topo.isSwitch(name)
+                       and hasattr(topo.nodeInfo(name).get('cls'), 'startRouter')]
+        self.routers = list(routers)
+        self.asn_base = asn_base
+        self.stub_pool = ipaddress.ip_network(stub_pool)
+        self.transit_pool = ipaddress.ip_network(transit_pool)
+        # router -> OrderedDict intf -> {'address', 'segment'}
+        self.interfaces = OrderedDict((name, OrderedDict()) for name in self.routers)
+        self.segments = self._segments()
+
+    def _segments(self):
+        "Segment name -> {'subnet', 'members': [(router, intf, address)]}"
+        routers = set(self.routers)
+        segments = OrderedDict()
+        for node1, node2, info in self.topo.links(sort=False, withInfo=True):
+            ends = [(node1, 1, node2), (node2, 2, node1)]
+            for node, side, other in ends:
+                if node not in routers:
+                    continue
+                if other in routers:
+                    key = '-'.join(sorted((node1, node2)))
+                else:
+                    key = other
+                intf = info.get('intfName{}'.format(side)) or '{}-eth{}'.format(
+                    node, info['port{}'.format(side)])
+                address = (info.get('params{}'.format(side)) or {}).get('ip')
+                if address is not None:
+                    address = ipaddress.ip_interface(address)
+                segment = segments.setdefault(key, {'subnet': None, 'members': []})
+                segment['members'].append([node, intf, address])
+        self._number(segments)
+        for name, segment in segments.items():
+            for router, intf, address in segment['members']:
+                self.interfaces[router][intf] = {'address': address, 'segment': name}
+        return segments
+
+    def _allocate(self, pool, prefixlen, explicit):
+        "Next free subnet of `prefixlen` in `pool` not overlapping `explicit`"
+        size = 1 << (pool.max_prefixlen - prefixlen)
+        while True:
+            cursor = -(-self.cursors[pool] // size) * size
+            self.cursors[pool] = cursor + size
+            subnet = ipaddress.ip_network((cursor, prefixlen))
+            if not subnet.subnet_of(pool):
+                raise ValueError('address pool {} exhausted'.format(pool))
+            if not any(subnet.overlaps(other) for other in explicit):
+                return subnet
+
+    def _number(self, segments):
+        """
+        Give the segments without addresses a subnet (stub: a /24, transit:
+        the smallest one fitting its routers) and their members addresses
+        """
+        explicit = set()
+        for segment in segments.values():
+            for member in segment['members']:
+                if member[2] is not None:
+                    segment['subnet'] = member[2].network
+                    explicit.add(member[2].network)
+        self.cursors = {self.stub_pool: int(self.stub_pool.network_address),
+                        self.transit_pool: int(self.transit_pool.network_address)}
+        for segment in segments.values():
+            count = len(segment['members'])
+            if segment['subnet'] is None:
+                if count > 1:
+                    prefixlen = min(30, 32 - (count + 1).bit_length())
+                    segment['subnet'] = self._allocate(self.transit_pool, prefixlen, explicit)
+                else:
+                    segment['subnet'] = self._allocate(self.stub_pool, 24, explicit)
+            subnet = segment['subnet']
+            taken = set(member[2].ip for member in segment['members'] if member[2] is not None)
+            hosts = None
+            for member in segment['members']:
+                if member[2] is not None:
+                    continue
+                number = router_number(member[0])
+                address = None
+                if number is not None and 0 < number < subnet.num_addresses - 1:
+                    address = subnet.network_address + number
+                if address is None or address in taken:
+                    hosts = hosts or subnet.hosts()
+                    address = next(address for address in hosts if address not in taken)
+                taken.add(address)
+                member[2] = ipaddress.ip_interface('{}/{}'.format(address, subnet.prefixlen))
+
+    def transit(self, segment):
+        return len(self.segments[segment]['members']) > 1
+
+    def asn(self, router):
+        asn = self.topo.nodeInfo(router).get('asn')
+        if asn is None:
+            number = router_number(router)
+            asn = self.asn_base + (number if number is not None else
+                                   self.routers.index(router) + 1)
+        return asn
+
+    def router_id(self, router):
+        "The first transit address, the first address without transit"
+        addresses = [(not self.transit(intf['segment']), intf['address'].ip)
+                     for intf in self.interfaces[router].values()]
+        return str(min(addresses, key=lambda item: item[0])[1]) if addresses else '0.0.0.0'
+
+    def peers(self, router):
+        "(address, asn) of the routers sharing a transit segment with `router`"
+        result = []
+        for intf in self.interfaces[router].values():
+            for peer, _, address in self.segments[intf['segment']]['members']:
+                if peer != router:
+                    result.append((str(address.ip), self.asn(peer)))
+        return result
+
+    def render_zebra(self, router):
+        lines = ['log file zebra.log', '!', 'hostname {}'.format(router), '!']
+        for name, intf in self.interfaces[router].items():
+            lines.append('interface {}'.format(name))
+            lines.append(' description to {} - {} interface'.format(
+                intf['segment'], 'transit' if self.transit(intf['segment']) else 'stub'))
+            lines.append(' ip address {}'.format(intf['address'].with_prefixlen))
+            lines.append(' no link-detect')
+            lines.append('!')
+        static = self.topo.nodeInfo(router).get('static_routes') or ()
+        for route in static:
+            lines.append('ip route {}'.format(route))
+        if static:
+            lines.append('!')
+        lines += ['ip forwarding', 'ipv6 forwarding', '!', 'line vty', '!']
+        return '\n'.join(lines) + '\n'
+
+    def render_ripd(self, router):
+        lines = ['log file ripd.log', '!', 'router rip', ' version 2']
+        for what in self.topo.nodeInfo(router).get('rip_redistribute') or ():
+            lines.append(' redistribute {}'.format(what))
+        for intf in self.interfaces[router].values():
+            if self.transit(intf['segment']):
+                lines.append(' network {}'.format(self.segments[intf['segment']]['subnet']))
+        lines += ['!', 'line vty', '!']
+        return '\n'.join(lines) + '\n'
+
+    def render_bgpd(self, router):
+        lines = ['log file bgpd.log', '!', 'router bgp {}'.format(self.asn(router)),
+                 ' bgp router-id {}'.format(self.router_id(router)),
+                 ' no bgp ebgp-requires-policy']
+        for address, asn in self.peers(router):
+            lines.append(' neighbor {} remote-as {}'.format(address, asn))
+        # the stub networks behind the router, the transit ones without
+        networks = [self.segments[intf['segment']]['subnet']
+                    for intf in self.interfaces[router].values()
+                    if not self.transit(intf['segment'])]
+        if not networks:
+            networks = [self.segments[intf['segment']]['subnet']
+                        for intf in self.interfaces[router].values()]
+        for network in networks:
+            lines.append(' network {}'.format(network))
+        lines += ['!', 'line vty', '!']
+        return '\n'.join(lines) + '\n'
+
+    def render(self, routers=None, daemons=DAEMONS):
+        "{router: {daemon: config text}} of all (or the given) routers"
+        configs = OrderedDict()
+        for router in routers or self.routers:
+            configs[router] = OrderedDict(
+                (daemon, getattr(self, 'render_{}'.format(daemon))(router))
+                for daemon in daemons)
+        return configs
+
+    def write(self, logdir, routers=None, daemons=DAEMONS):
+        """
+        Render and install the configs to <logdir>/<router>/ in one pass,
+        returns (written, skipped) file counts.
+        """
+        return install_configs(self.render(routers, daemons), logdir)
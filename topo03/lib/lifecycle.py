@@ -0,0 +1,109 @@
+#
+# lifecycle.py
+# Parallel start/stop of the routers of a topology
+#
+# Copyright (c) 2017 by
+# Network Device Education Foundation, Inc. ("NetDEF")
+#
+# Permission to use, copy, modify, and/or distribute this software
+# for any purpose with or without fee is hereby granted, provided
+# that the above copyright notice and this permission notice appear
+# in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND NETDEF DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL NETDEF BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY
+# DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS,
+# WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+
+"""
+Router lifecycle manager.
+
+Every Mininet node has its own shell, so different routers can be driven
+from different threads at the same time (one thread per router, never two
+threads on the same node). Starting happens in phases: zebra on all
+routers, then each protocol daemon on all routers. Every phase waits for
+the daemons' pid files / zebra's API socket instead of fixed sleeps, so
+bring-up and tear-down take roughly the time of the slowest router.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lib import crashreport
+from lib.frrconf import FrrConfigRenderer
+from lib.topolog import logger
+
+# Upper bound of concurrently driven node shells
+MAX_WORKERS = 32
+
+
+class RouterLifecycle(object):
+    "Starts and stops the daemons of `routers` in parallel"
+
+    def __init__(self, routers, workers=None):
+        self.routers = list(routers)
+        self.workers = workers or min(MAX_WORKERS, max(1, len(self.routers)))
+        self.report = None
+
+    def _each(self, what, func):
+        "Run func(router) for all routers in parallel, return the results"
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(func, self.routers))
+        logger.info('%s on %s routers took %.2f seconds',
+                    what, len(self.routers), time.time() - start_time)
+        return results
+
+    def start_routers(self, source):
+        """
+        Copy the configs from the `source` directory, or render them all
+        at once with `source` a FrrConfigRenderer, and start zebra on all
+        routers. Returns the startRouter() results (empty string on success).
+        """
+        if isinstance(source, FrrConfigRenderer):
+            start_time = time.time()
+            written, skipped = source.write(self.routers[0].logdir,
+                                            [router.name for router in self.routers])
+            logger.info('rendered configs of %d routers (%d written, %d unchanged) '
+                        'in %.2f seconds', len(self.routers), written, skipped,
+                        time.time() - start_time)
+            source = None
+        return self._each('zebra start',
+                          lambda router: router.startRouter(source))
+
+    def start_daemons(self, daemons):
+        """
+        Start the protocol `daemons` (e.g. ['ripd', 'bgpd']) on all routers,
+        one daemon after the other. Returns False if any did not come up.
+        """
+        ok = True
+        for daemon in daemons:
+            ok = all(self._each('{} start'.format(daemon),
+                                lambda router: router.startDaemon(daemon))) and ok
+        return ok
+
+    def stop_routers(self, wait=True, assertOnError=True):
+        """
+        Stop all daemons, returns the router name -> errors dict. With
+        `wait` the crash/leak findings of all routers are written to
+        crash-report.json in the run's log directory (self.report).
+        """
+        errors = self._each('stop', lambda router: router.stopRouter(
+            wait=wait, assertOnError=False))
+        errors = dict((router.name, err) for router, err in zip(self.routers, errors)
+                      if err)
+        if wait and self.routers:
+            self.report = crashreport.run_report(
+                self.routers, os.path.join(self.routers[0].logdir, 'crash-report.json'))
+            if self.report['problems']:
+                logger.error('%s daemons with problems, see %s',
+                             self.report['problems'], self.routers[0].logdir)
+        if assertOnError and errors:
+            assert "Errors found - details follow:" == 0, '\n'.join(errors.values())
+        return errors
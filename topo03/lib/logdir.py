@@ -0,0 +1,214 @@
+#
+# logdir.py
+# Per-run log directories with rotation and retention
+#
+# Copyright (c) 2017 by
+# Network Device Education Foundation, Inc. ("NetDEF")
+#
+# Permission to use, copy, modify, and/or distribute this software
+# for any purpose with or without fee is hereby granted, provided
+# that the above copyright notice and this permission notice appear
+# in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND NETDEF DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL NETDEF BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY
+# DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS,
+# WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+
+"""
+Log directory manager.
+
+Every run gets its own directory, /tmp/topotests/<test>/<run id>, with a
+'latest' symlink next to it. Node directories are created once, world
+writable and owned by the daemon user, so no recursive chmod is needed:
+the daemons are started with umask 000 and create their files readable
+and writable for everybody anyway.
+
+Old runs beyond `keep` are removed in a background thread, one run at a
+time. Daemon logs can be rotated by size: the log is copied to
+<log>.1.gz and truncated in place, FRR appends to its log file so it
+keeps writing at the (new) end.
+
+    logdirs = LogDirManager('test_topo03')
+    nodedir = logdirs.node_dir('r1')
+    logdirs.start_rotation()
+"""
+
+import grp
+import gzip
+import os
+import pwd
+import shutil
+import stat
+import threading
+import time
+
+from lib.topolog import logger
+
+BASE_DIR = '/tmp/topotests'
+KEEP_RUNS = 3
+MAX_LOG_BYTES = 10 * 1024 * 1024
+LOG_BACKUPS = 3
+ROTATE_INTERVAL = 10
+
+
+def _owner(user):
+    "uid, gid of `user` (and its group), None if it does not exist"
+    try:
+        return pwd.getpwnam(user).pw_uid, grp.getgrnam(user).gr_gid
+    except KeyError:
+        return None
+
+
+def rotate(path, backups=LOG_BACKUPS):
+    """
+    Compress `path` to <path>.1.gz (shifting older backups up to
+    <path>.<backups>.gz) and truncate it in place.
+    """
+    for i in range(backups - 1, 0, -1):
+        older = '{}.{}.gz'.format(path, i)
+        if os.path.exists(older):
+            os.replace(older, '{}.{}.gz'.format(path, i + 1))
+    tmp = '{}.1.gz.tmp'.format(path)
+    with open(path, 'rb') as src, gzip.open(tmp, 'wb', compresslevel=1) as dst:
+        shutil.copyfileobj(src, dst)
+        src_size = src.tell()
+    os.replace(tmp, '{}.1.gz'.format(path))
+    # empties the whole file: lines appended after the copy are lost, like
+    # with logrotate's copytruncate
+    os.truncate(path, 0)
+    return src_size
+
+
+class LogDirManager(object):
+    "Per-run, per-node log directories of one test"
+
+    def __init__(self, test, base=BASE_DIR, keep=KEEP_RUNS, user='frr',
+                 max_bytes=MAX_LOG_BYTES, backups=LOG_BACKUPS):
+        self.test_dir = os.path.join(base, test)
+        self.run_id = '{}-{}'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid())
+        self.run_dir = os.path.join(self.test_dir, self.run_id)
+        self.keep = keep
+        self.owner = _owner(user)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.nodes = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.rotator = None
+        self.created = False
+
+    def _mkdir(self, path):
+        "Create `path` world writable (not subject to the umask) and chown it"
+        try:
+            os.mkdir(path)
+        except FileExistsError:
+            return
+        os.chmod(path, 0o777)
+        if self.owner is not None:
+            try:
+                os.chown(path, *self.owner)
+            except OSError:
+                pass
+
+    def _create_run(self):
+        for path in (os.path.dirname(self.test_dir), self.test_dir, self.run_dir):
+            self._mkdir(path)
+        latest = os.path.join(self.test_dir, 'latest')
+        tmp = '{}.{}'.format(latest, os.getpid())
+        os.symlink(self.run_id, tmp)
+        os.replace(tmp, latest)
+        self.created = True
+        threading.Thread(target=self.prune, name='logdir-prune', daemon=True).start()
+
+    def get_run_dir(self):
+        "The directory of this run, created on first use"
+        with self.lock:
+            if not self.created:
+                self._create_run()
+        return self.run_dir
+
+    def node_dir(self, node):
+        "The directory of `node` in this run, created once"
+        with self.lock:
+            path = self.nodes.get(node)
+            if path is None:
+                if not self.created:
+                    self._create_run()
+                path = self.nodes[node] = os.path.join(self.run_dir, node)
+                self._mkdir(path)
+        return path
+
+    def runs(self):
+        """
+        Run directories of the test, oldest first. Entries starting with a
+        dot are kept across runs (the config store of lib/frrconf.py).
+        """
+        try:
+            names = os.listdir(self.test_dir)
+        except OSError:
+            return []
+        runs = []
+        for name in names:
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self.test_dir, name)
+            try:
+                st = os.lstat(path)
+            except OSError:
+                # removed meanwhile (another run pruning)
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                runs.append((st.st_mtime, path))
+        return [path for _, path in sorted(runs)]
+
+    def prune(self):
+        "Remove runs older than the `keep` newest, one after the other"
+        old = [path for path in self.runs() if path != self.run_dir]
+        for path in old[:max(0, len(old) - (self.keep - 1))]:
+            if self.stopped.is_set():
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            logger.debug('removed old log directory %s', path)
+
+    def rotate_logs(self):
+        "Rotate the *.log files of all nodes that grew past max_bytes"
+        rotated = []
+        for path in list(self.nodes.values()):
+            try:
+                names = os.listdir(path)
+            except OSError:
+                continue
+            for name in names:
+                if not name.endswith('.log'):
+                    continue
+                logfile = os.path.join(path, name)
+                try:
+                    if os.path.getsize(logfile) > self.max_bytes:
+                        rotate(logfile, self.backups)
+                        rotated.append(logfile)
+                except OSError:
+                    continue
+        return rotated
+
+    def _rotate_loop(self, interval):
+        while not self.stopped.wait(interval):
+            self.rotate_logs()
+
+    def start_rotation(self, interval=ROTATE_INTERVAL):
+        "Check the log sizes every `interval` seconds in a thread"
+        if self.rotator is None:
+            self.rotator = threading.Thread(target=self._rotate_loop, args=(interval,),
+                                            name='logdir-rotate', daemon=True)
+            self.rotator.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.rotator is not None:
+            self.rotator.join()
+            self.rotator = None
@@ -0,0 +1,343 @@
+#
+# refstore.py
+# Parsed and cached reference outputs of the routers
+#
+# Copyright (c) 2017 by
+# Network Device Education Foundation, Inc. ("NetDEF")
+#
+# Permission to use, copy, modify, and/or distribute this software
+# for any purpose with or without fee is hereby granted, provided
+# that the above copyright notice and this permission notice appear
+# in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND NETDEF DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL NETDEF BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY
+# DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS,
+# WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+
+"""
+Reference store.
+
+The rX/<kind>.ref files (show_ip_route, show_ip_rip, rip_status) are
+parsed once into records keyed by prefix (interface, network or source
+for the RIP status) with the volatile fields (timers, uptimes) masked by
+precompiled rules. Parsed records are cached outside the source tree in
+$RN_CACHE_DIR (/var/cache/rn-practice as root, like rnlib/routing.py,
+else ~/.cache/rn-practice) and only re-parsed when a .ref file changes.
+
+Live output is parsed the same way and compared record by record with
+dict lookups, linear in the size of the output:
+
+    store = RefStore(thisDir)
+    diff = store.check(net['r1'], 'show_ip_rip')   # '' when equal
+    store.regenerate([net['r1'], net['r2']])        # after convergence
+
+show_ip_route references only hold some protocols (the RIP routes), the
+live routes are compared for the protocols the reference has.
+"""
+
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.topolog import logger
+
+CACHE_DIR = os.environ.get('RN_CACHE_DIR',
+                           '/var/cache/rn-practice' if os.geteuid() == 0
+                           else os.path.expanduser('~/.cache/rn-practice'))
+# bump when the parsers change, older caches are re-parsed
+CACHE_VERSION = 1
+WORKERS = 16
+
+ROUTE = re.compile(r'^([A-Za-z])(\S*)\s+(\S+/\d+)\s+(?:\[(\d+)/(\d+)\]\s+)?(.*)$')
+ROUTE_NEXTHOP = re.compile(r'^\s+(\S*)\s+((?:via|is directly connected).*)$')
+VIA = re.compile(r'via ([^,\s]+)(?:,\s*([^,\s]+))?')
+CONNECTED = re.compile(r'is directly connected,\s*([^,\s]+)')
+RIP = re.compile(r'^(\S\(\S\))\s+(\S+/\d+)\s+(\S+)\s+(\d+)\s+(\S+)\s+(\d+)')
+RIP_INTERFACE = re.compile(r'^\s+(\S+)\s+(\d+)\s+(\d+)')
+RIP_SOURCE = re.compile(r'^\s+(\d+\.\d+\.\d+\.\d+)\s+(\d+)\s+(\d+)\s+(\d+)')
+
+# (pattern, replacement) applied to every line of a kind before parsing
+MASKS = {
+    'show_ip_route': [
+        (re.compile(r',\s*(\d\d:\d\d:\d\d|\d+d\d\dh\d\dm|\d+w\dd\d\dh)\s*$'), ''),
+    ],
+    'show_ip_rip': [
+        (re.compile(r'\b\d\d:\d\d\s*$'), 'XX:XX'),
+    ],
+    'rip_status': [
+        (re.compile(r'next due in \d+ seconds'), 'next due in XX seconds'),
+        (re.compile(r'\b\d\d:\d\d:\d\d\b'), 'XX:XX:XX'),
+    ],
+}
+COMMANDS = OrderedDict([
+    ('show_ip_route', 'show ip route'),
+    ('show_ip_rip', 'show ip rip'),
+    ('rip_status', 'show ip rip status'),
+])
+
+
+def mask(kind, line):
+    "`line` with the volatile fields of `kind` output masked"
+    for pattern, replacement in MASKS[kind]:
+        line = pattern.sub(replacement, line)
+    return line.rstrip()
+
+
+def _nexthop(text):
+    match = VIA.search(text)
+    if match:
+        return {'via': match.group(1), 'dev': match.group(2)}
+    match = CONNECTED.search(text)
+    if match:
+        return {'via': None, 'dev': match.group(1)}
+    return {'via': None, 'dev': None, 'text': ' '.join(text.split())}
+
+
+def parse_route(lines):
+    "'show ip route' lines -> prefix -> record"
+    records = OrderedDict()
+    record = None
+    for line in lines:
+        match = ROUTE.match(line)
+        if match:
+            code, flags, prefix, distance, metric, rest = match.groups()
+            record = records[prefix] = {
+                'protocol': code, 'selected': '>' in flags, 'fib': '*' in flags,
+                'distance': int(distance) if distance else None,
+                'metric': int(metric) if metric else None,
+                'nexthops': [_nexthop(rest)], 'lines': [line]}
+            continue
+        match = ROUTE_NEXTHOP.match(line)
+        if match and record is not None:
+            record['nexthops'].append(_nexthop(match.group(2)))
+            record['lines'].append(line)
+        else:
+            record = None
+    return records
+
+
+def parse_rip(lines):
+    "'show ip rip' lines -> prefix -> record"
+    records = OrderedDict()
+    for line in lines:
+        match = RIP.match(line)
+        if match:
+            rtype, prefix, nexthop, metric, source, tag = match.groups()
+            records[prefix] = {'type': rtype, 'nexthop': nexthop, 'metric': int(metric),
+                               'from': source, 'tag': int(tag), 'lines': [line]}
+    return records
+
+
+def parse_rip_status(lines):
+    "'show ip rip status' lines -> interface/network/source/line -> record"
+    records = OrderedDict()
+    section = None
+    for line in lines:
+        text = ' '.join(line.split())
+        if not text:
+            continue
+        if text.startswith('Interface Send Recv'):
+            section = 'interface'
+            continue
+        if text == 'Routing for Networks:':
+            section = 'network'
+            continue
+        if text == 'Routing Information Sources:':
+            section = 'source'
+            continue
+        if text.startswith('Gateway BadPackets'):
+            continue
+        if section == 'interface':
+            match = RIP_INTERFACE.match(line)
+            if match:
+                records['interface ' + match.group(1)] = {
+                    'send': match.group(2), 'recv': match.group(3), 'lines': [line]}
+                continue
+        elif section == 'network' and line.startswith('  '):
+            records['network ' + text] = {'lines': [line]}
+            continue
+        elif section == 'source':
+            match = RIP_SOURCE.match(line)
+            if match:
+                records['source ' + match.group(1)] = {
+                    'badpackets': int(match.group(2)), 'badroutes': int(match.group(3)),
+                    'distance': int(match.group(4)), 'lines': [line]}
+                continue
+        section = None
+        records['line ' + text] = {'lines': [line]}
+    return records
+
+
+PARSERS = {
+    'show_ip_route': parse_route,
+    'show_ip_rip': parse_rip,
+    'rip_status': parse_rip_status,
+}
+
+
+def parse(kind, text):
+    "Masked records of `kind` output `text`"
+    return PARSERS[kind](mask(kind, line) for line in text.splitlines())
+
+
+def _fields(record):
+    return dict((key, value) for key, value in record.items() if key != 'lines')
+
+
+def compare_records(expected, current, kind=None):
+    """
+    Differences between the `expected` and `current` records as a list of
+    lines, empty when equal. For show_ip_route only the protocols of
+    `expected` are compared.
+    """
+    if kind == 'show_ip_route' and expected:
+        protocols = set(record['protocol'] for record in expected.values())
+        current = OrderedDict((key, record) for key, record in current.items()
+                              if record['protocol'] in protocols)
+    diff = []
+    for key, record in expected.items():
+        live = current.get(key)
+        if live is None:
+            diff.append('-{}'.format('\n-'.join(record['lines'])))
+        elif _fields(live) != _fields(record):
+            diff.append('-{}'.format('\n-'.join(record['lines'])))
+            diff.append('+{}'.format('\n+'.join(live['lines'])))
+    for key, record in current.items():
+        if key not in expected:
+            diff.append('+{}'.format('\n+'.join(record['lines'])))
+    return diff
+
+
+class RefStore(object):
+    "The parsed <base>/<router>/<kind>.ref references"
+
+    def __init__(self, base, kinds=tuple(COMMANDS), cachedir=CACHE_DIR):
+        self.base = base
+        self.kinds = kinds
+        # one cache per reference directory
+        key = hashlib.sha1(os.path.abspath(base).encode()).hexdigest()[:16]
+        self.cachedir = cachedir
+        self.cache_path = os.path.join(cachedir, 'refstore-{}.json'.format(key))
+        self.refs = {}
+        self._load()
+
+    def _path(self, router, kind):
+        return os.path.join(self.base, router, '{}.ref'.format(kind))
+
+    def _load(self):
+        "Parse the changed references, take the others from the cache"
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f, object_pairs_hook=OrderedDict)
+            if cache.get('version') != CACHE_VERSION:
+                cache = {}
+        except (OSError, ValueError):
+            cache = {}
+        entries = cache.get('refs', {})
+        changed = False
+        for router in sorted(os.listdir(self.base)):
+            for kind in self.kinds:
+                path = self._path(router, kind)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                name = os.path.relpath(path, self.base)
+                entry = entries.get(name)
+                if entry is None or entry['mtime_ns'] != stat.st_mtime_ns \
+                        or entry['size'] != stat.st_size:
+                    with open(path) as f:
+                        entry = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+                                 'records': parse(kind, f.read())}
+                    changed = True
+                self.refs[(router, kind)] = entry
+        if changed or len(entries) != len(self.refs):
+            self._save()
+
+    def _save(self):
+        cache = {'version': CACHE_VERSION, 'refs': OrderedDict(
+            (os.path.relpath(self._path(router, kind), self.base), entry)
+            for (router, kind), entry in sorted(self.refs.items()))}
+        try:
+            os.makedirs(self.cachedir, exist_ok=True)
+            tmp = '{}.{}'.format(self.cache_path, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(cache, f)
+            os.replace(tmp, self.cache_path)
+        except OSError as error:
+            logger.debug('reference cache not written: %s', error)
+
+    def get(self, router, kind):
+        "The records of the reference, None without one"
+        entry = self.refs.get((router, kind))
+        return entry['records'] if entry is not None else None
+
+    def compare(self, router, kind, text):
+        """
+        Compare live output `text` with the reference, returns the
+        differences as text ('' when equal, None without a reference).
+        """
+        expected = self.get(router, kind)
+        if expected is None:
+            return None
+        diff = compare_records(expected, parse(kind, text), kind)
+        if not diff:
+            return ''
+        return '--- {0}/{1}.ref\n+++ {0} {2}\n{3}'.format(
+            router, kind, COMMANDS[kind], '\n'.join(diff))
+
+    def check(self, router, kind):
+        "Run the command of `kind` in `router` and compare() the output"
+        return self.compare(router.name, kind, router.vtysh_cmd(COMMANDS[kind]))
+
+    def _reference(self, router, kind, text):
+        "Masked reference text of live output, show_ip_route: only the routes"
+        records = parse(kind, text)
+        if kind != 'show_ip_route':
+            lines = [mask(kind, line) for line in text.rstrip().splitlines()]
+            return records, '\n'.join(lines) + '\n'
+        old = self.get(router, kind)
+        if old:
+            protocols = set(record['protocol'] for record in old.values())
+            records = OrderedDict((key, record) for key, record in records.items()
+                                  if record['protocol'] in protocols)
+        lines = [line for record in records.values() for line in record['lines']]
+        return records, '\n'.join(lines) + '\n'
+
+    def regenerate(self, routers, kinds=None, workers=WORKERS):
+        """
+        Write the references of all `routers` from their current (converged)
+        output, the commands run on all routers in parallel. Returns the
+        written paths.
+        """
+        kinds = kinds or self.kinds
+
+        def collect(router):
+            return [(kind, router.vtysh_cmd(COMMANDS[kind])) for kind in kinds]
+
+        routers = list(routers)
+        with ThreadPoolExecutor(max_workers=min(workers, max(1, len(routers)))) as pool:
+            outputs = list(pool.map(collect, routers))
+        written = []
+        for router, results in zip(routers, outputs):
+            os.makedirs(os.path.join(self.base, router.name), exist_ok=True)
+            for kind, text in results:
+                records, reference = self._reference(router.name, kind, text)
+                path = self._path(router.name, kind)
+                with open(path, 'w') as f:
+                    f.write(reference)
+                stat = os.stat(path)
+                self.refs[(router.name, kind)] = {
+                    'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'records': records}
+                written.append(path)
+        self._save()
+        return written
@@ -0,0 +1,165 @@
+#
+# routes.py
+# Structured kernel route table snapshots
+#
+# Copyright (c) 2017 by
+# Network Device Education Foundation, Inc. ("NetDEF")
+#
+# Permission to use, copy, modify, and/or distribute this software
+# for any purpose with or without fee is hereby granted, provided
+# that the above copyright notice and this permission notice appear
+# in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND NETDEF DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL NETDEF BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY
+# DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS,
+# WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+
+"""
+Route table snapshots.
+
+Reads a node's kernel routes with 'ip -json route' (netlink, parsed by the
+C json decoder) instead of splitting 'ip route' text in Python. The
+command runs through node.popen(), so large tables do not go through the
+node's shell pipe.
+
+    snap = route_snapshot(router, family=4, prefixes=['10.0.0.0/8'])
+    later = route_snapshot(router, family=4, prefixes=['10.0.0.0/8'])
+    added, removed, changed = snap.diff(later)
+"""
+
+import ipaddress
+import json
+import subprocess
+from collections import namedtuple
+
+# Compact route record, `via` is a tuple (more than one entry for ECMP)
+Route = namedtuple('Route', 'prefix dev via proto metric scope pref')
+
+# Same numbers FRR uses for its protocols (see proto_name_to_number)
+PROTO_NUMBERS = {
+    'bgp': '186',
+    'isis': '187',
+    'ospf': '188',
+    'rip': '189',
+    'ripng': '190',
+    'nhrp': '191',
+    'eigrp': '192',
+    'ldp': '193',
+    'sharp': '194',
+    'pbr': '195',
+    'static': '196',
+}
+
+
+def parse_routes(data):
+    """
+    Turn 'ip -json route' output into a list of Route records. The prefix
+    is the destination as 'ip route' prints it (host routes without a
+    prefix length, like the keys ip4_route() always had).
+    """
+    routes = []
+    for entry in json.loads(data or '[]'):
+        if 'nexthops' in entry:
+            via = tuple(nh['gateway'] for nh in entry['nexthops'] if 'gateway' in nh)
+            dev = entry['nexthops'][0].get('dev') if entry['nexthops'] else None
+        else:
+            via = (entry['gateway'],) if 'gateway' in entry else ()
+            dev = entry.get('dev')
+        proto = entry.get('protocol')
+        metric = entry.get('metric')
+        routes.append(Route(
+            entry.get('dst', 'default'), dev, via,
+            PROTO_NUMBERS.get(proto, proto) if proto is not None else None,
+            str(metric) if metric is not None else None,
+            entry.get('scope'), entry.get('pref')))
+    return routes
+
+
+class RouteSnapshot(object):
+    "Routes of one node at one point in time, indexed by prefix"
+
+    def __init__(self, routes, family=4):
+        self.family = family
+        self.routes = dict((r.prefix, r) for r in routes)
+
+    def __len__(self):
+        return len(self.routes)
+
+    def __contains__(self, prefix):
+        return prefix in self.routes
+
+    def __getitem__(self, prefix):
+        return self.routes[prefix]
+
+    def filter(self, prefixes):
+        "Snapshot with only the routes inside one of `prefixes`"
+        nets = [ipaddress.ip_network(p) for p in prefixes]
+        routes = []
+        for route in self.routes.values():
+            if route.prefix == 'default':
+                net = ipaddress.ip_network('0.0.0.0/0' if self.family == 4 else '::/0')
+            else:
+                # a host route's bare address is a /32 or /128 network
+                net = ipaddress.ip_network(route.prefix, strict=False)
+            if any(net.version == n.version and net.subnet_of(n) for n in nets):
+                routes.append(route)
+        return RouteSnapshot(routes, self.family)
+
+    def diff(self, other):
+        """
+        Compare with a later snapshot. Returns (added, removed, changed):
+        lists of Route for added/removed prefixes and (old, new) pairs for
+        prefixes whose route changed.
+        """
+        mine, theirs = self.routes, other.routes
+        added = [theirs[p] for p in theirs.keys() - mine.keys()]
+        removed = [mine[p] for p in mine.keys() - theirs.keys()]
+        changed = [(mine[p], theirs[p]) for p in mine.keys() & theirs.keys()
+                   if mine[p] != theirs[p]]
+        return added, removed, changed
+
+    def to_dict(self):
+        """
+        The format of ip4_route()/ip6_route(): prefix -> dict with the
+        'dev', 'via', 'proto', 'metric' and 'scope' (IPv4) / 'pref' (IPv6)
+        keys the route has.
+        """
+        result = {}
+        for route in self.routes.values():
+            entry = result[route.prefix] = {}
+            if route.dev is not None:
+                entry['dev'] = route.dev
+            if route.via:
+                entry['via'] = route.via[0]
+            if route.proto is not None:
+                entry['proto'] = route.proto
+            if route.metric is not None:
+                entry['metric'] = route.metric
+            if self.family == 4 and route.scope is not None and route.scope != 'global':
+                entry['scope'] = route.scope
+            if self.family == 6 and route.pref is not None:
+                entry['pref'] = route.pref
+        return result
+
+
+def route_snapshot(node, family=4, table='main', prefixes=None):
+    """
+    Snapshot the kernel routes of `node` (a Mininet node, None for the
+    host itself), optionally only those inside `prefixes`.
+    """
+    cmd = ['ip', '-json', '-{}'.format(family), 'route', 'show', 'table', str(table)]
+    if node is None:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    else:
+        proc = node.popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    data, _ = proc.communicate()
+    snap = RouteSnapshot(parse_routes(data.decode()), family)
+    if prefixes is not None:
+        snap = snap.filter(prefixes)
+    return snap
@@ -24,10 +24,23 @@
 Logging utilities for topology tests.
 
 This file defines our logging abstraction.
+
+Records are not written by the calling thread: every logger has a
+QueueHandler that only puts the record on a queue (the message is not
+formatted there either), a QueueListener thread formats and writes it to
+the sinks. Sinks are stdout/stderr for the global logger, an optional
+file per router (router_logger()) and the targets of get_logger().
+set_format('json') switches all sinks to one JSON object per line.
 """
 
-import sys
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
 
 # Helper dictionary to convert Topogen logging levels to Python's logging.
 DEBUG_TOPO2LOGGING = {
@@ -39,10 +52,62 @@ DEBUG_TOPO2LOGGING = {
     'critical': logging.CRITICAL,
 }
 
+TEXT_FORMAT = '%(asctime)s %(levelname)s: %(message)s'
+
+
 class InfoFilter(logging.Filter):
     def filter(self, rec):
         return rec.levelno in (logging.DEBUG, logging.INFO)
 
+
+class JsonFormatter(logging.Formatter):
+    "One JSON object per record"
+
+    def format(self, record):
+        data = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread. The stdlib
+    one merges msg and args in the calling thread; mutable arguments must
+    not be changed after the log call.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class SinkHandler(logging.Handler):
+    """
+    Handler of the listener thread: sends a record to the handlers
+    registered for its logger name, the console handlers are used for
+    loggers registered with console=True.
+    """
+
+    def __init__(self, console):
+        super(SinkHandler, self).__init__()
+        self.console = console
+        # logger name -> (handler or None, also to console)
+        self.sinks = {}
+
+    def handle(self, record):
+        handler, console = self.sinks.get(record.name, (None, True))
+        if handler is not None and record.levelno >= handler.level:
+            handler.handle(record)
+        if console:
+            for handler in self.console:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
 #
 # Logger class definition
 #
@@ -59,29 +124,68 @@ class Logger(object):
         # Create default global logger
         self.log_level = logging.INFO
         self.logger = logging.Logger('topolog', level=self.log_level)
+        self.lock = threading.Lock()
 
         handler_stdout = logging.StreamHandler(sys.stdout)
         handler_stdout.setLevel(logging.DEBUG)
         handler_stdout.addFilter(InfoFilter())
-        handler_stdout.setFormatter(
-            logging.Formatter(fmt='%(asctime)s %(levelname)s: %(message)s')
-        )
         handler_stderr = logging.StreamHandler()
         handler_stderr.setLevel(logging.WARNING)
-        handler_stderr.setFormatter(
-            logging.Formatter(fmt='%(asctime)s %(levelname)s: %(message)s')
-        )
 
-        self.logger.addHandler(handler_stdout)
-        self.logger.addHandler(handler_stderr)
+        self.handlers = [handler_stdout, handler_stderr]
+        self.formatter = logging.Formatter(fmt=TEXT_FORMAT)
+        for handler in self.handlers:
+            handler.setFormatter(self.formatter)
+
+        self.queue = queue.Queue()
+        self.sink = SinkHandler(list(self.handlers))
+        self.listener = logging.handlers.QueueListener(self.queue, self.sink)
+        self.listener.start()
+        atexit.register(self.flush)
+
+        self.logger.addHandler(LazyQueueHandler(self.queue))
 
         # Handle more loggers
         self.loggers = {'topolog': self.logger}
 
+        if os.environ.get('TOPOLOG_FORMAT') == 'json':
+            self.set_format('json')
+
     def set_log_level(self, level):
         "Set the logging level"
         self.log_level = DEBUG_TOPO2LOGGING.get(level)
         self.logger.setLevel(self.log_level)
+        for name, nlogger in self.loggers.items():
+            if name.startswith('topolog.'):
+                nlogger.setLevel(self.log_level)
+
+    def set_format(self, fmt):
+        "Switch all sinks to 'text' or 'json' (JSON lines)"
+        # queued records keep the format they were logged with
+        self.flush()
+        if fmt == 'json':
+            self.formatter = JsonFormatter()
+        else:
+            self.formatter = logging.Formatter(fmt=TEXT_FORMAT)
+        for handler in self.handlers:
+            handler.setFormatter(self.formatter)
+
+    def flush(self):
+        "Wait until the listener thread has written all queued records"
+        # the listener calls task_done() for every record it handled
+        self.queue.join()
+        for handler in self.handlers:
+            handler.flush()
+
+    def _add(self, name, log_level, handler, console):
+        nlogger = logging.Logger(name, level=log_level)
+        nlogger.addHandler(LazyQueueHandler(self.queue))
+        if handler is not None:
+            handler.setFormatter(self.formatter)
+            self.handlers.append(handler)
+        self.sink.sinks[name] = (handler, console)
+        self.loggers[name] = nlogger
+        return nlogger
 
     def get_logger(self, name='topolog', log_level=None, target=sys.stdout):
         """
@@ -90,21 +194,31 @@ class Logger(object):
         """
         if log_level is None:
             log_level = self.log_level
-        if self.loggers.has_key(name):
-            return self.loggers[name]
+        with self.lock:
+            if name in self.loggers:
+                return self.loggers[name]
 
-        nlogger = logging.Logger(name, level=log_level)
-        if isinstance(target, str):
-            handler = logging.FileHandler(filename=target)
-        else:
-            handler = logging.StreamHandler(stream=target)
+            if isinstance(target, str):
+                handler = logging.FileHandler(filename=target)
+            else:
+                handler = logging.StreamHandler(stream=target)
+            return self._add(name, log_level, handler, console=False)
 
-        handler.setFormatter(
-            logging.Formatter(fmt='%(asctime)s %(levelname)s: %(message)s')
-        )
-        nlogger.addHandler(handler)
-        self.loggers[name] = nlogger
-        return nlogger
+    def router_logger(self, name, filename=None, log_level=None):
+        """
+        Logger for router `name`: writes to the console like the global
+        logger and, if `filename` is given, also to that file.
+        """
+        if log_level is None:
+            log_level = self.log_level
+        name = 'topolog.{}'.format(name)
+        with self.lock:
+            if name in self.loggers:
+                return self.loggers[name]
+            handler = None
+            if filename is not None:
+                handler = logging.FileHandler(filename=filename, delay=True)
+            return self._add(name, log_level, handler, console=True)
 
 #
 # Global variables
@@ -112,4 +226,3 @@ class Logger(object):
 
 logger_config = Logger()
 logger = logger_config.logger
-
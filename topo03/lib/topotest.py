@@ -29,20 +29,20 @@ import re
 import sys
 import functools
 import glob
-import pwd
-import grp
-try:
-    from StringIO import StringIO ## for Python 2
-except ImportError:
-    from io import StringIO ## for Python 3
-
-import subprocess
 import tempfile
 import platform
 import difflib
+import bisect
 import time
 
-from lib.topolog import logger
+from lib.topolog import logger, logger_config
+from lib.convergence import ConvergenceWaiter
+from lib.routes import route_snapshot
+from lib.vtysh import VtyshPool
+from lib.logdir import LogDirManager
+from lib.addresses import AddressInventory
+from lib import crashreport
+from lib import frrconf
 
 from mininet.topo import Topo
 from mininet.net import Mininet
@@ -55,34 +55,68 @@ class json_cmp_result(object):
     "json_cmp result class for better assertion messages"
 
     def __init__(self):
-        self.errors = []
+        self._errors = []
 
     def add_error(self, error):
-        "Append error message to the result"
-        for line in error.splitlines():
-            self.errors.append(line)
+        """
+        Append error message to the result. `error` may also be a callable
+        returning the message, it is only rendered when `errors` is read.
+        """
+        self._errors.append(error)
+
+    @property
+    def errors(self):
+        "Error message lines"
+        lines = []
+        for error in self._errors:
+            if callable(error):
+                error = error()
+            lines.extend(error.splitlines())
+        return lines
 
     def has_errors(self):
         "Returns True if there were errors, otherwise False."
-        return len(self.errors) > 0
+        return len(self._errors) > 0
+
+    def __str__(self):
+        return '\n'.join(self.errors)
+
+
+class _json_error(object):
+    "Error message with a json_diff() that is rendered on first use"
+
+    def __init__(self, fmt, args, d1, d2):
+        self.fmt = fmt
+        self.args = args
+        self.d1 = d1
+        self.d2 = d2
+
+    def __call__(self):
+        return self.fmt.format(*(self.args + (json_diff(self.d1, self.d2),)))
+
+# Keys list items are indexed by (first one all expected items have)
+JSON_INDEX_KEYS = ('prefix', 'network', 'prefixes', 'interface', 'name',
+                   'address', 'id', 'vrf', 'neighbor', 'peer')
+
+_JSON_SCALARS = (str, int, float, bool)
+
+# Log directories of this run: /tmp/topotests/test_topo03/<run id>/<node>
+logdirs = LogDirManager('test_topo03')
+
+# Interface addresses of the routers, re-read when 'ip monitor' reports a change
+addresses = AddressInventory(watch=True)
 
 def get_test_logdir(node=None, init=False):
     """
-    Return the current test log directory based on PYTEST_CURRENT_TEST
-    environment variable.
+    Return the current test (run) log directory.
     Optional paramters:
     node:  when set, adds the node specific log directory to the init dir
-    init:  when set, initializes the log directory and fixes path permissions
+    init:  when set, creates the (node) log directory with the right
+           permissions and ownership
     """
-    cur_test = 'test_topo03'
-
-    ret = '/tmp/topotests/' + cur_test
-    if node != None:
-        dir = ret + "/" + node
-    if init:
-        os.system('mkdir -p ' + dir)
-        os.system('chmod -R go+rw /tmp/topotests')
-    return ret
+    if init and node is not None:
+        logdirs.node_dir(node)
+    return logdirs.get_run_dir()
 
 def json_diff(d1, d2):
     """
@@ -97,45 +131,104 @@ def json_diff(d1, d2):
     return difflines(dstr2, dstr1, title1='Expected value', title2='Current value', n=0)
 
 
-def _json_list_cmp(list1, list2, parent, result):
+def _json_index_key(items):
+    "Pick the key to index list items by, None if there is none"
+    dicts = [item for item in items if isinstance(item, dict)]
+    if not dicts or len(dicts) != len(items):
+        return None
+
+    def usable(key):
+        return all(isinstance(item.get(key), _JSON_SCALARS) for item in dicts)
+
+    for key in JSON_INDEX_KEYS:
+        if usable(key):
+            return key
+    for key in sorted(dicts[0]):
+        if usable(key):
+            return key
+    return None
+
+
+def _json_list_subset(list1, list2, index=True):
+    """
+    Returns True if every item of list2 matches (is a subset of) some item
+    of list1. With `index`, list1 is hashed by a key all expected items
+    have (or by value for scalar lists), so only items with the same key
+    value are compared: O(n + m) instead of O(n * m).
+    """
+    if len(list2) > len(list1):
+        return False
+    if not list2:
+        return True
+
+    key = _json_index_key(list2) if index else None
+    if key is not None:
+        buckets = {}
+        for value in list1:
+            if isinstance(value, dict):
+                kval = value.get(key)
+                if isinstance(kval, _JSON_SCALARS):
+                    buckets.setdefault(kval, []).append(value)
+        for expected in list2:
+            candidates = buckets.get(expected[key], ())
+            if not any(_json_subset(value, expected, index) for value in candidates):
+                return False
+        return True
+
+    if index and all(isinstance(item, _JSON_SCALARS) for item in list2):
+        hashable = set(value for value in list1 if isinstance(value, _JSON_SCALARS))
+        return all(expected in hashable for expected in list2)
+
+    for expected in list2:
+        if expected is None:
+            return False
+        if not any(_json_subset(value, expected, index) for value in list1):
+            return False
+    return True
+
+
+def _json_subset(d1, d2, index=True):
+    "Fast boolean version of json_cmp(): does `d1` contain `d2`?"
+    if isinstance(d2, dict):
+        if not isinstance(d1, dict):
+            return False
+        for key, value in d2.items():
+            if value is None:
+                if key in d1:
+                    return False
+            elif key not in d1 or not _json_subset(d1[key], value, index):
+                return False
+        return True
+    if isinstance(d2, list):
+        return isinstance(d1, list) and _json_list_subset(d1, d2, index)
+    return d1 == d2
+
+
+def _json_list_cmp(list1, list2, parent, result, index=True):
     "Handles list type entries."
     # Check second list2 type
     if not isinstance(list1, type([])) or not isinstance(list2, type([])):
-        result.add_error(
-            '{} has different type than expected '.format(parent) +
-            '(have {}, expected {}):\n{}'.format(
-                type(list1), type(list2), json_diff(list1, list2)))
+        result.add_error(_json_error(
+            '{} has different type than expected '
+            '(have {}, expected {}):\n{}', (parent, type(list1), type(list2)),
+            list1, list2))
         return
 
     # Check list size
     if len(list2) > len(list1):
-        result.add_error(
-            '{} too few items '.format(parent) +
-            '(have {}, expected {}:\n {})'.format(
-                len(list1), len(list2),
-                json_diff(list1, list2)))
+        result.add_error(_json_error(
+            '{} too few items '
+            '(have {}, expected {}:\n {})', (parent, len(list1), len(list2)),
+            list1, list2))
         return
 
-    # List all unmatched items errors
-    unmatched = []
-    for expected in list2:
-        matched = False
-        for value in list1:
-            if json_cmp({'json': value}, {'json': expected}) is None:
-                matched = True
-                break
-
-        if not matched:
-            unmatched.append(expected)
-
     # If there are unmatched items, error out.
-    if unmatched:
-        result.add_error(
-            '{} value is different (\n{})'.format(
-                parent, json_diff(list1, list2)))
+    if not _json_list_subset(list1, list2, index):
+        result.add_error(_json_error(
+            '{} value is different (\n{})', (parent,), list1, list2))
 
 
-def json_cmp(d1, d2):
+def json_cmp(d1, d2, index=True):
     """
     JSON compare function. Receives two parameters:
     * `d1`: json value
@@ -145,6 +238,10 @@ def json_cmp(d1, d2):
     otherwise a string containing what failed.
 
     Note: key absence can be tested by adding a key with value `None`.
+
+    List items are matched through an index on a key like 'prefix' (see
+    JSON_INDEX_KEYS), `index=False` compares every item with every item.
+    The diffs in the error messages are only rendered when read.
     """
     squeue = [(d1, d2, 'json')]
     result = json_cmp_result()
@@ -154,7 +251,7 @@ def json_cmp(d1, d2):
 
         # Handle JSON beginning with lists.
         if isinstance(nd1, type([])) or isinstance(nd2, type([])):
-            _json_list_cmp(nd1, nd2, parent, result)
+            _json_list_cmp(nd1, nd2, parent, result, index)
             if result.has_errors():
                 return result
             else:
@@ -165,23 +262,26 @@ def json_cmp(d1, d2):
         s2_req = set([key for key in nd2 if nd2[key] is not None])
         diff = s2_req - s1
         if diff != set({}):
-            result.add_error('expected key(s) {} in {} (have {}):\n{}'.format(
-                str(list(diff)), parent, str(list(s1)), json_diff(nd1, nd2)))
+            result.add_error(_json_error(
+                'expected key(s) {} in {} (have {}):\n{}',
+                (str(list(diff)), parent, str(list(s1))), nd1, nd2))
 
         for key in s2.intersection(s1):
             # Test for non existence of key in d2
             if nd2[key] is None:
-                result.add_error('"{}" should not exist in {} (have {}):\n{}'.format(
-                    key, parent, str(s1), json_diff(nd1[key], nd2[key])))
+                result.add_error(_json_error(
+                    '"{}" should not exist in {} (have {}):\n{}',
+                    (key, parent, str(s1)), nd1[key], nd2[key]))
                 continue
 
             # If nd1 key is a dict, we have to recurse in it later.
             if isinstance(nd2[key], type({})):
                 if not isinstance(nd1[key], type({})):
-                    result.add_error(
-                        '{}["{}"] has different type than expected '.format(parent, key) +
-                        '(have {}, expected {}):\n{}'.format(
-                            type(nd1[key]), type(nd2[key]), json_diff(nd1[key], nd2[key])))
+                    result.add_error(_json_error(
+                        '{}["{}"] has different type than expected '
+                        '(have {}, expected {}):\n{}',
+                        (parent, key, type(nd1[key]), type(nd2[key])),
+                        nd1[key], nd2[key]))
                     continue
                 nparent = '{}["{}"]'.format(parent, key)
                 squeue.append((nd1[key], nd2[key], nparent))
@@ -189,14 +289,14 @@ def json_cmp(d1, d2):
 
             # Check list items
             if isinstance(nd2[key], type([])):
-                _json_list_cmp(nd1[key], nd2[key], parent, result)
+                _json_list_cmp(nd1[key], nd2[key], parent, result, index)
                 continue
 
             # Compare JSON values
             if nd1[key] != nd2[key]:
-                result.add_error(
-                    '{}["{}"] value is different (\n{})'.format(
-                        parent, key, json_diff(nd1[key], nd2[key])))
+                result.add_error(_json_error(
+                    '{}["{}"] value is different (\n{})', (parent, key),
+                    nd1[key], nd2[key]))
                 continue
 
     if result.has_errors():
@@ -225,9 +325,10 @@ def router_json_cmp(router, cmd, data):
 
 def run_and_expect(func, what, count=20, wait=3):
     """
-    Run `func` and compare the result with `what`. Do it for `count` times
-    waiting `wait` seconds between tries. By default it tries 20 times with
-    3 seconds delay between tries.
+    Run `func` and compare the result with `what` until it matches or
+    `count` * `wait` seconds passed. Tries start 25ms apart and back off
+    exponentially up to `wait` seconds, so a converged network is detected
+    right away. By default it waits up to 60 seconds.
 
     Returns (True, func-return) on success or
     (False, func-return) on failure.
@@ -238,7 +339,6 @@ def run_and_expect(func, what, count=20, wait=3):
     - router_output_cmp
     - router_json_cmp
     """
-    start_time = time.time()
     func_name = "<unknown>"
     if func.__class__ == functools.partial:
         func_name = func.func.__name__
@@ -246,25 +346,11 @@ def run_and_expect(func, what, count=20, wait=3):
         func_name = func.__name__
 
     logger.info(
-        "'{}' polling started (interval {} secs, maximum wait {} secs)".format(
-            func_name, wait, int(wait * count)))
-
-    while count > 0:
-        result = func()
-        if result != what:
-            time.sleep(wait)
-            count -= 1
-            continue
+        "'%s' polling started (interval up to %s secs, maximum wait %s secs)",
+        func_name, wait, int(wait * count))
 
-        end_time = time.time()
-        logger.info("'{}' succeeded after {:.2f} seconds".format(
-            func_name, end_time - start_time))
-        return (True, result)
-
-    end_time = time.time()
-    logger.error("'{}' failed after {:.2f} seconds".format(
-        func_name, end_time - start_time))
-    return (False, result)
+    waiter = ConvergenceWaiter(timeout=wait * count, max_wait=wait)
+    return waiter.wait(func, what, func_name)
 
 
 def int2dpid(dpid):
@@ -309,11 +395,140 @@ def get_textdiff(text1, text2, title1="", title2="", **opts):
     diff = os.linesep.join([s for s in diff.splitlines() if s])
     return diff
 
+# Gaps between patience anchors without unique lines are handed to
+# difflib up to this many line pairs, larger ones are reported as replaced
+DIFF_FALLBACK_LIMIT = 1000000
+
+
+def _diff_blocks(a, b, alo, ahi, blo, bhi, blocks):
+    """
+    Patience diff of a[alo:ahi] and b[blo:bhi]: appends the matching
+    blocks [i, j, size] to `blocks` in order.
+    """
+    start = alo
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        alo += 1
+        blo += 1
+    if alo > start:
+        blocks.append([start, blo - (alo - start), alo - start])
+    end = ahi
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+    if alo < ahi and blo < bhi:
+        # lines occurring exactly once on both sides, the anchors
+        seen = {}
+        for i in range(alo, ahi):
+            seen[a[i]] = -1 if a[i] in seen else i
+        unique = {}
+        for j in range(blo, bhi):
+            i = seen.get(b[j], -1)
+            if i >= 0:
+                unique[i] = -1 if i in unique else j
+        pairs = sorted((i, j) for i, j in unique.items() if j >= 0)
+        # longest increasing run of b positions (patience sorting)
+        tops = []
+        piles = []
+        for i, j in pairs:
+            pile = bisect.bisect_left(tops, j)
+            if pile == len(tops):
+                tops.append(j)
+            else:
+                tops[pile] = j
+            piles.append(pile)
+        anchors = []
+        want = len(tops) - 1
+        for index in range(len(pairs) - 1, -1, -1):
+            if piles[index] == want:
+                anchors.append(pairs[index])
+                want -= 1
+        anchors.reverse()
+        if anchors:
+            for i, j in anchors:
+                _diff_blocks(a, b, alo, i, blo, j, blocks)
+                blocks.append([i, j, 1])
+                alo, blo = i + 1, j + 1
+            _diff_blocks(a, b, alo, ahi, blo, bhi, blocks)
+        elif (ahi - alo) * (bhi - blo) <= DIFF_FALLBACK_LIMIT:
+            matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=False)
+            for i, j, size in matcher.get_matching_blocks():
+                if size:
+                    blocks.append([alo + i, blo + j, size])
+    if end > ahi:
+        blocks.append([ahi, bhi, end - ahi])
+
+
+class _PatienceMatcher(difflib.SequenceMatcher):
+    "SequenceMatcher whose matching blocks come from _diff_blocks()"
+
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+        self.matching_blocks = None
+        self.opcodes = None
+
+    def get_matching_blocks(self):
+        if self.matching_blocks is None:
+            blocks = []
+            _diff_blocks(self.a, self.b, 0, len(self.a), 0, len(self.b), blocks)
+            merged = []
+            for block in blocks:
+                last = merged[-1] if merged else None
+                if last and last[0] + last[2] == block[0] and last[1] + last[2] == block[1]:
+                    last[2] += block[2]
+                else:
+                    merged.append(block)
+            merged.append([len(self.a), len(self.b), 0])
+            self.matching_blocks = [difflib.Match(*block) for block in merged]
+        return self.matching_blocks
+
+
+def _unified_range(start, stop):
+    "Hunk range like difflib.unified_diff() writes it"
+    length = stop - start
+    if length == 1:
+        return '{}'.format(start + 1)
+    return '{},{}'.format(start + 1 if length else start, length)
+
+
+def unified_diff_lines(lines1, lines2, title1='', title2='', n=3):
+    """
+    unified_diff() of two line lists (without line endings), short-circuits
+    on equal input and uses a patience diff, which stays close to linear
+    on large tables where difflib goes quadratic.
+    """
+    if lines1 == lines2:
+        return
+    groups = _PatienceMatcher(lines1, lines2).get_grouped_opcodes(n)
+    first = True
+    for group in groups:
+        if first:
+            yield '--- {}'.format(title1)
+            yield '+++ {}'.format(title2)
+            first = False
+        yield '@@ -{} +{} @@'.format(_unified_range(group[0][1], group[-1][2]),
+                                     _unified_range(group[0][3], group[-1][4]))
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                for line in lines1[i1:i2]:
+                    yield ' ' + line
+                continue
+            if tag in ('replace', 'delete'):
+                for line in lines1[i1:i2]:
+                    yield '-' + line
+            if tag in ('replace', 'insert'):
+                for line in lines2[j1:j2]:
+                    yield '+' + line
+
+
 def difflines(text1, text2, title1='', title2='', **opts):
-    "Wrapper for get_textdiff to avoid string transformations."
-    text1 = ('\n'.join(text1.rstrip().splitlines()) + '\n').splitlines(1)
-    text2 = ('\n'.join(text2.rstrip().splitlines()) + '\n').splitlines(1)
-    return get_textdiff(text1, text2, title1, title2, **opts)
+    "Returns empty string if same or the unified diff of the two texts"
+    if text1 == text2:
+        return ''
+    # an empty text is one empty line, like it always was
+    lines1 = text1.rstrip().splitlines() or ['']
+    lines2 = text2.rstrip().splitlines() or ['']
+    return os.linesep.join(unified_diff_lines(lines1, lines2, title1, title2, opts.get('n', 3)))
 
 def get_file(content):
     """
@@ -325,19 +540,40 @@ def get_file(content):
     fde.close()
     return fname
 
-def normalize_text(text):
+_BLANKS = re.compile(r'[ \t]+')
+# whitespace str.split() splits on but normalize_text() keeps
+_ODD_SPACES = re.compile('[\r\x0b\x0c\x1c-\x1f]')
+
+
+def normalize_lines(lines):
     """
-    Strips formating spaces/tabs, carriage returns and trailing whitespace.
+    normalize_text() of an iterable of lines (a file, a pipe, ...), one
+    line at a time: yields the lines without line endings, formating
+    spaces/tabs, carriage returns and trailing whitespace. Trailing empty
+    lines are dropped.
     """
-    text = re.sub(r'[ \t]+', ' ', text)
-    text = re.sub(r'\r', '', text)
+    empty = 0
+    for line in lines:
+        line = line.rstrip(' \t\r\n')
+        if not line:
+            empty += 1
+            continue
+        if line.isascii() and not _ODD_SPACES.search(line):
+            # split() collapses the blanks in C, keep one leading blank
+            line = (' ' if line[0] in ' \t' else '') + ' '.join(line.split())
+        else:
+            line = _BLANKS.sub(' ', line).replace('\r', '').rstrip(' \t')
+        for _ in range(empty):
+            yield ''
+        empty = 0
+        yield line
 
-    # Remove whitespace in the middle of text.
-    text = re.sub(r'[ \t]+\n', '\n', text)
-    # Remove whitespace at the end of the text.
-    text = text.rstrip()
 
-    return text
+def normalize_text(text):
+    """
+    Strips formating spaces/tabs, carriage returns and trailing whitespace.
+    """
+    return '\n'.join(normalize_lines(text.split('\n'))).rstrip()
 
 def module_present(module, load=True):
     """
@@ -421,6 +657,8 @@ def interface_set_status(node, ifacename, ifaceaction=False, vrf_name=None):
         cmd = 'vtysh -c \"configure terminal\" -c \"interface {0} vrf {1}\" -c \"{2}\"'.format(ifacename, vrf_name, str_ifaceaction)
     node.run(cmd)
 
+_ROUTE_UPTIME = re.compile(r" [0-2][0-9]:[0-5][0-9]:[0-5][0-9]")
+
 def ip4_route_zebra(node, vrf_name=None):
     """
     Gets an output of 'show ip route' command. It can be used
@@ -430,7 +668,7 @@ def ip4_route_zebra(node, vrf_name=None):
         tmp = node.vtysh_cmd('show ip route')
     else:
         tmp = node.vtysh_cmd('show ip route vrf {0}'.format(vrf_name))
-    output = re.sub(r" [0-2][0-9]:[0-5][0-9]:[0-5][0-9]", " XX:XX:XX", tmp)
+    output = _ROUTE_UPTIME.sub(" XX:XX:XX", tmp)
 
     lines = output.splitlines()
     header_found = False
@@ -458,7 +696,8 @@ def proto_name_to_number(protocol):
 
 def ip4_route(node):
     """
-    Gets a structured return of the command 'ip route'. It can be used in
+    Gets a structured return of the command 'ip route' (read as JSON, see
+    lib/routes.py for snapshots and diffs). It can be used in
     conjuction with json_cmp() to provide accurate assert explanations.
 
     Return example:
@@ -474,31 +713,12 @@ def ip4_route(node):
         }
     }
     """
-    output = normalize_text(node.run('ip route')).splitlines()
-    result = {}
-    for line in output:
-        columns = line.split(' ')
-        route = result[columns[0]] = {}
-        prev = None
-        for column in columns:
-            if prev == 'dev':
-                route['dev'] = column
-            if prev == 'via':
-                route['via'] = column
-            if prev == 'proto':
-                # translate protocol names back to numbers
-                route['proto'] = proto_name_to_number(column)
-            if prev == 'metric':
-                route['metric'] = column
-            if prev == 'scope':
-                route['scope'] = column
-            prev = column
-
-    return result
+    return route_snapshot(node, family=4).to_dict()
 
 def ip6_route(node):
     """
-    Gets a structured return of the command 'ip -6 route'. It can be used in
+    Gets a structured return of the command 'ip -6 route' (read as JSON, see
+    lib/routes.py for snapshots and diffs). It can be used in
     conjuction with json_cmp() to provide accurate assert explanations.
 
     Return example:
@@ -513,39 +733,34 @@ def ip6_route(node):
         }
     }
     """
-    output = normalize_text(node.run('ip -6 route')).splitlines()
-    result = {}
-    for line in output:
-        columns = line.split(' ')
-        route = result[columns[0]] = {}
-        prev = None
-        for column in columns:
-            if prev == 'dev':
-                route['dev'] = column
-            if prev == 'via':
-                route['via'] = column
-            if prev == 'proto':
-                # translate protocol names back to numbers
-                route['proto'] = proto_name_to_number(column)
-            if prev == 'metric':
-                route['metric'] = column
-            if prev == 'pref':
-                route['pref'] = column
-            prev = column
-
-    return result
+    return route_snapshot(node, family=6).to_dict()
 
 def sleep(amount, reason=None):
     """
     Sleep wrapper that registers in the log the amount of sleep
     """
     if reason is None:
-        logger.info('Sleeping for {} seconds'.format(amount))
+        logger.info('Sleeping for %s seconds', amount)
     else:
-        logger.info(reason + ' ({} seconds)'.format(amount))
+        logger.info('%s (%s seconds)', reason, amount)
 
     time.sleep(amount)
 
+def wait_for(check, timeout=10, interval=0.01, max_interval=0.5):
+    """
+    Call `check` until it returns True or `timeout` seconds passed, with an
+    exponential backoff starting at `interval`. Returns the last result.
+    """
+    deadline = time.time() + timeout
+    while True:
+        if check():
+            return True
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, max_interval)
+
 def checkAddressSanitizerError(output, router, component):
     "Checks for AddressSanitizer in output. If found, then logs it and returns true, false otherwise"
 
@@ -567,15 +782,18 @@ def checkAddressSanitizerError(output, router, component):
         return True
     return False
 
-def addRouter(topo, name):
-    "Adding a FRRouter (or Quagga) to Topology"
+def addRouter(topo, name, **params):
+    """
+    Adding a FRRouter (or Quagga) to Topology, `params` are kept with the
+    node (e.g. the lib/frrconf.py options asn, static_routes, ...)
+    """
 
     MyPrivateDirs = ['/etc/frr',
                          '/etc/quagga',
                          '/var/run/frr',
                          '/var/run/quagga',
                          '/var/log']
-    return topo.addNode(name, cls=Router, privateDirs=MyPrivateDirs)
+    return topo.addNode(name, cls=Router, privateDirs=MyPrivateDirs, **params)
 
 def set_sysctl(node, sysctl, value):
     "Set a sysctl value and return None on success or an error string"
@@ -629,6 +847,11 @@ class Router(Node):
         self.daemons_options = {'zebra': ''}
         self.reportCores = True
         self.version = None
+        self.crash_report = {}
+        self.vtysh = VtyshPool(self)
+        # console and {logdir}/{name}/topolog.log, written by the log thread
+        self.logger = logger_config.router_logger(
+            name, os.path.join(self.logdir, name, 'topolog.log'))
 
     def _config_frr(self, **params):
         "Configure FRR binaries"
@@ -697,41 +920,43 @@ class Router(Node):
         # Disable forwarding
         set_sysctl(self, 'net.ipv4.ip_forward', 0)
         set_sysctl(self, 'net.ipv6.conf.all.forwarding', 0)
+        addresses.forget(self)
         super(Router, self).terminate()
-        os.system('chmod -R go+rw /tmp/topotests')
+
+    def _pidfiles(self):
+        "Pid files of running daemons, in FRR's run dir and the node log dir"
+        output = self.cmd('ls -1 /var/run/{0}/*.pid {1}/{2}/*.pid 2>/dev/null'.format(
+            self.routertype, self.logdir, self.name))
+        return [line.strip() for line in output.splitlines() if line.strip()]
 
     def stopRouter(self, wait=True, assertOnError=True, minErrorVersion='5.1'):
         # Stop Running Quagga or FRR Daemons
-        rundaemons = self.cmd('ls -1 /var/run/%s/*.pid' % self.routertype)
+        self.vtysh.close()
+        pidfiles = self._pidfiles()
         errors = ""
-        if re.search(r"No such file or directory", rundaemons):
+        if not pidfiles:
             return errors
-        if rundaemons is not None:
-            numRunning = 0
-            for d in StringIO(rundaemons):
-                daemonpid = self.cmd('cat %s' % d.rstrip()).rstrip()
-                if (daemonpid.isdigit() and pid_exists(int(daemonpid))):
-                    logger.info('{}: stopping {}'.format(
-                        self.name,
-                        os.path.basename(d.rstrip().rsplit(".", 1)[0])
-                    ))
-                    self.cmd('kill -TERM %s' % daemonpid)
+        running = {}
+        for d in pidfiles:
+            daemonpid = self.cmd('cat %s' % d).rstrip()
+            if (daemonpid.isdigit() and pid_exists(int(daemonpid))):
+                self.logger.info('%s: stopping %s', self.name,
+                                 os.path.basename(d.rsplit(".", 1)[0]))
+                self.cmd('kill -TERM %s' % daemonpid)
+                self.waitOutput()
+                running[d] = int(daemonpid)
+        if wait and running:
+            # Poll for the daemons to exit instead of a fixed sleep
+            wait_for(lambda: not any(pid_exists(p) for p in running.values()),
+                     timeout=2)
+            # 2nd round of kill if daemons didn't exit
+            for d, daemonpid in running.items():
+                if pid_exists(daemonpid):
+                    self.logger.info('%s: killing %s', self.name,
+                                     os.path.basename(d.rsplit(".", 1)[0]))
+                    self.cmd('kill -7 %s' % daemonpid)
                     self.waitOutput()
-                    if pid_exists(int(daemonpid)):
-                        numRunning += 1
-            if wait and numRunning > 0:
-                sleep(2, '{}: waiting for daemons stopping'.format(self.name))
-                # 2nd round of kill if daemons didn't exit
-                for d in StringIO(rundaemons):
-                    daemonpid = self.cmd('cat %s' % d.rstrip()).rstrip()
-                    if (daemonpid.isdigit() and pid_exists(int(daemonpid))):
-                        logger.info('{}: killing {}'.format(
-                            self.name,
-                            os.path.basename(d.rstrip().rsplit(".", 1)[0])
-                        ))
-                        self.cmd('kill -7 %s' % daemonpid)
-                        self.waitOutput()
-                    self.cmd('rm -- {}'.format(d.rstrip()))
+                self.cmd('rm -- {}'.format(d))
         if wait:
                 errors = self.checkRouterCores(reportOnce=True)
                 if self.checkRouterVersion('<', minErrorVersion):
@@ -741,6 +966,36 @@ class Router(Node):
                     assert "Errors found - details follow:" == 0, errors
         return errors
 
+    def checkRouterVersion(self, cmpop, version):
+        """
+        Compares router version using operation `cmpop` with `version`.
+        Valid `cmpop` values:
+        * `>=`: has the same version or greater
+        * '>': has greater version
+        * '=': has the same version
+        * '<': has a lesser version
+        * '<=': has the same version or lesser
+
+        Usage example: router.checkRouterVersion('>', '1.0')
+        """
+        # Make sure we have version information first
+        if self.version == None:
+            self.version = self.cmd(os.path.join(self.daemondir, 'bgpd')+' -v').split()[2]
+            self.logger.info('%s: running version: %s', self.name, self.version)
+
+        result = version_cmp(self.version, version)
+        if cmpop == '>=':
+            return result >= 0
+        if cmpop == '>':
+            return result > 0
+        if cmpop == '=':
+            return result == 0
+        if cmpop == '<':
+            return result < 0
+        if cmpop == '<=':
+            return result <= 0
+        raise ValueError('invalid version comparison operator {}'.format(cmpop))
+
     def removeIPs(self):
         for interface in self.intfNames():
             self.cmd('ip address flush', interface)
@@ -772,29 +1027,48 @@ class Router(Node):
         if self.daemons['eigrpd'] == 1:
             eigrpd_path = os.path.join(self.daemondir, 'eigrpd')
             if not os.path.isfile(eigrpd_path):
-                logger.info("EIGRP Test, but no eigrpd compiled or installed")
+                self.logger.info("EIGRP Test, but no eigrpd compiled or installed")
                 return "EIGRP Test, but no eigrpd compiled or installed"
 
         if self.daemons['bfdd'] == 1:
             bfdd_path = os.path.join(self.daemondir, 'bfdd')
             if not os.path.isfile(bfdd_path):
-                logger.info("BFD Test, but no bfdd compiled or installed")
+                self.logger.info("BFD Test, but no bfdd compiled or installed")
                 return "BFD Test, but no bfdd compiled or installed"
 
         self.restartRouter(source)
         return ""
     def startRIPD(self, source=None):
-        self.cmd('cd {}/{}'.format(self.logdir, self.name))
-        self.cmd('umask 000')
-        ripd_path = os.path.join(self.daemondir, 'ripd')
-        self.cmd('{0} --config_file ./ripd.conf --pid_file ./ripd.pid -z ./zebra.api &'.format(ripd_path))
+        return self.startDaemon('ripd')
 
     def startBGPD(self, source=None):
+        return self.startDaemon('bgpd')
+
+    def startDaemon(self, daemon, wait=True, timeout=10):
+        """
+        Start a protocol daemon with ./<daemon>.conf against the running
+        zebra. With `wait`, returns once the daemon wrote its pid file.
+        """
         self.cmd('cd {}/{}'.format(self.logdir, self.name))
         self.cmd('umask 000')
-        bgpd_path = os.path.join(self.daemondir, 'bgpd')
-        self.cmd('{0} --config_file ./bgpd.conf --pid_file ./bgpd.pid -z ./zebra.api &'.format(bgpd_path))
-	
+        daemon_path = os.path.join(self.daemondir, daemon)
+        self.cmd('rm -f ./{0}.pid; {1} --config_file ./{0}.conf --pid_file ./{0}.pid -z ./zebra.api &'.format(
+            daemon, daemon_path))
+        if wait:
+            return self.waitDaemon(daemon, timeout)
+        return True
+
+    def waitDaemon(self, daemon, timeout=10):
+        "Wait until `daemon` wrote its pid file (zebra: its API socket)"
+        nodedir = '{}/{}'.format(self.logdir, self.name)
+        if daemon == 'zebra':
+            path = os.path.join(nodedir, 'zebra.api')
+        else:
+            path = os.path.join(nodedir, '{}.pid'.format(daemon))
+        if not wait_for(lambda: os.path.exists(path), timeout=timeout):
+            self.logger.error('%s: %s not up after %s seconds', self.name, daemon, timeout)
+            return False
+        return True
                 
     def restartRouter(self, source=None):
         # Starts actual daemons without init (ie restart)
@@ -806,33 +1080,30 @@ class Router(Node):
         
         if self.version == None:
             self.version = self.cmd(os.path.join(self.daemondir, 'bgpd')+' -v').split()[2]
-            logger.info('{}: running version: {}'.format(self.name,self.version))
+            self.logger.info('%s: running version: %s', self.name, self.version)
             
         # Start Zebra first
         zebra_path = os.path.join(self.daemondir, 'zebra')
-     
-        path = './'.format(self.name)
-        os.chmod(path, 0o777)
-        uid = pwd.getpwnam("frr").pw_uid
-        gid = grp.getgrnam("frr").gr_gid
-        self.cmd('pwd');
-        os.chown(path, uid, gid)  
+        # the node directory is world writable and owned by frr (lib/logdir.py)
         
-        self.cmd('cp {0}/{1}/zebra.conf ./'.format(source,self.name))
-        self.cmd('cp {0}/{1}/ripd.conf ./'.format(source,self.name))
-        self.cmd('cp {0}/{1}/bgpd.conf ./'.format(source,self.name))
+        # hand-written configs from source/<name>/, without a source they
+        # were rendered into the node directory already (lib/frrconf.py)
+        if source is not None:
+            frrconf.install_configs(frrconf.read_configs(source, [self.name]), self.logdir)
         
-        self.cmd('{0} --config_file ./zebra.conf --daemon --pid_file ./zebra.pid -z ./zebra.api &'.format(
+        self.cmd('rm -f ./zebra.api; {0} --config_file ./zebra.conf --daemon --pid_file ./zebra.pid -z ./zebra.api &'.format(
          zebra_path
         ))
         self.waitOutput()
-        logger.debug('{}: {} zebra started'.format(self, self.routertype))
+        # Other daemons need the API socket, wait for it instead of guessing
+        self.waitDaemon('zebra')
+        self.logger.debug('%s: %s zebra started', self, self.routertype)
         
 
        
        # Fix Link-Local Addresses
         # Somehow (on Mininet only), Zebra removes the IPv6 Link-Local addresses on start. Fix this
-        self.cmd('for i in `ls /sys/class/net/` ; do mac=`cat /sys/class/net/$i/address`; IFS=\':\'; set $mac; unset IFS; ip address add dev $i scope link fe80::$(printf %02x $((0x$1 ^ 2)))$2:${3}ff:fe$4:$5$6/64; done')
+        addresses.repair_linklocal([self])
         # Now start all the other daemons
         for daemon in self.daemons:
             # Skip disabled daemons and zebra
@@ -843,7 +1114,32 @@ class Router(Node):
                 daemon_path, self.daemons_options.get(daemon, ''), daemon
             ))
             self.waitOutput()
-            logger.debug('{}: {} {} started'.format(self, self.routertype, daemon))
+            self.logger.debug('%s: %s %s started', self, self.routertype, daemon)
+    def vtysh_cmd(self, command, isjson=False):
+        """
+        Runs `command` in the router's vtysh over a persistent VTY session
+        (see lib/vtysh.py). With `isjson` the output is decoded, an empty
+        dict is returned if it is not JSON.
+        """
+        return self.vtysh_batch([command], isjson)[0]
+
+    def vtysh_batch(self, commands, isjson=False):
+        """
+        Runs all `commands` in one round-trip per daemon and returns their
+        outputs in order, e.g. for polling several 'show ... json' at once.
+        """
+        outputs = self.vtysh.batch(commands)
+        if not isjson:
+            return outputs
+        result = []
+        for command, output in zip(commands, outputs):
+            try:
+                result.append(json.loads(output))
+            except ValueError:
+                self.logger.warning('%s: "%s" returned no JSON', self.name, command)
+                result.append({})
+        return result
+
     def getStdErr(self, daemon):
         return self.getLog('err', daemon)
     def getStdOut(self, daemon):
@@ -854,68 +1150,27 @@ class Router(Node):
 
 
     def checkRouterCores(self, reportLeaks=True, reportOnce=False):
+        """
+        Looks for core files, memory leaks and AddressSanitizer errors of the
+        daemons (see lib/crashreport.py). The findings are kept in
+        `self.crash_report`, returns them as text ("" if there are none).
+        """
         if reportOnce and not self.reportCores:
-            return
-        reportMade = False
-        traces = ""
-        for daemon in self.daemons:
-            if (self.daemons[daemon] == 1):
-                # Look for core file
-                corefiles = glob.glob('{}/{}/{}_core*.dmp'.format(
-                    self.logdir, self.name, daemon))
-                if (len(corefiles) > 0):
-                    daemon_path = os.path.join(self.daemondir, daemon)
-                    backtrace = subprocess.check_output([
-                        "gdb {} {} --batch -ex bt 2> /dev/null".format(daemon_path, corefiles[0])
-                    ], shell=True)
-                    sys.stderr.write("\n%s: %s crashed. Core file found - Backtrace follows:\n" % (self.name, daemon))
-                    sys.stderr.write("%s" % backtrace)
-                    traces = traces + "\n%s: %s crashed. Core file found - Backtrace follows:\n%s" % (self.name, daemon, backtrace)
-                    reportMade = True
-                elif reportLeaks:
-                    log = self.getStdErr(daemon)
-                    if "memstats" in log:
-                        sys.stderr.write("%s: %s has memory leaks:\n" % (self.name, daemon))
-                        traces = traces + "\n%s: %s has memory leaks:\n" % (self.name, daemon)
-                        log = re.sub("core_handler: ", "", log)
-                        log = re.sub(r"(showing active allocations in memory group [a-zA-Z0-9]+)", r"\n  ## \1", log)
-                        log = re.sub("memstats:  ", "    ", log)
-                        sys.stderr.write(log)
-                        reportMade = True
-                # Look for AddressSanitizer Errors and append to /tmp/AddressSanitzer.txt if found
-                if checkAddressSanitizerError(self.getStdErr(daemon), self.name, daemon):
-                    sys.stderr.write("%s: Daemon %s killed by AddressSanitizer" % (self.name, daemon))
-                    traces = traces + "\n%s: Daemon %s killed by AddressSanitizer" % (self.name, daemon)
-                    reportMade = True
-        if reportMade:
+            return ""
+        report = crashreport.analyze([self], leaks=reportLeaks)
+        self.crash_report = report[self.name]
+        traces = crashreport.format_report(report)
+        if traces:
+            sys.stderr.write(traces)
+            crashreport.write_asan_log(report)
             self.reportCores = False
         return traces
 
    
     def get_ipv6_linklocal(self):
         "Get LinkLocal Addresses from interfaces"
+        return addresses.linklocal(self)
 
-        linklocal = []
-
-        ifaces = self.cmd('ip -6 address')
-        # Fix newlines (make them all the same)
-        ifaces = ('\n'.join(ifaces.splitlines()) + '\n').splitlines()
-        interface=""
-        ll_per_if_count=0
-        for line in ifaces:
-            m = re.search('[0-9]+: ([^:@]+)[@if0-9:]+ <', line)
-            if m:
-                interface = m.group(1)
-                ll_per_if_count = 0
-            m = re.search('inet6 (fe80::[0-9a-f]+:[0-9a-f]+:[0-9a-f]+:[0-9a-f]+)[/0-9]* scope link', line)
-            if m:
-                local = m.group(1)
-                ll_per_if_count += 1
-                if (ll_per_if_count > 1):
-                    linklocal += [["%s-%s" % (interface, ll_per_if_count), local]]
-                else:
-                    linklocal += [[interface, local]]
-        return linklocal
     def daemon_available(self, daemon):
         "Check if specified daemon is installed (and for ldp if kernel supports MPLS)"
 
@@ -945,8 +1200,8 @@ class Router(Node):
                 log = self.getStdErr(daemon)
                 if "memstats" in log:
                     # Found memory leak
-                    logger.info('\nRouter {} {} StdErr Log:\n{}'.format(
-                        self.name, daemon, log))
+                    self.logger.info('\nRouter %s %s StdErr Log:\n%s',
+                                     self.name, daemon, log)
                     if not leakfound:
                         leakfound = True
                         # Check if file already exists
@@ -0,0 +1,226 @@
+#
+# vtysh.py
+# Persistent VTY socket sessions to the daemons of a router
+#
+# Copyright (c) 2017 by
+# Network Device Education Foundation, Inc. ("NetDEF")
+#
+# Permission to use, copy, modify, and/or distribute this software
+# for any purpose with or without fee is hereby granted, provided
+# that the above copyright notice and this permission notice appear
+# in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND NETDEF DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL NETDEF BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY
+# DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS,
+# WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+
+"""
+VTY session pool.
+
+vtysh itself is a thin client: it connects to the '<daemon>.vty' unix
+socket of every daemon, writes the command terminated by a NUL byte and
+reads the output up to a '\\0\\0\\0<status>' trailer. VtyshPool does the
+same from the test process, keeps one connection per daemon open for the
+lifetime of the router and pipelines commands: a batch is written in one
+go per daemon and the replies are read back in order.
+
+The sockets live in the router's private /var/run/frr, which the test
+process reaches through /proc/<node pid>/root. Commands that go to more
+than one daemon or that are not 'show' commands (configuration, 'write',
+...) fall back to a one-shot 'vtysh -c' in the node, as does a command the
+guessed daemon does not know.
+
+    pool = VtyshPool(router)
+    routes, rip = pool.batch(['show ip route json', 'show ip rip status'])
+"""
+
+import socket
+import threading
+
+from lib.topolog import logger
+
+# Command prefix -> daemon answering it, first match wins. Other 'show'
+# commands go to zebra.
+DAEMON_COMMANDS = [
+    ('show ip rip', 'ripd'),
+    ('show ipv6 ripng', 'ripngd'),
+    ('show ip bgp', 'bgpd'),
+    ('show ipv6 bgp', 'bgpd'),
+    ('show bgp', 'bgpd'),
+    ('show ip ospf', 'ospfd'),
+    ('show ipv6 ospf6', 'ospf6d'),
+    ('show isis', 'isisd'),
+    ('show ip pim', 'pimd'),
+    ('show ip igmp', 'pimd'),
+    ('show ip msdp', 'pimd'),
+    ('show mpls ldp', 'ldpd'),
+    ('show l2vpn', 'ldpd'),
+    ('show ip eigrp', 'eigrpd'),
+    ('show ip nhrp', 'nhrpd'),
+    ('show bfd', 'bfdd'),
+]
+
+# 'show' commands every daemon answers, vtysh merges their outputs
+MULTI_DAEMON_COMMANDS = ('show running-config', 'show run', 'show version',
+                         'show memory', 'show thread', 'show logging',
+                         'show debugging', 'show modules')
+
+# Return codes of lib/command.h
+CMD_SUCCESS = 0
+CMD_ERR_NO_MATCH = 2
+CMD_ERR_AMBIGUOUS = 3
+CMD_ERR_INCOMPLETE = 4
+
+TIMEOUT = 30
+RECV_SIZE = 65536
+
+
+def command_daemon(cmd):
+    "The daemon answering `cmd` alone, None if it needs vtysh"
+    cmd = ' '.join(cmd.split())
+    if '\n' in cmd or not cmd.startswith('show '):
+        return None
+    if cmd.startswith(MULTI_DAEMON_COMMANDS):
+        return None
+    for prefix, daemon in DAEMON_COMMANDS:
+        if cmd == prefix or cmd.startswith(prefix + ' '):
+            return daemon
+    return 'zebra'
+
+
+class VtyError(Exception):
+    "The VTY socket of a daemon failed"
+
+
+class VtyConnection(object):
+    "One connection to a daemon's VTY socket"
+
+    def __init__(self, path, timeout=TIMEOUT):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(path)
+        except OSError:
+            self.sock.close()
+            raise
+        self.buf = b''
+        # vtysh sessions start in the view node
+        self.execute(['enable'])
+
+    def send(self, cmds):
+        "Write all `cmds` at once"
+        self.sock.sendall(b''.join(cmd.encode() + b'\0' for cmd in cmds))
+
+    def receive(self, count):
+        "Read the replies of `count` sent commands: [(status, output)]"
+        replies = []
+        while len(replies) < count:
+            end = self.buf.find(b'\0\0\0')
+            if end >= 0 and len(self.buf) >= end + 4:
+                replies.append((self.buf[end + 3], self.buf[:end].decode(errors='replace')))
+                self.buf = self.buf[end + 4:]
+                continue
+            data = self.sock.recv(RECV_SIZE)
+            if not data:
+                raise VtyError('{}: connection closed'.format(self.path))
+            self.buf += data
+        return replies
+
+    def execute(self, cmds):
+        "Pipeline `cmds`, returns [(status, output)]"
+        self.send(cmds)
+        return self.receive(len(cmds))
+
+    def close(self):
+        self.sock.close()
+
+
+class VtyshPool(object):
+    """
+    Per-router VTY sessions, one per daemon, created on first use and
+    re-created once when a daemon was restarted. Thread safe: commands to
+    the same daemon are serialized, different daemons run concurrently.
+    """
+
+    def __init__(self, router, rundir=None):
+        self.router = router
+        self.rundir = rundir
+        self.sessions = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def _path(self, daemon):
+        rundir = self.rundir or '/var/run/{}'.format(self.router.routertype)
+        return '/proc/{}/root{}/{}.vty'.format(self.router.pid, rundir, daemon)
+
+    def _daemon_lock(self, daemon):
+        with self.lock:
+            return self.locks.setdefault(daemon, threading.Lock())
+
+    def _execute(self, daemon, cmds):
+        "Run `cmds` on `daemon`, None if there is no usable session"
+        for attempt in range(2):
+            session = self.sessions.get(daemon)
+            try:
+                if session is None:
+                    session = self.sessions[daemon] = VtyConnection(self._path(daemon))
+                return session.execute(cmds)
+            except (OSError, VtyError) as error:
+                self.sessions.pop(daemon, None)
+                if session is not None:
+                    session.close()
+                if attempt:
+                    logger.debug('%s: no VTY session to %s: %s',
+                                 self.router.name, daemon, error)
+        return None
+
+    def _vtysh(self, cmd):
+        "One-shot vtysh in the node"
+        args = ' '.join('-c "{}"'.format(line.strip().replace('"', '\\"'))
+                        for line in cmd.splitlines() if line.strip())
+        return self.router.cmd('vtysh {} 2>/dev/null'.format(args))
+
+    def batch(self, cmds):
+        """
+        Run `cmds` and return their outputs in order. Commands are grouped
+        by daemon, each group is pipelined over its session.
+        """
+        outputs = [None] * len(cmds)
+        groups = {}
+        for i, cmd in enumerate(cmds):
+            daemon = command_daemon(cmd)
+            if daemon is not None:
+                groups.setdefault(daemon, []).append(i)
+        for daemon, indexes in groups.items():
+            with self._daemon_lock(daemon):
+                replies = self._execute(daemon, [cmds[i] for i in indexes])
+            if replies is None:
+                continue
+            for i, (status, output) in zip(indexes, replies):
+                if status not in (CMD_ERR_NO_MATCH, CMD_ERR_AMBIGUOUS, CMD_ERR_INCOMPLETE):
+                    outputs[i] = output
+        for i, output in enumerate(outputs):
+            if output is None:
+                outputs[i] = self._vtysh(cmds[i])
+        return outputs
+
+    def cmd(self, cmd):
+        "Run one command, returns its output"
+        return self.batch([cmd])[0]
+
+    def close(self):
+        "Close all sessions, each after the commands running on it"
+        with self.lock:
+            daemons = list(self.locks)
+        for daemon in daemons:
+            with self._daemon_lock(daemon):
+                session = self.sessions.pop(daemon, None)
+                if session is not None:
+                    session.close()
@@ -27,6 +27,7 @@ test_rip_topo1.py: Testing RIPv2
 
 """
 
+import argparse
 import os
 import re
 import sys
@@ -45,6 +46,12 @@ from functools import partial
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from lib import topotest
 import lib.topotest 
+from lib.lifecycle import RouterLifecycle
+from lib.frrconf import FrrConfigRenderer
+from lib.refstore import RefStore
+from lib.convergence import ConvergenceWaiter, RouteTrigger
+from lib.topolog import logger
+from rnlib import cleanup
 fatal_error = ""
 
 
@@ -67,8 +74,13 @@ class NetworkTopo(Topo):
         #router[4] = topotest.addRouter(self, 'r1')
         #
         # Setup RIP Routers
+        # r3 redistributes its stub net and a static route into RIP (the
+        # router params and link addresses are used by lib/frrconf.py, they
+        # are the same as in the rX/*.conf files)
+        params = {3: {'static_routes': ['192.168.2.0/24 192.168.3.10'],
+                      'rip_redistribute': ['connected', 'static']}}
         for i in range(2, 5):
-            router[i] = topotest.addRouter(self, 'r%s' % i)
+            router[i] = topotest.addRouter(self, 'r%s' % i, **params.get(i, {}))
         #
         # Setup Switches
         switch = {}
@@ -76,74 +88,122 @@ class NetworkTopo(Topo):
         # On main router
         # First switch is for a dummy interface (for local network)
         switch[1] = self.addSwitch('sw1', cls=topotest.LegacySwitch)
-        self.addLink(switch[1], router[1], intfName2='r1-eth0')
+        self.addLink(switch[1], router[1], intfName2='r1-eth0',
+                     params2={'ip': '192.168.1.1/24'})
         #
         # Switches for RIP
         # switch 2 switch is for connection to RIP router
         switch[2] = self.addSwitch('sw2', cls=topotest.LegacySwitch)
-        self.addLink(switch[2], router[1], intfName2='r1-eth1')
-        self.addLink(switch[2], router[2], intfName2='r2-eth0')
+        self.addLink(switch[2], router[1], intfName2='r1-eth1',
+                     params2={'ip': '193.1.1.1/26'})
+        self.addLink(switch[2], router[2], intfName2='r2-eth0',
+                     params2={'ip': '193.1.1.2/26'})
         # switch 3 is between RIP routers
         switch[3] = self.addSwitch('sw3', cls=topotest.LegacySwitch)
-        self.addLink(switch[3], router[2], intfName2='r2-eth1')
-        self.addLink(switch[3], router[3], intfName2='r3-eth1')
+        self.addLink(switch[3], router[2], intfName2='r2-eth1',
+                     params2={'ip': '193.1.2.1/24'})
+        self.addLink(switch[3], router[3], intfName2='r3-eth1',
+                     params2={'ip': '193.1.2.2/24'})
         # switch 4 is stub on remote RIP router
         switch[4] = self.addSwitch('sw4', cls=topotest.LegacySwitch)
-        self.addLink(switch[4], router[3], intfName2='r3-eth0')
+        self.addLink(switch[4], router[3], intfName2='r3-eth0',
+                     params2={'ip': '192.168.3.1/24'})
         
-        self.addLink(switch[2], router[4], intfName2='r4-eth0')
-        self.addLink(switch[3], router[4], intfName2='r4-eth1')
+        self.addLink(switch[2], router[4], intfName2='r4-eth0',
+                     params2={'ip': '193.1.1.4/26'})
+        self.addLink(switch[3], router[4], intfName2='r4-eth1',
+                     params2={'ip': '193.1.2.4/24'})
 #####################################################
 ##
 ##   Tests starting
 ##
 #####################################################
 
-def startRIPD(net):
-    thisDir = os.path.dirname(os.path.realpath(__file__))
-
+def startRIPD(lifecycle):
     print("******** Start RIPD *************\n")   
-    for i in range(1, 5):
-        net['r%s' % i].startRIPD(thisDir)
-
-def startBGPD(net):
+    lifecycle.start_daemons(['ripd'])
+
+def expectedRIPRoutes(refs, name):
+    "Kernel routes ip4_route() should show, taken from rX/show_ip_route.ref"
+    records = refs.get(name, 'show_ip_route')
+    if not records:
+        return None
+    return dict((prefix, {'via': record['nexthops'][0]['via'],
+                          'dev': record['nexthops'][0]['dev']})
+                for prefix, record in records.items() if record['protocol'] == 'R')
+
+def waitRIPConvergence(net):
+    "Wait until the RIP routes match the references, False if some never did"
     thisDir = os.path.dirname(os.path.realpath(__file__))
 
-    print("******** Start BGP *************\n")   
+    print("******** Waiting for RIP convergence *************\n")   
+    refs = RefStore(thisDir)
+    expected = {}
     for i in range(1, 5):
-        net['r%s' % i].startBGPD(thisDir)
+        routes = expectedRIPRoutes(refs, 'r%s' % i)
+        if routes:
+            expected['r%s' % i] = routes
+    def ripRoutesCheck(router):
+        return lambda: topotest.json_cmp(topotest.ip4_route(router), expected[router.name])
+
+    # Re-check on every netlink route change, not every few seconds
+    waiter = ConvergenceWaiter(timeout=180)
+    results = waiter.wait_routers([net[name] for name in expected], ripRoutesCheck, None,
+                                  trigger=RouteTrigger)
+    waiter.report()
+    failed = [name for name, (ok, _) in results.items() if not ok]
+    for name in failed:
+        logger.error('%s: RIP routes differ from %s/show_ip_route.ref:\n%s',
+                     name, name, results[name][1])
+    return not failed
+
+def startBGPD(lifecycle):
+    print("******** Start BGP *************\n")   
+    lifecycle.start_daemons(['bgpd'])
   
           
         
-def run():
+def run(render=False):
     topo = NetworkTopo()
     print("******************************************\n")
 
     print("Cleanup old Mininet runs")
-    os.system('sudo mn -c > /dev/null 2>&1')
+    cleanup.reap_previous('topo03')
 
     thisDir = os.path.dirname(os.path.realpath(__file__))
 
     net = Mininet(controller=None, topo=topo)
     net.start()
+    # the log directories are kept per run by topotest.logdirs, not reaped
+    manifest = cleanup.RunManifest.record('topo03', net)
 
-    # Starting Routers
+    # Starting Routers, all of them in parallel
     #
-    for i in range(1, 5):
-        net['r%s' % i].startRouter(thisDir)
+    lifecycle = RouterLifecycle([net['r%s' % i] for i in range(1, 5)])
+    # the hand-written rX/*.conf files or configs rendered from the topology
+    lifecycle.start_routers(FrrConfigRenderer(topo) if render else thisDir)
+    topotest.logdirs.start_rotation()
     print("******** Router up and running *************\n")   
     CLI(net) 
-    startRIPD(net)
-    startBGPD(net)
+    startRIPD(lifecycle)
+    if not waitRIPConvergence(net):
+        print("******** RIP did not converge, see the errors above *************\n")
+    startBGPD(lifecycle)
     CLI(net)
     print("\n\n** %s: Shutdown Topology")
     print("******************************************\n")
 
-    for i in range(1, 5):
-        net['r%s' % i].stopRouter()
+    lifecycle.stop_routers()
     # End - Shutdown network
     net.stop()
+    # leftovers net.stop() does not know about
+    manifest.reap()
+    topotest.logdirs.stop()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='RIP/BGP topology with 4 routers')
+    parser.add_argument('--render', action='store_true',
+                        help='render the FRR configs from the topology instead of rX/*.conf')
+    args = parser.parse_args()
     setLogLevel('info')
-    run()
+    run(render=args.render)
@@ -3,6 +3,11 @@ from mininet.net import Mininet
 from mininet.node import Controller, RemoteController, Node
 from mininet.cli import CLI
 from mininet.log import setLogLevel
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rnlib import telemetry
 
 class MyTopo(Topo):
     def build(self):
@@ -51,7 +56,11 @@ if __name__ == '__main__':
     
     configureRouter(net) 
 
+    # Interface and qdisc counters of hosts, router and the OVS switches
+    sampler = telemetry.Sampler(net).start()
+    telemetry.install_cli(sampler)
     CLI(net)
+    sampler.stop()
 
     net.stop()
 